@@ -6,9 +6,9 @@ import dbus
 import argparse
 import sys
 import os
-import json
 import time
 import re
+import signal
 from gi.repository import GLib
 
 # Victron packages
@@ -19,10 +19,63 @@ from dbusmonitor import DbusMonitor
 from settingsdevice import SettingsDevice
 from logger import setup_logging
 import delegates
-from sc_utils import safeadd as _safeadd, safemax as _safemax
+from delegates.base import SystemCalcDelegate
+from sc_utils import safeadd as _safeadd, safemax as _safemax, ContentCache
+from settingscache import WriteBehindSettings
+from persist import PersistentStore
+from publisher import TrackedService
+from shmexport import ShmExport, DEFAULT_PATH as SHM_PATH
+from streamserver import StreamServer, DEFAULT_PATH as STREAM_PATH
 
 softwareVersion = '2.138'
 
+def _service_class(service):
+	return '.'.join(service.split('.')[:3])
+
+class PushedDelegate(object):
+	""" Calls on_paths_changed of a delegate that implements it with what
+	    changed of what it depends on, or skips it if nothing did. """
+	def __init__(self, delegate, dbusservice, summeditems):
+		self.delegate = delegate
+		self._dbusservice = dbusservice
+		self._inputs = {}
+		for service, paths in delegate.get_input():
+			self._inputs.setdefault(service, set()).update(paths)
+
+		# Calculated values are compared to the ones of the last update,
+		# values published directly go by their version.
+		upstream = delegate.get_upstream()
+		self._calculated = {p: None for p in upstream if p in summeditems}
+		self._published = [p for p in upstream if p not in summeditems]
+		self._seq = dbusservice.seq
+
+		self._outputs = [p for p, _ in delegate.get_output()]
+		self._values = {}
+
+	def update_values(self, newvalues, inputs):
+		""" inputs holds the (service, path) of the inputs of all pushed
+		    delegates that changed since the last update, or is None if
+		    everything should be looked at again. """
+		changed = None
+		if inputs is not None:
+			changed = {(s, p) for s, p in inputs
+				if p in self._inputs.get(_service_class(s), ())}
+			changed.update(p for p, v in self._calculated.items()
+				if newvalues.get(p) != v)
+			versions = self._dbusservice.versions
+			changed.update(p for p in self._published
+				if (versions.get(p) or (0,))[0] > self._seq)
+
+		self._calculated = {p: newvalues.get(p) for p in self._calculated}
+		self._seq = self._dbusservice.seq
+
+		if changed is not None and not changed:
+			newvalues.update(self._values)
+			return
+
+		self.delegate.on_paths_changed(newvalues, changed)
+		self._values = {p: newvalues[p] for p in self._outputs if p in newvalues}
+
 class SystemCalc:
 	STATE_IDLE = 0
 	STATE_CHARGING = 1
@@ -174,6 +227,7 @@ class SystemCalc:
 		}
 
 		self._modules = [
+			delegates.EventScheduler(),
 			delegates.Multi(),
 			delegates.HubTypeSelect(),
 			delegates.VebusSocWriter(),
@@ -197,13 +251,23 @@ class SystemCalc:
 			delegates.PvInverters(),
 			delegates.BatteryService(self),
 			delegates.CanBatterySense(),
-			delegates.DynamicEss()]
-
+			delegates.DynamicEss(),
+			delegates.EnergyCounters(),
+			delegates.History()]
+
+		# Changes to the inputs of delegates that implement on_paths_changed
+		# are collected in _dirty between updates. _pushedinputs holds these
+		# inputs by service class.
+		self._dirty = set()
+		self._pushedinputs = {}
 		for m in self._modules:
+			pushed = type(m).on_paths_changed is not SystemCalcDelegate.on_paths_changed
 			for service, paths in m.get_input():
 				s = dbus_tree.setdefault(service, {})
 				for path in paths:
 					s[path] = dummy
+				if pushed:
+					self._pushedinputs.setdefault(service, set()).update(paths)
 
 		self._dbusmonitor = self._create_dbus_monitor(dbus_tree, valueChangedCallback=self._dbus_value_changed,
 			deviceAddedCallback=self._device_added, deviceRemovedCallback=self._device_removed)
@@ -218,9 +282,11 @@ class SystemCalc:
 			for setting in m.get_settings():
 				supported_settings[setting[0]] = list(setting[1:])
 
-		self._settings = self._create_settings(supported_settings, self._handlechangedsetting)
+		self._settings = WriteBehindSettings(
+			self._create_settings(supported_settings, self._handlechangedsetting))
 
-		self._dbusservice = self._create_dbus_service()
+		self._dbusservice = TrackedService(self._create_dbus_service())
+		self._published = ContentCache(self._dbusservice)
 
 		for m in self._modules:
 			m.set_sources(self._dbusmonitor, self._settings, self._dbusservice)
@@ -314,6 +380,13 @@ class SystemCalc:
 		for path in self._summeditems.keys():
 			self._dbusservice.add_path(path, value=None, gettextcallback=self._gettext)
 
+		# Delegates that implement on_paths_changed only run when something
+		# they depend on changed.
+		self._pushed = {m: PushedDelegate(m, self._dbusservice, self._summeditems)
+			for m in self._modules
+			if type(m).on_paths_changed is not SystemCalcDelegate.on_paths_changed}
+		self._reconsider = True
+
 		self._batteryservice = None
 		self._determinebatteryservice()
 
@@ -339,9 +412,22 @@ class SystemCalc:
 	def _create_dbus_service(self):
 		raise Exception("This function should be overridden")
 
+	def export_values(self, path=SHM_PATH):
+		""" Keep a copy of the published values in a memory mapped file,
+		    see shmexport. """
+		self._dbusservice.add_listener(ShmExport(self._dbusservice, path))
+
+	def stream_values(self, path=STREAM_PATH):
+		""" Stream the changes of the published values to the clients of
+		    a unix domain socket, see streamserver. """
+		server = StreamServer(self._dbusservice, path)
+		self._dbusservice.add_listener(server)
+		return server
+
 	def _handlechangedsetting(self, setting, oldvalue, newvalue):
 		self._determinebatteryservice()
 		self._changed = True
+		self._reconsider = True
 
 		# Give our delegates a chance to react on a settings change
 		for m in self._modules:
@@ -408,6 +494,7 @@ class SystemCalc:
 
 			# Battery service has changed. Notify delegates.
 			self._dbusservice['/Dc/Battery/BatteryService'] = self._batteryservice = newbatteryservice
+			self._reconsider = True
 			for m in self._modules:
 				m.battery_service_changed(auto_selected, self._batteryservice, newbatteryservice)
 
@@ -771,20 +858,16 @@ class SystemCalc:
 			newvalues['/Dc/System/Power'] = solarchargers_loadoutput_power
 
 		# ==== Vebus ====
+		# Read once, the Multi delegate publishes the same for every system
+		snapshots = delegates.Multi.instance.take_snapshots()
 		multi_path = getattr(delegates.Multi.instance.multi, 'service', None)
-		if multi_path is not None:
-			dc_current = self._dbusmonitor.get_value(multi_path, '/Dc/0/Current')
-			newvalues['/Dc/Vebus/Current'] = dc_current
-			dc_power = self._dbusmonitor.get_value(multi_path, '/Dc/0/Power')
-			# Just in case /Dc/0/Power is not available
-			if dc_power == None and dc_current is not None:
-				dc_voltage = self._dbusmonitor.get_value(multi_path, '/Dc/0/Voltage')
-				if dc_voltage is not None:
-					dc_power = dc_voltage * dc_current
+		multi = snapshots.get(multi_path)
+		if multi is not None:
+			newvalues['/Dc/Vebus/Current'] = multi.dc_current
 			# Note that there is also vebuspower, which is the total DC power summed over all multis.
 			# However, this value cannot be combined with /Dc/Multi/Current, because it does not make sense
 			# to add the Dc currents of all multis if they do not share the same DC voltage.
-			newvalues['/Dc/Vebus/Power'] = dc_power
+			newvalues['/Dc/Vebus/Power'] = multi.dc_power
 
 		# ===== AC IN SOURCE =====
 		ac_in_source = None
@@ -799,13 +882,8 @@ class SystemCalc:
 				else:
 					ac_in_source = 240
 		else:
-			active_input = self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/ActiveInput')
-			if active_input == 0xF0:
-				# Not connected
-				ac_in_source = 240
-			elif active_input is not None:
-				settings_path = '/Settings/SystemSetup/AcInput%s' % (active_input + 1)
-				ac_in_source = self._dbusmonitor.get_value('com.victronenergy.settings', settings_path)
+			active_input = multi.active_input
+			ac_in_source = multi.ac_in_source
 		newvalues['/Ac/ActiveIn/Source'] = ac_in_source
 
 		# ===== GRID METERS & CONSUMPTION ====
@@ -846,10 +924,11 @@ class SystemCalc:
 					c = None
 					cc = None
 					if uses_active_input:
-						if multi_path is not None:
+						if multi is not None:
+							p_in, i_in = multi.ac_in[phase]
 							try:
-								c = _safeadd(c, -self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/%s/P' % phase))
-								cc = _safeadd(cc, -self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/%s/I' % phase))
+								c = _safeadd(c, -p_in)
+								cc = _safeadd(cc, -i_in)
 							except TypeError:
 								pass
 						elif non_vebus_inverter is not None and active_input in (0, 1):
@@ -868,11 +947,10 @@ class SystemCalc:
 					currentconsumption[phase] = _safeadd(currentconsumption[phase], _safemax(0, cc))
 				else:
 					if uses_active_input:
-						if multi_path is not None  and (
-								p := self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/%s/P' % phase)) is not None:
+						if multi is not None and (ac_in := multi.ac_in[phase])[0] is not None:
+							p, mc = ac_in
 							consumption[phase] = _safeadd(0, consumption[phase])
 							currentconsumption[phase] = _safeadd(0, currentconsumption[phase])
-							mc = self._dbusmonitor.get_value(multi_path, '/Ac/ActiveIn/%s/I' % phase)
 						elif non_vebus_inverter is not None and active_input in (0, 1):
 							p = self._dbusmonitor.get_value(non_vebus_inverter, '/Ac/In/%d/%s/P' % (active_input + 1, phase))
 							mc = self._dbusmonitor.get_value(non_vebus_inverter, '/Ac/In/%d/%s/I' % (active_input + 1, phase))
@@ -939,9 +1017,8 @@ class SystemCalc:
 						c = _safeadd(c, ac_out)
 						a = _safeadd(a, i)
 				else:
-					ac_out = self._dbusmonitor.get_value(multi_path, '/Ac/Out/%s/P' % phase)
+					ac_out, i_out = multi.ac_out[phase]
 					c = _safeadd(c, ac_out)
-					i_out = self._dbusmonitor.get_value(multi_path, '/Ac/Out/%s/I' % phase)
 					a = _safeadd(a, i_out)
 				c = _safemax(0, c)
 				a = _safemax(0, a)
@@ -955,8 +1032,14 @@ class SystemCalc:
 		self._compute_number_of_phases('/Ac/ConsumptionOnOutput', newvalues)
 		self._compute_number_of_phases('/Ac/ConsumptionOnInput', newvalues)
 
+		changed = None if self._reconsider else self._dirty
+		self._dirty = set()
+		self._reconsider = False
 		for m in self._modules:
-			m.update_values(newvalues)
+			if m in self._pushed:
+				self._pushed[m].update_values(newvalues, changed)
+			else:
+				m.update_values(newvalues)
 
 		# ==== UPDATE DBUS ITEMS ====
 		with self._dbusservice as sss:
@@ -965,6 +1048,9 @@ class SystemCalc:
 				sss[path] = newvalues.get(path, None)
 
 	def _handleservicechange(self):
+		# Devices came or went, have all delegates look again
+		self._reconsider = True
+
 		# Update the available battery monitor services, used to populate the dropdown in the settings.
 		# Below code makes a dictionary. The key is [dbuserviceclass]/[deviceinstance]. For example
 		# "battery/245". The value is the name to show to the user in the dropdown. The full dbus-
@@ -978,19 +1064,19 @@ class SystemCalc:
 		services.update({k: v for k, v in self._get_connected_service_list(
 			'com.victronenergy.inverter').items() if self._dbusmonitor.get_value(k, '/Soc') is not None})
 
+		names = {self._get_instance_service_name(servicename, instance):
+			self._get_readable_service_name(servicename) for servicename, instance in services.items()}
+
 		ul = {self.BATSERVICE_DEFAULT: 'Automatic', self.BATSERVICE_NOBATTERY: 'No battery monitor'}
-		for servicename, instance in services.items():
-			key = self._get_instance_service_name(servicename, instance)
-			ul[key] = self._get_readable_service_name(servicename)
-		self._dbusservice['/AvailableBatteryServices'] = json.dumps(ul)
+		ul.update(names)
+		self._published.set_json('/AvailableBatteryServices', ul)
 
 		ul = {self.BATSERVICE_DEFAULT: 'Automatic', self.BATSERVICE_NOBATTERY: 'No battery monitor'}
 		# For later: for device supporting multiple Dc measurement we should add entries for /Dc/1 etc as
 		# well.
-		for servicename, instance in services.items():
-			key = self._get_instance_service_name(servicename, instance).replace('.', '_').replace('/', '_') + '/Dc/0'
-			ul[key] = self._get_readable_service_name(servicename)
-		self._dbusservice['/AvailableBatteryMeasurements'] = ul
+		for key, name in names.items():
+			ul[key.replace('.', '_').replace('/', '_') + '/Dc/0'] = name
+		self._published.set('/AvailableBatteryMeasurements', ul)
 
 		self._determinebatteryservice()
 
@@ -1017,6 +1103,9 @@ class SystemCalc:
 
 	def _dbus_value_changed(self, dbusServiceName, dbusPath, dict, changes, deviceInstance):
 		self._changed = True
+		self._dbusservice.inputs.touch((dbusServiceName, dbusPath))
+		if dbusPath in self._pushedinputs.get(_service_class(dbusServiceName), ()):
+			self._dirty.add((dbusServiceName, dbusPath))
 
 		# Workaround because com.victronenergy.vebus is available even when there is no vebus product
 		# connected.
@@ -1040,6 +1129,8 @@ class SystemCalc:
 
 	def _device_removed(self, service, instance):
 		self._handleservicechange()
+		inputs = self._dbusservice.inputs
+		inputs.discard([k for k, _ in inputs.items() if k[0] == service])
 
 		for m in self._modules:
 			m.device_removed(service, instance)
@@ -1129,6 +1220,10 @@ if __name__ == "__main__":
 
 	parser.add_argument("-d", "--debug", help="set logging level to debug",
 					action="store_true")
+	parser.add_argument("--export", metavar="PATH", nargs="?", const=SHM_PATH,
+					help="export the values to a memory mapped file, default %s" % SHM_PATH)
+	parser.add_argument("--stream", metavar="PATH", nargs="?", const=STREAM_PATH,
+					help="stream the values on a unix domain socket, default %s" % STREAM_PATH)
 
 	args = parser.parse_args()
 
@@ -1139,8 +1234,19 @@ if __name__ == "__main__":
 	DBusGMainLoop(set_as_default=True)
 
 	systemcalc = DbusSystemCalc()
+	if args.export:
+		systemcalc.export_values(args.export)
+	if args.stream:
+		systemcalc.stream_values(args.stream)
 
 	# Start and run the mainloop
 	logger.info("Starting mainloop, responding only on events")
 	mainloop = GLib.MainLoop()
+	for signum in (signal.SIGTERM, signal.SIGINT):
+		GLib.unix_signal_add(GLib.PRIORITY_HIGH, signum, mainloop.quit)
 	mainloop.run()
+
+	# Keep what was accumulated since the last copy, and settings that
+	# were not written out yet
+	PersistentStore.sync_all()
+	systemcalc._settings.flush()
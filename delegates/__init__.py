@@ -4,6 +4,7 @@
 from delegates.base import SystemCalcDelegate
 
 # All delegates
+from delegates.eventscheduler import EventScheduler
 from delegates.hubtype import HubTypeSelect
 from delegates.dvcc import Dvcc
 from delegates.servicemapper import ServiceMapper
@@ -28,3 +29,5 @@ from delegates.pvinverter import PvInverters
 from delegates.batteryservice import BatteryService
 from delegates.canbatterysense import CanBatterySense
 from delegates.dynamicess import DynamicEss
+from delegates.energy import EnergyCounters
+from delegates.history import History
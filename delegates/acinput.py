@@ -46,7 +46,15 @@ class AcInputs(SystemCalcDelegate):
 	def get_input(self):
 		return [('com.victronenergy.multi', [
 				'/Ac/ActiveIn/ActiveInput',
-				'/Ac/NumberOfAcInputs'])]
+				'/Ac/NumberOfAcInputs',
+				'/Ac/In/1/Type',
+				'/Ac/In/2/Type']),
+			('com.victronenergy.vebus', [
+				'/Ac/ActiveIn/ActiveInput',
+				'/Ac/NumberOfAcInputs']),
+			('com.victronenergy.settings', [
+				'/Settings/SystemSetup/AcInput1',
+				'/Settings/SystemSetup/AcInput2'])]
 
 	def get_output(self):
 		return [('/Ac/In/0/ServiceName', {'gettext': '%s'}),
@@ -64,6 +72,9 @@ class AcInputs(SystemCalcDelegate):
 				('/Ac/In/NumberOfAcInputs', {'gettext': '%d'}),
 		]
 
+	def get_upstream(self):
+		return ['/VebusService']
+
 	def device_added(self, service, instance, *args):
 		# Look for grid and genset
 		if service.startswith('com.victronenergy.grid.'):
@@ -116,7 +127,7 @@ class AcInputs(SystemCalcDelegate):
 			'/Ac/In/{}/Connected'.format(inp): active
 		}
 
-	def update_values(self, newvalues):
+	def on_paths_changed(self, newvalues, changed):
 		multi = Multi.instance.multi or self.invertercharger
 		number_of_inputs = getattr(multi, 'number_of_inputs', None) or 0
 		source_count = 0
@@ -60,9 +60,30 @@ class SystemCalcDelegate(object, metaclass=TrackInstance):
 		    that event by implementing battery_monitor_changed. """
 		pass
 
+	def get_upstream(self):
+		"""Delegates that implement on_paths_changed should return the paths of com.victronenergy.system
+		they read, other than their own outputs. These are the values calculated by the core and the
+		delegates before them, as found in newvalues, or paths that other delegates publish directly.
+		Example:
+		def get_upstream(self):
+			return ['/Dc/Pv/Power', '/ActiveBatteryService']
+		"""
+		return []
+
 	def update_values(self, newvalues):
 		pass
 
+	def on_paths_changed(self, newvalues, changed):
+		""" A delegate can implement this instead of update_values, to only
+		    be called when something it depends on changed since its last
+		    call. changed is a set of the paths of get_input that changed,
+		    as (service, path), and the paths of get_upstream that changed.
+		    It is None when everything should be looked at again, after a
+		    device, a setting or the battery service changed. When nothing
+		    changed the delegate is skipped, and the values of its outputs
+		    from the last call are used again. """
+		self.update_values(newvalues)
+
 	def device_added(self, service, instance, do_service_change=True):
 		pass
 
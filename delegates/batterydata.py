@@ -1,9 +1,8 @@
 from gi.repository import GLib
-import json
 from collections import defaultdict
 from itertools import chain
 from functools import partial
-from sc_utils import reify, smart_dict
+from sc_utils import reify, smart_dict, ContentCache
 from delegates.base import SystemCalcDelegate
 
 # Victron packages
@@ -53,7 +52,18 @@ class BatteryTracker(object):
 		self.instance = instance
 		self.monitor = monitor
 		self.channel = None
+		self.dirty = True
 		self._tracked = { k: None for k in self._paths }
+		self._cache = None
+
+	def track(self):
+		""" Ask the monitor to mark this tracker dirty when any of the
+		    tracked paths change. """
+		for p in self._paths:
+			self.monitor.track_value(self.service, p, self._on_value_changed)
+
+	def _on_value_changed(self, *args):
+		self.dirty = True
 
 	@property
 	def valid(self):
@@ -77,12 +87,15 @@ class BatteryTracker(object):
 		return "{}/{}".format('.'.join(self.service.split('.')[:3]), self.instance)
 
 	def update(self):
+		self.dirty = False
 		changed = False
 		for k, v in self._tracked.items():
 			n = self.monitor.get_value(self.service, k)
 			if n != v:
 				self._tracked[k] = n
 				changed = True
+		if changed:
+			self._cache = None
 		return changed
 
 	def _data(self):
@@ -104,7 +117,13 @@ class BatteryTracker(object):
 		}
 
 	def data(self):
-		return { k: v for k, v in self._data().items() if v is not None }
+		""" Returns the summary for this battery. The same dict is returned
+		    until a tracked value or the name changes. """
+		name = self.name
+		if self._cache is None or self._cache[0] != name:
+			self._cache = (name,
+				{ k: v for k, v in self._data().items() if v is not None })
+		return self._cache[1]
 
 class SecondaryBatteryTracker(BatteryTracker):
 	""" Used to track the starter battery where available. """
@@ -187,9 +206,12 @@ class BatteryData(SystemCalcDelegate):
 		self.deviceschanged = False
 		self.configured_batteries = {}
 		self.active_battery_service = None
+		self._entries = {}
+		self._published = None
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		SystemCalcDelegate.set_sources(self, dbusmonitor, settings, dbusservice)
+		self._published = ContentCache(dbusservice)
 
 		# Publish the battery configuration
 		self._dbusservice.add_path('/Batteries', value=None)
@@ -219,13 +241,15 @@ class BatteryData(SystemCalcDelegate):
 
 	def device_removed(self, service, instance):
 		if service in self.batteries:
-			del self.batteries[service]
+			for t in self.batteries.pop(service):
+				self._entries.pop(t, None)
 			self.changed = True
 			self.deviceschanged = True
 
 	def add_trackers(self, service, *args):
 		self.batteries[service].extend(args)
 		for t in args:
+			t.track()
 			if t.service_id not in self.configured_batteries:
 				self.add_configured_battery(t.service_id)
 
@@ -241,35 +265,51 @@ class BatteryData(SystemCalcDelegate):
 
 	def update_values(self, newvalues=None):
 		self.changed = any([tracker.update() for tracker in chain.from_iterable(
-			self.batteries.values())]) or self.changed
+			self.batteries.values()) if tracker.dirty]) or self.changed
 
 	def add_configured_battery(self, service):
 		self.configured_batteries[service] = BatteryConfiguration(
 			self, service)
 
+	def _entry(self, tracker, active):
+		""" Returns the /Batteries entry for a tracker, reusing the previous
+		    one if nothing it is made of has changed. """
+		data = tracker.data()
+		key = (data, active, self.config_name(tracker))
+		try:
+			k, entry = self._entries[tracker]
+		except KeyError:
+			pass
+		else:
+			if k[0] is data and k[1:] == key[1:]:
+				return entry
+		entry = dict(data, **{k: v for k, v in (
+			('active_battery_service', active),
+			('name', key[2])) if v is not None})
+		self._entries[tracker] = (key, entry)
+		return entry
+
 	def _on_timer(self):
 		active = self._dbusservice['/ActiveBatteryService']
 		if self.changed or self.active_battery_service != active:
 			# Update the summary
-			is_active = lambda x: active == x.service_id
-			kwargs = lambda x: {k: v for k, v in (('active_battery_service', is_active(x)),
-				('name', self.config_name(x))) if v is not None}
-
-			self._dbusservice['/Batteries'] = [
-				dict(tracked.data(), **kwargs(tracked)) \
+			batteries = [
+				self._entry(tracked, active == tracked.service_id) \
 					for tracked in chain.from_iterable(self.batteries.values()) \
-					if (tracked.valid and self.is_enabled(tracked)) or is_active(tracked)
+					if (tracked.valid and self.is_enabled(tracked)) or active == tracked.service_id
 			]
+			self._published.set('/Batteries', batteries)
 
 		if self.deviceschanged or self.active_battery_service != active:
-			# This is returned as JSON, because QML won't let us pass
-			# lists of objects.
-			self._dbusservice['/AvailableBatteries'] = json.dumps({
+			available = {
 				b.service_id: {
 					'name': b.name,
 					'channel': b.channel,
 					'type': b.service_type
-				} for b in chain.from_iterable(self.batteries.values()) if b.valid })
+				} for b in chain.from_iterable(self.batteries.values()) if b.valid }
+			# This is returned as JSON, because QML won't let us pass
+			# lists of objects.
+			self._published.set_json('/AvailableBatteries', available)
 			self.deviceschanged = False
 
 			self.changed = False
@@ -1,10 +1,9 @@
 import logging
-from gi.repository import GLib
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time
 
 # Victron packages
-from ve_utils import exit_on_error
 from delegates.base import SystemCalcDelegate
+from delegates.eventscheduler import EventScheduler
 
 # Path constants
 BLPATH = "/Settings/CGwacs/BatteryLife";
@@ -62,11 +61,17 @@ class BatteryLife(SystemCalcDelegate):
 	def __init__(self):
 		super(BatteryLife, self).__init__()
 		self._tracked_values = {}
-		self._timer = GLib.timeout_add(900000, exit_on_error, self._on_timer)
+		self._forcecharge_event = None
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(BatteryLife, self).set_sources(dbusmonitor, settings, dbusservice)
 		self._dbusservice.add_path('/Control/ActiveSocLimit', value=None)
+		EventScheduler.instance.every_day(time.min, self._on_midnight)
+		self._update_forcecharge_event()
+
+	def settings_changed(self, setting, oldvalue, newvalue):
+		if setting in ('state', 'dischargedtime'):
+			self._update_forcecharge_event()
 
 	def get_input(self):
 		# We need to check the assistantid to know if we should even be active.
@@ -321,21 +326,39 @@ class BatteryLife(SystemCalcDelegate):
 		else:
 			self._dbusservice['/Control/ActiveSocLimit'] = None
 
-	def _on_timer(self):
-		now = self._get_time()
+	def _on_midnight(self, now):
+		self.flags = 0
+
+	def _update_forcecharge_event(self):
+		""" While Discharged or Sustained, arm an event for when we have
+		    been there for ForceChargeInterval. """
+		EventScheduler.instance.cancel(self._forcecharge_event)
+		self._forcecharge_event = None
+
+		if self.state in (State.BLDischarged, State.BLSustain):
+			if self.dischargedtime:
+				when = datetime.fromtimestamp(self.dischargedtime) + \
+					timedelta(seconds=Constants.ForceChargeInterval)
+			else:
+				when = self._get_time()
+			self._forcecharge_event = EventScheduler.instance.at(
+				when, self._on_forcecharge_due)
 
-		# Test for the first 15-minute window of the day, and clear the flags
-		if now.hour == 0 and now.minute < 15:
-			self.flags = 0
+	def _on_forcecharge_due(self, now):
+		self._forcecharge_event = None
+		now = self._get_time()
 
 		if self.state in (State.BLDischarged, State.BLSustain):
 			# load dischargedtime, it's a unix timestamp, ie UTC
 			if self.dischargedtime:
 				dt = datetime.fromtimestamp(self.dischargedtime)
-				if now - dt > timedelta(seconds=Constants.ForceChargeInterval):
+				if now - dt >= timedelta(seconds=Constants.ForceChargeInterval):
 					self.adjust_soc_limit(Constants.SocSwitchIncrement)
 					self.state = State.BLForceCharge
+					return
 			else:
 				self.dischargedtime = dt_to_stamp(now)
 
-		return True
+		# Arm again, for the new dischargedtime or because the clock was
+		# set back.
+		self._update_forcecharge_event()
@@ -1,9 +1,9 @@
 from collections import namedtuple
-from itertools import chain
 from gi.repository import GLib
 from dbus.exceptions import DBusException
 from delegates.base import SystemCalcDelegate
 from delegates.dvcc import Dvcc
+from sc_utils import ContentCache
 
 # Victron packages
 from ve_utils import exit_on_error
@@ -11,6 +11,9 @@ from ve_utils import exit_on_error
 # Write temperature this often (in 3-second units)
 TEMPERATURE_INTERVAL = 3
 
+# Paths on solarchargers and inverters that receive the shared values
+LINK_PATHS = ('/Link/VoltageSense', '/Link/BatteryCurrent', '/Link/TemperatureSense')
+
 def safe_float(v):
 	""" Return a floating point value for v, unless it is None/invalid. """
 	try:
@@ -52,9 +55,17 @@ class BatterySense(SystemCalcDelegate):
 		super(BatterySense, self).__init__()
 		self.systemcalc = sc
 		self._timer = None
+		self._published = None
 		self.temperaturesensors = {}
 		self.tick = TEMPERATURE_INTERVAL
 
+		# Index of services that accept the shared values, so that we don't
+		# have to probe every service on every pass.
+		self._link_targets = {p: set() for p in LINK_PATHS}
+		self._networked = set() # Solarchargers with /Link/NetworkMode
+		self._inverters = set()
+		self._vecan = set()
+
 	def get_input(self):
 		return [
 			('com.victronenergy.solarcharger', [
@@ -100,6 +111,7 @@ class BatterySense(SystemCalcDelegate):
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		SystemCalcDelegate.set_sources(self, dbusmonitor, settings, dbusservice)
+		self._published = ContentCache(dbusservice)
 		self._dbusservice.add_path('/Control/SolarChargerVoltageSense', value=0)
 		self._dbusservice.add_path('/Control/BatteryVoltageSense', value=0)
 		self._dbusservice.add_path('/Control/BatteryCurrentSense', value=0)
@@ -158,7 +170,7 @@ class BatterySense(SystemCalcDelegate):
 				name = self._dbusmonitor.get_value(sensor.service, '/ProductName')
 				services[sensor.instance_service_name+sensor.path] = self.nice_name(sensor.service)
 
-		self._dbusservice['/AvailableTemperatureServices'] = services
+		self._published.set('/AvailableTemperatureServices', services)
 
 	def _find_device_instance(self, serviceclass, instance):
 		di = {(s.service_class, s.instance): s.service for s in self.temperaturesensors.values()}
@@ -201,7 +213,38 @@ class BatterySense(SystemCalcDelegate):
 
 		return None, None
 
+	def _on_link_path(self, service, path, *args):
+		self._link_targets[path].add(service)
+
+	def _on_networkmode(self, service, changes):
+		if changes.get('Value') is None:
+			self._networked.discard(service)
+		else:
+			self._networked.add(service)
+
+	def _index_device(self, service):
+		if service.startswith('com.victronenergy.solarcharger.') or \
+				service.startswith('com.victronenergy.inverter.'):
+			for path in LINK_PATHS:
+				if self._dbusmonitor.seen(service, path):
+					self._link_targets[path].add(service)
+				else:
+					# Older firmware may add it later
+					self._dbusmonitor.track_value(service, path,
+						self._on_link_path, service, path)
+			if service.startswith('com.victronenergy.inverter.'):
+				self._inverters.add(service)
+			else:
+				self._dbusmonitor.track_value(service, '/Link/NetworkMode',
+					self._on_networkmode, service)
+				self._on_networkmode(service, {'Value':
+					self._dbusmonitor.get_value(service, '/Link/NetworkMode')})
+		elif service.startswith('com.victronenergy.vecan.'):
+			self._vecan.add(service)
+
 	def device_added(self, service, instance, *args):
+		self._index_device(service)
+
 		# Devices that can serve as temperature sensors
 		if service.startswith('com.victronenergy.battery.') or \
 				service.startswith('com.victronenergy.vebus.') or \
@@ -221,6 +264,12 @@ class BatterySense(SystemCalcDelegate):
 			self.update_temperature_sensors()
 
 	def device_removed(self, service, instance):
+		for targets in self._link_targets.values():
+			targets.discard(service)
+		self._networked.discard(service)
+		self._inverters.discard(service)
+		self._vecan.discard(service)
+
 		if service in self.temperaturesensors:
 			del self.temperaturesensors[service]
 			self.update_temperature_sensors()
@@ -284,20 +333,16 @@ class BatterySense(SystemCalcDelegate):
 			return multi_written, charger_written
 
 		# Forward voltage sense to solarchargers and supporting inverters
-		for service in chain(self._dbusmonitor.get_service_list('com.victronenergy.solarcharger'),
-			self._dbusmonitor.get_service_list('com.victronenergy.inverter')):
+		for service in self._link_targets['/Link/VoltageSense']:
 			if service == sense_voltage_service:
 				continue
-			if not self._dbusmonitor.seen(service, '/Link/VoltageSense'):
-				continue
 			self._dbusmonitor.set_value_async(service, '/Link/VoltageSense', sense_voltage)
 			charger_written = self.VSENSE_ON
 
 		# Only forward to the VE.Can if the voltage is not coming from it, or
 		# if it is a battery that is known not to response to these vregs.
-		vecan = self._dbusmonitor.get_service_list('com.victronenergy.vecan')
-		if len(vecan) and (self._service_is_battery(sense_voltage_service) or not self._service_on_vecan(sense_voltage_service)):
-			for _ in vecan.keys():
+		if self._vecan and (self._service_is_battery(sense_voltage_service) or not self._service_on_vecan(sense_voltage_service)):
+			for _ in self._vecan:
 				self._dbusmonitor.set_value_async(_, '/Link/VoltageSense', sense_voltage)
 			charger_written = self.VSENSE_ON
 
@@ -323,21 +368,16 @@ class BatterySense(SystemCalcDelegate):
 			return BatterySense.ISENSE_NO_MONITOR
 
 		sent = BatterySense.ISENSE_NO_CHARGERS
-		for service in chain(self._dbusmonitor.get_service_list(
-			'com.victronenergy.solarcharger').keys(), self._dbusmonitor.get_service_list(
-			'com.victronenergy.inverter').keys()):
-			# Skip for old firmware versions to save some dbus traffic
-			if not self._dbusmonitor.seen(service, '/Link/BatteryCurrent'):
-				continue # No such feature on this charger
+		# Old firmware versions don't have the path and are not in the index
+		for service in self._link_targets['/Link/BatteryCurrent']:
 			self._dbusmonitor.set_value_async(service, '/Link/BatteryCurrent', battery_current)
 			sent = BatterySense.ISENSE_ENABLED
 
 		# Forward isense to VE.Can only if it doesn't come from there
-		vecan = self._dbusmonitor.get_service_list('com.victronenergy.vecan')
-		if vecan:
+		if self._vecan:
 			sense_origin = self._dbusmonitor.get_value(sense_voltage_service, '/Mgmt/Connection')
 			if sense_origin and sense_origin != 'VE.Can':
-				for service in vecan.keys():
+				for service in self._vecan:
 					self._dbusmonitor.set_value_async(service, '/Link/BatteryCurrent', battery_current)
 					sent = BatterySense.ISENSE_ENABLED
 
@@ -352,28 +392,26 @@ class BatterySense(SystemCalcDelegate):
 
 		# Write the tempeature to all solar chargers.
 		written = 0
-		for charger in self._dbusmonitor.get_service_list('com.victronenergy.solarcharger'):
+		targets = self._link_targets['/Link/TemperatureSense']
+
+		# We use /Link/NetworkMode to detect Hub support in the solarcharger.
+		for charger in self._networked:
 			# Don't write the temperature back to its source
 			if charger == sense_temp_service:
 				continue
 
-			# We use /Link/NetworkMode to detect Hub support in the
-			# solarcharger.
-			if self._dbusmonitor.get_value(charger, '/Link/NetworkMode') is None:
-				continue
-
 			# VE.Can chargers don't have this path, so only set it when it has been seen
-			if self._dbusmonitor.seen(charger, '/Link/TemperatureSense'):
+			if charger in targets:
 				self._dbusmonitor.set_value_async(charger, '/Link/TemperatureSense', sense_temp)
 			written = 1
 
 		# Write to supporting inverters
-		for charger in self._dbusmonitor.get_service_list('com.victronenergy.inverter'):
+		for charger in self._inverters:
 			# Don't write the temperature back to its source
 			if charger == sense_temp_service:
 				continue
 
-			if self._dbusmonitor.seen(charger, '/Link/TemperatureSense'):
+			if charger in targets:
 				self._dbusmonitor.set_value_async(charger, '/Link/TemperatureSense', sense_temp)
 			written = 1
 
@@ -385,9 +423,8 @@ class BatterySense(SystemCalcDelegate):
 			written = 1
 
 		# Update vecan only if there is one..
-		vecan = self._dbusmonitor.get_service_list('com.victronenergy.vecan')
-		if len(vecan) and (self._service_is_battery(sense_temp_service) or not self._service_on_vecan(sense_temp_service)):
-			for _ in vecan.keys():
+		if self._vecan and (self._service_is_battery(sense_temp_service) or not self._service_on_vecan(sense_temp_service)):
+			for _ in self._vecan:
 				self._dbusmonitor.set_value_async(_, '/Link/TemperatureSense', sense_temp)
 			written = 1
 
@@ -1,6 +1,6 @@
 from dbus.exceptions import DBusException
 from delegates.base import SystemCalcDelegate
-from sc_utils import reify
+from sc_utils import reify, ContentCache
 
 class Battery(object):
 	def __init__(self, monitor, service, instance):
@@ -89,9 +89,11 @@ class BatteryService(SystemCalcDelegate):
 		self._batteries = {}
 		self.bms = None
 		self._notify = []
+		self._published = None
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(BatteryService, self).set_sources(dbusmonitor, settings, dbusservice)
+		self._published = ContentCache(dbusservice)
 		self._dbusservice.add_path('/ActiveBmsService', value=None)
 		self._dbusservice.add_path('/AvailableBmsServices', value=None)
 
@@ -168,14 +170,14 @@ class BatteryService(SystemCalcDelegate):
 	def _set_bms(self, *args, **kwargs):
 		bmses = self.bmses
 		if bmses:
-			self._dbusservice['/AvailableBmsServices'] = [
+			self._published.set('/AvailableBmsServices', [
 				{
 					'name': b.custom_name or b.product_name,
 					'instance': b.device_instance
 				} for b in bmses
-			]
+			])
 		else:
-			self._dbusservice['/AvailableBmsServices'] = None
+			self._published.set('/AvailableBmsServices', None)
 
 		# Disabled
 		if self.selected_bms_instance == BatteryService.BMSSERVICE_NOBMS:
@@ -5,14 +5,24 @@ class BatterySoc(SystemCalcDelegate):
 		super(BatterySoc, self).__init__()
 		self.systemcalc = sc
 
+	def get_input(self):
+		return [
+			('com.victronenergy.battery', ['/Soc']),
+			('com.victronenergy.vebus', ['/Soc']),
+			('com.victronenergy.multi', ['/Soc']),
+			('com.victronenergy.inverter', ['/Soc'])]
+
 	def get_output(self):
 		return [('/Dc/Battery/Soc', {'gettext': '%.0F %%'})]
 
+	def get_upstream(self):
+		return ['/Dc/Battery/BatteryService']
+
 	@property
 	def soc(self):
 		if self.systemcalc.batteryservice is not None:
 			return self._dbusmonitor.get_value(self.systemcalc.batteryservice, '/Soc')
 		return None
 
-	def update_values(self, newvalues):
+	def on_paths_changed(self, newvalues, changed):
 		newvalues['/Dc/Battery/Soc'] = self.soc
@@ -3,11 +3,10 @@ from gi.repository import GLib
 import logging
 from math import pi, floor, ceil
 import traceback
-from itertools import count
 from functools import partial, wraps
 
 # Victron packages
-from sc_utils import safeadd, copy_dbus_value, reify
+from sc_utils import safeadd, copy_dbus_value, reify, LowPassFilterBank
 from ve_utils import exit_on_error
 
 from delegates.base import SystemCalcDelegate
@@ -102,68 +101,76 @@ QUIRKS = {
 	0xA3E6: _lynx_smart_bms_quirk,
 }
 
+def water_fill(values, ceilings, weights, target):
+	""" Raises (or lowers) all values by a common level, scaled by their
+	    weights and clipped between zero and their ceilings, so that they
+	    add up to target. The level is found in one sweep over the sorted
+	    points where a value hits zero or its ceiling.
+
+	    A value above its ceiling ends up at most at the ceiling, and what
+	    it loses counts towards target, as in the loop distribute used to
+	    be. Unlike that loop, which depended on the order of the values,
+	    the result always adds up to target if it can. """
+	assert all(c >= 0 for c in ceilings)
+	if target >= sum(ceilings):
+		return list(ceilings)
+	if target <= 0:
+		return [0] * len(values)
+
+	# Each value adds its weight to the slope of the total between the level
+	# where it leaves zero and the level where it reaches its ceiling.
+	# Values with no weight don't move.
+	total = slope = 0
+	breakpoints = []
+	for v, c, w in zip(values, ceilings, weights):
+		if w > 0:
+			breakpoints.append((-v / w, w))
+			breakpoints.append(((c - v) / w, -w))
+		else:
+			total += min(max(v, 0), c)
+	breakpoints.sort()
+
+	level = breakpoints[0][0] if breakpoints else 0
+	for point, d in breakpoints:
+		t = total + slope * (point - level)
+		if t >= target:
+			level += (target - total) / slope
+			break
+		total, level, slope = t, point, slope + d
+
+	return [min(max(v + w * level, 0), c) for v, c, w in zip(values, ceilings, weights)]
+
 def distribute(current_values, max_values, increment):
 	""" current_values and max_values are lists of equal size containing the
 	    current limits, and the maximum they can be increased to. increment
 	    contains the amount by which we want to increase the total, ie the sum
 	    of the values in current_values, while staying below max_values.
 
-	    This is done simply by first attempting to spread the increment
-	    equally. If a value exceeds the max in that process, the remainder is
-	    thrown back into the pot and distributed equally among the rest.
+	    The increment is spread equally. If a value exceeds the max in that
+	    process, the remainder is thrown back into the pot and distributed
+	    equally among the rest.
 
 	    Negative values are also handled, and zero is assumed to be the
 	    implicit lower limit. """
-	n = cn = len(current_values)
-	new_values = [-1] * n
-	for j in range(0, n):
-		for i, mv, av in zip(count(), max_values, current_values):
-			assert mv >= 0
-			if new_values[i] == mv or new_values[i] == 0:
-				continue
-			nv = av + float(increment) / cn
-
-			if nv >= mv:
-				increment += av - mv
-				cn -= 1
-				new_values[i] = mv
-				break
-			elif nv < 0:
-				increment += av
-				cn -= 1
-				new_values[i] = 0
-				break
-
-			new_values[i] = nv
-		else:
-			break
-		continue
-	return new_values
-
-class LowPassFilter(object):
-	""" Low pass filter, with a cap. """
-	def __init__(self, omega, value):
-		self.omega = omega
-		self._value = value
-
-	def update(self, newvalue):
-		self._value += (newvalue - self._value) * self.omega
-		return self._value
-
-	@property
-	def value(self):
-		return self._value
+	return water_fill(current_values, max_values, [1] * len(current_values),
+		sum(current_values) + increment)
 
 class SolarCharger(object):
 	""" Encapsulates a solar charger on dbus. Exposes dbus paths as convenient
 	    attributes. """
 
-	def __init__(self, monitor, service):
+	def __init__(self, monitor, service, filters):
 		self.monitor = monitor
 		self.service = service
-		self._smoothed_current = LowPassFilter((2 * pi)/20, self.chargecurrent or 0)
+		self._filters = filters
+		self._smoothed_current = filters.add((2 * pi)/20,
+			self.chargecurrent or 0, service)
 		self._has_externalcontrol_support = False
 
+	def release(self):
+		""" Return the filter slot to the bank. """
+		self._filters.remove(self._smoothed_current)
+
 	def _get_path(self, path):
 		return self.monitor.get_value(self.service, path)
 
@@ -266,7 +273,7 @@ class SolarCharger(object):
 	@property
 	def smoothed_current(self):
 		""" Returns the internal low-pass filtered current value. """
-		return self._smoothed_current.value
+		return self._filters[self._smoothed_current]
 
 	def maximize_charge_current(self):
 		""" Max out the charge current of this solar charger by setting
@@ -281,15 +288,15 @@ class SolarCharger(object):
 		# a smooth current value.
 		v = self.monitor.get_value(self.service, '/Dc/0/Current')
 		if v is not None:
-			self._smoothed_current.update(v)
+			self._filters.set_input(self._smoothed_current, v)
 
 class InverterCharger(SolarCharger):
 	""" Encapsulates an inverter/charger object, currently the inverter RS,
 	    which has a solar input and can charge the battery like a solar
 	    charger, but is also an inverter.
 	"""
-	def __init__(self, monitor, service):
-		super(InverterCharger, self).__init__(monitor, service)
+	def __init__(self, monitor, service, filters):
+		super(InverterCharger, self).__init__(monitor, service, filters)
 
 	@property
 	def has_externalcontrol_support(self):
@@ -345,20 +352,21 @@ class SolarChargerSubsystem(object):
 	    a charging system (sans Multi). Properties related to the whole
 	    system or some combination of the individual chargers are exposed
 		here as attributes. """
-	def __init__(self, monitor):
+	def __init__(self, monitor, filters):
 		self.monitor = monitor
+		self.filters = filters
 		self._solarchargers = {}
 
 	def add_charger(self, service):
-		self._solarchargers[service] = charger = SolarCharger(self.monitor, service)
+		self._solarchargers[service] = charger = SolarCharger(self.monitor, service, self.filters)
 		return charger
 
 	def add_invertercharger(self, service):
-		self._solarchargers[service] = inverter = InverterCharger(self.monitor, service)
+		self._solarchargers[service] = inverter = InverterCharger(self.monitor, service, self.filters)
 		return inverter
 
 	def remove_charger(self, service):
-		del self._solarchargers[service]
+		self._solarchargers.pop(service).release()
 
 	def __iter__(self):
 		return iter(self._solarchargers.values())
@@ -466,31 +474,45 @@ class SolarChargerSubsystem(object):
 		# Return flags of what we did
 		return voltage_written, int(network_mode_written and max_charge_current is not None), network_mode
 
-	# The math for the below is as follows. Let c be the total capacity of the
-	# charger, l be the current limit, a the actual current it produces, k the
-	# total current limit for the two chargers, and m the margin (l - a)
+	# The math for the below is as follows. Let c be the total capacity of a
+	# charger, l its current limit, a the actual current it produces, k the
+	# total current limit for all chargers, and m the margin (l - a)
 	# between the limit and what is produced.
 	#
 	# We want m/c to be the same for all our chargers.
 	#
-	# Expression 1: (l1-a1)/c1 == (l2-a2)/c2
-	# Expression 2: l1 + l2 == k
+	# Expression 1: (li-ai)/ci == r for all i
+	# Expression 2: sum(li) == k
 	#
-	# Solving that yields the expression below.
+	# So li = ai + r*ci, which is water-filling with the capacities as
+	# weights, with 0 <= li <= ci.
 	@staticmethod
-	def _balance_chargers(charger1, charger2, l1, l2):
-		c1, c2 = charger1.currentlimit, charger2.currentlimit
-		a1 = min(charger1.smoothed_current, c1)
-		a2 = min(charger2.smoothed_current, c2)
-		k = l1 + l2
-
-		try:
-			l1 = round((c2 * a1 - c1 * a2 + k * c1)/(c1 + c2), 1)
-		except ArithmeticError:
-			return l1, l2 # unchanged
-		else:
-			l1 = max(min(l1, c1), 0)
-			return l1, k - l1
+	def _balance_chargers(chargers, limits):
+		""" Redistribute the sum of limits so that all chargers have the
+		    same headroom relative to their size, ie (limit-current)/size is
+		    the same for all of them. """
+		ceilings = [c.currentlimit for c in chargers]
+		actual = [min(c.smoothed_current, ci) for c, ci in zip(chargers, ceilings)]
+
+		# Work in whole tenths of an amp, so that the limits are exact
+		# multiples of 100mA and their sum does not drift.
+		k = int(round(sum(limits) * 10))
+		tops = [int(floor(c * 10 + 1e-6)) for c in ceilings]
+		balanced = [l * 10 for l in water_fill(actual, ceilings, ceilings, k / 10.0)]
+		tenths = [max(min(int(floor(l + 1e-6)), t), 0) for l, t in zip(balanced, tops)]
+
+		# Hand what rounding down left over to the chargers with the largest
+		# remainders, one tenth each, as long as they have room.
+		rest = k - sum(tenths)
+		order = sorted(range(len(tenths)), key=lambda i: tenths[i] - balanced[i])
+		step = 1 if rest > 0 else -1
+		for i in (order if rest > 0 else reversed(order)):
+			if rest == 0:
+				break
+			if 0 <= tenths[i] + step <= tops[i]:
+				tenths[i] += step
+				rest -= step
+		return [t / 10.0 for t in tenths]
 
 	@staticmethod
 	def _distribute_current(chargers, max_charge_current):
@@ -521,22 +543,14 @@ class SolarChargerSubsystem(object):
 				charger.maxchargecurrent = limit
 		else:
 			# Balance the limits so they have the same headroom at the top.
-			# Each charger is balanced against its neighbour, the one at the
-			# end is paired with the one at the start.
-			limits = []
-			r = chargers[0].maxchargecurrent
-			for c1, c2 in zip(chargers, chargers[1:]):
-				l, r = SolarChargerSubsystem._balance_chargers(c1, c2, r, c2.maxchargecurrent)
-				limits.append(l)
-			l, limits[0] = SolarChargerSubsystem._balance_chargers(c2, chargers[0], r, limits[0])
-			limits.append(l)
-
+			limits = SolarChargerSubsystem._balance_chargers(chargers, limits)
 			for charger, limit in zip(chargers, limits):
 				charger.maxchargecurrent = limit
 
 	def update_values(self):
 		# This is called periodically from a timer to update contained
-		# solar chargers with values that they track.
+		# solar chargers with values that they track. The filters are
+		# stepped when the bank is updated.
 		for charger in self._solarchargers.values():
 			charger.update_values()
 
@@ -573,11 +587,12 @@ class BatteryOperationalLimits(object):
 class Multi(object):
 	""" Encapsulates the multi. Makes access to dbus paths a bit neater by
 	    exposing them as attributes. """
-	def __init__(self, monitor, service):
+	def __init__(self, monitor, service, filters):
 		self.monitor = monitor
 		self._service = service
 		self.bol = BatteryOperationalLimits(self)
-		self._dc_current = LowPassFilter((2 * pi)/30, 0)
+		self._filters = filters
+		self._dc_current = self._filters.add((2 * pi)/30, 0, 'vebus')
 		self._v = None
 
 	@property
@@ -611,7 +626,7 @@ class Multi(object):
 	@property
 	def dc_current(self):
 		""" Return a low-pass smoothed current. """
-		return self._dc_current.value
+		return self._filters[self._dc_current]
 
 	@property
 	def hub_voltage(self):
@@ -679,7 +694,7 @@ class Multi(object):
 			# backing-off when the load drops suddenly.
 			if limit is not None:
 				c = max(c, -limit)
-			self._dc_current.update(c)
+			self._filters.set_input(self._dc_current, c)
 
 class Dvcc(SystemCalcDelegate):
 	""" This is the main DVCC delegate object. """
@@ -690,7 +705,12 @@ class Dvcc(SystemCalcDelegate):
 		self._vecan_services = []
 		self._timer = None
 		self._tickcount = ADJUST
-		self._dcsyscurrent = LowPassFilter((2 * pi)/20, 0.0)
+		self._bms_limits = {}
+		self._fast_adjust = None
+		self._fast_replaced = False
+		self._fast_pending = False
+		self._filters = LowPassFilterBank()
+		self._dcsyscurrent = self._filters.add((2 * pi)/20, 0.0, 'dcsystem')
 
 	def get_input(self):
 		return [
@@ -763,9 +783,9 @@ class Dvcc(SystemCalcDelegate):
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		SystemCalcDelegate.set_sources(self, dbusmonitor, settings, dbusservice)
-		self._solarsystem = SolarChargerSubsystem(dbusmonitor)
+		self._solarsystem = SolarChargerSubsystem(dbusmonitor, self._filters)
 		self._inverters = InverterSubsystem(dbusmonitor)
-		self._multi = Multi(dbusmonitor, dbusservice)
+		self._multi = Multi(dbusmonitor, dbusservice, self._filters)
 
 		self._dbusservice.add_path('/Control/SolarChargeVoltage', value=0)
 		self._dbusservice.add_path('/Control/SolarChargeCurrent', value=0)
@@ -778,6 +798,7 @@ class Dvcc(SystemCalcDelegate):
 		self._dbusservice.add_path('/Debug/BatteryOperationalLimits/CurrentOffset', value=0, writeable=True)
 		self._dbusservice.add_path('/Dvcc/Alarms/FirmwareInsufficient', value=0)
 		self._dbusservice.add_path('/Dvcc/Alarms/MultipleBatteries', value=0)
+		self._dbusservice.add_path('/Debug/SmoothedCurrents', value=None)
 
 	def device_added(self, service, instance, do_service_change=True):
 		service_type = service.split('.')[2]
@@ -793,7 +814,10 @@ class Dvcc(SystemCalcDelegate):
 		elif service_type == 'vecan':
 			self._vecan_services.append(service)
 		elif service_type == 'battery':
-			pass # install timer below
+			for path in ('/Info/MaxChargeCurrent', '/Info/MaxChargeVoltage'):
+				self._bms_limits[(service, path)] = self._dbusmonitor.get_value(service, path)
+				self._dbusmonitor.track_value(service, path,
+					self._on_bms_limit_changed, service, path)
 		else:
 			# Skip timer code below
 			return
@@ -802,6 +826,8 @@ class Dvcc(SystemCalcDelegate):
 			self._timer = GLib.timeout_add(1000, exit_on_error, self._on_timer)
 
 	def device_removed(self, service, instance):
+		self._bms_limits.pop((service, '/Info/MaxChargeCurrent'), None)
+		self._bms_limits.pop((service, '/Info/MaxChargeVoltage'), None)
 		if service in self._solarsystem:
 			self._solarsystem.remove_charger(service)
 			# Some solar chargers are inside an inverter
@@ -827,18 +853,24 @@ class Dvcc(SystemCalcDelegate):
 	invertervoltageoffset = property(partial(_property, '/Debug/BatteryOperationalLimits/VebusVoltageOffset'))
 	currentoffset = property(partial(_property, '/Debug/BatteryOperationalLimits/CurrentOffset'))
 
-	@property
-	def dcsyscurrent(self):
-		""" Return non-zero DC system current, if it is based on
-		    a real measurement. If an estimate/calculation, we cannot use it.
-		"""
+	def _update_dcsyscurrent(self):
+		""" Feed the DC system current into its filter, if it is based on a
+		    real measurement. """
 		if self._dbusservice['/Dc/System/MeasurementType'] == 1:
 			try:
 				v = self._dbusservice['/Dc/Battery/Voltage']
-				return self._dcsyscurrent.update(
+				self._filters.set_input(self._dcsyscurrent,
 					float(self._dbusservice['/Dc/System/Power'])/v)
 			except (TypeError, ZeroDivisionError):
 				pass
+
+	@property
+	def dcsyscurrent(self):
+		""" Return non-zero DC system current, if it is based on
+		    a real measurement. If an estimate/calculation, we cannot use it.
+		"""
+		if self._dbusservice['/Dc/System/MeasurementType'] == 1:
+			return self._filters[self._dcsyscurrent]
 		return 0.0
 
 	@property
@@ -862,12 +894,40 @@ class Dvcc(SystemCalcDelegate):
 	def bms_seen(self):
 		return self._solarsystem.want_bms
 
-	def _on_timer(self):
-		def update_solarcharger_control_flags(voltage_written, current_written, chargevoltage):
-			self._dbusservice['/Control/SolarChargeVoltage'] = voltage_written
-			self._dbusservice['/Control/SolarChargeCurrent'] = current_written
-			self._dbusservice['/Control/EffectiveChargeVoltage'] = chargevoltage
+	def _update_solarcharger_control_flags(self, voltage_written, current_written, chargevoltage):
+		self._dbusservice['/Control/SolarChargeVoltage'] = voltage_written
+		self._dbusservice['/Control/SolarChargeCurrent'] = current_written
+		self._dbusservice['/Control/EffectiveChargeVoltage'] = chargevoltage
+
+	def _on_bms_limit_changed(self, service, path, changes):
+		""" Called when the charge limits of a battery change. A decrease on
+		    the active BMS is acted upon immediately, in place of the next
+		    ADJUST cycle. Increases wait for that cycle. """
+		v = changes.get('Value')
+		previous = self._bms_limits.get((service, path))
+		self._bms_limits[(service, path)] = v
+		if v is None or previous is None or v == previous:
+			return
+		bms = self.bms
+		if bms is None or bms.service != service or not self.has_dvcc:
+			return
+
+		# The out-of-cycle adjustment takes the place of the next scheduled
+		# one. If the limits change again before that, run the scheduled
+		# one after all, so we never adjust more than once per ADJUST.
+		if self._fast_replaced:
+			self._fast_pending = True
+		elif v < previous and self._fast_adjust is None:
+			self._fast_adjust = GLib.idle_add(exit_on_error, self._on_fast_adjust)
+
+	def _on_fast_adjust(self):
+		self._fast_adjust = None
+		if self.has_dvcc:
+			self._adjust()
+			self._fast_replaced = True
+		return False
 
+	def _on_timer(self):
 		bol_support = self.has_dvcc
 
 		self._tickcount -= 1; self._tickcount %= ADJUST
@@ -876,7 +936,7 @@ class Dvcc(SystemCalcDelegate):
 			if self._tickcount > 0: return True
 
 			voltage_written, current_written = self._legacy_update_solarchargers()
-			update_solarcharger_control_flags(voltage_written, current_written, None) # Not tracking for non-DVCC case
+			self._update_solarcharger_control_flags(voltage_written, current_written, None) # Not tracking for non-DVCC case
 			self._dbusservice['/Control/BmsParameters'] = 0
 			self._dbusservice['/Control/MaxChargeCurrent'] = 0
 			self._dbusservice['/Control/Dvcc'] = 0
@@ -892,13 +952,32 @@ class Dvcc(SystemCalcDelegate):
 		self._dbusservice['/Dvcc/Alarms/MultipleBatteries'] = int(
 			len(BatteryService.instance.bmses) > 1)
 
-		# Update subsystems
+		# Update subsystems, then step all current filters at once. The DC
+		# system current is only used every ADJUST seconds.
 		self._solarsystem.update_values()
 		self._multi.update_values(self._solarsystem.capacity)
+		if self._tickcount == 0:
+			self._update_dcsyscurrent()
+		self._filters.update()
 
 		# Below are things we only do every ADJUST seconds
 		if self._tickcount > 0: return True
 
+		self._dbusservice['/Debug/SmoothedCurrents'] = {
+			k: round(v, 2) for k, v in self._filters.values().items()}
+
+		if self._fast_replaced:
+			# An out-of-cycle adjustment already took this cycle's place,
+			# unless the limits changed again since.
+			self._fast_replaced = self._fast_pending
+			self._fast_pending = False
+			if not self._fast_replaced: return True
+
+		self._adjust()
+		return True
+
+	def _adjust(self):
+		""" Calculate and write the charge voltage and current limits. """
 		# Signal Dvcc support to other processes
 		self._dbusservice['/Control/Dvcc'] = 1
 
@@ -908,8 +987,8 @@ class Dvcc(SystemCalcDelegate):
 		bms_service = self.bms
 		if self.bms_seen and bms_service is None and not self._multi.has_vebus_bmsv2:
 			# BMS is lost
-			update_solarcharger_control_flags(0, 0, None)
-			return True
+			self._update_solarcharger_control_flags(0, 0, None)
+			return
 
 		# Get the user current limit, if set
 		user_max_charge_current = self._settings['maxchargecurrent']
@@ -976,7 +1055,7 @@ class Dvcc(SystemCalcDelegate):
 		voltage_written, current_written, effective_charge_voltage = \
 			self._update_solarchargers_and_vecan(has_bms, charge_voltage,
 			_max_charge_current, feedback_allowed, stop_on_mcc0)
-		update_solarcharger_control_flags(voltage_written, current_written, effective_charge_voltage)
+		self._update_solarcharger_control_flags(voltage_written, current_written, effective_charge_voltage)
 
 		# The Multi gets the remainder after subtracting what the solar chargers made
 		if max_charge_current is not None:
@@ -1008,8 +1087,6 @@ class Dvcc(SystemCalcDelegate):
 			bms_parameters_written = self._update_battery_operational_limits(bms_service, charge_voltage, max_charge_current)
 		self._dbusservice['/Control/BmsParameters'] = int(bms_parameters_written or (bms_service is not None and voltage_written))
 
-		return True
-
 	def _adjust_battery_operational_limits(self, bms_service, feedback_allowed):
 		""" Take the charge voltage and maximum charge current from the BMS
 		    and adjust it as necessary. For now we only implement quirks
@@ -1,15 +1,26 @@
+import json
+import logging
+import os
 from datetime import datetime
 from gi.repository import GLib
+
+# Victron packages
+from ve_utils import exit_on_error
+
 from delegates.base import SystemCalcDelegate
+from delegates.eventscheduler import EventScheduler
 from delegates.batterysoc import BatterySoc
-from delegates.schedule import ScheduledWindow
+from delegates.schedule import ScheduledWindow, ScheduledWindowIndex
 from delegates.dvcc import Dvcc
 from delegates.batterylife import BatteryLife
 from delegates.batterylife import State as BatteryLifeState
 
 NUM_SCHEDULES = 4
+SCHEDULE_SETTINGS = ('dess_schedule', 'dess_start_', 'dess_duration_',
+	'dess_soc_', 'dess_discharge_')
 INTERVAL = 5
 SELLPOWER = -32000
+MAX_DURATION = 86400 # Longest slot in a packed schedule, in seconds
 HUB4_SERVICE = 'com.victronenergy.hub4'
 
 MODES = {
@@ -39,6 +50,28 @@ class DynamicEssWindow(ScheduledWindow):
 		return "Start: {}, Stop: {}, Soc: {}".format(
 			self.start, self.stop, self.soc)
 
+def is_number(v):
+	return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+def packed_window(slot):
+	""" Returns the window for a slot of a packed schedule, or None if
+	    the slot is not a list of a start timestamp, a duration of at most
+	    MAX_DURATION seconds, a soc between 0 and 100 and a 0 or 1. """
+	try:
+		start, duration, soc, discharge = slot
+	except (ValueError, TypeError):
+		return None
+	if not (is_number(start) and is_number(duration) and is_number(soc)):
+		return None
+	if not (0 < duration <= MAX_DURATION and 0 <= soc <= 100) or \
+			discharge not in (0, 1):
+		return None
+	try:
+		return DynamicEssWindow(datetime.fromtimestamp(start), duration,
+			soc, int(discharge))
+	except (ValueError, OverflowError, OSError):
+		return None # Start out of range
+
 class DynamicEss(SystemCalcDelegate):
 	_get_time = datetime.now
 
@@ -49,6 +82,10 @@ class DynamicEss(SystemCalcDelegate):
 		self.prevsoc = None
 		self.chargerate = None # How fast to charge/discharge to get to the next target
 		self._timer = None
+		self._schedule = None
+		self._schedule_tz = None
+		self._window = None
+		self._event = None
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(DynamicEss, self).set_sources(dbusmonitor, settings, dbusservice)
@@ -62,7 +99,7 @@ class DynamicEss(SystemCalcDelegate):
 			gettextcallback=lambda p, v: ERRORS.get(v, 'Unknown'))
 
 		if self.mode > 0:
-			self._timer = GLib.timeout_add(INTERVAL * 1000, self._on_timer)
+			self._start_timer()
 
 	def get_settings(self):
 		# Settings for DynamicEss
@@ -74,6 +111,10 @@ class DynamicEss(SystemCalcDelegate):
 			("dess_efficiency", path + "/SystemEfficiency", 90.0, 0.0, 100.0),
 			# 0=None, 1=disallow export, 2=disallow import
 			("dess_restrictions", path + "/Restrictions", 0, 0, 2),
+			# Packed schedule, a json list of [start, duration, soc,
+			# allowgridfeedin] slots. Used instead of the slots below
+			# when not empty.
+			("dess_schedule", path + "/Schedule/Packed", "", 0, 0),
 		]
 
 		for i in range(NUM_SCHEDULES):
@@ -99,19 +140,83 @@ class DynamicEss(SystemCalcDelegate):
 		]
 
 	def settings_changed(self, setting, oldvalue, newvalue):
-		if setting == 'dess_mode':
-			if oldvalue == 0 and newvalue > 0:
-				self._timer = GLib.timeout_add(INTERVAL * 1000, self._on_timer)
+		if setting.startswith(SCHEDULE_SETTINGS):
+			self._schedule = None
+
+		# Run the control loop now rather than at the next boundary, so
+		# that switching off also deactivates right away.
+		if setting == 'dess_mode' or (setting.startswith('dess_') and self.mode > 0):
+			self._wake_at(self._get_time())
+
+	def update_values(self, newvalues):
+		# Outside the slots in Auto mode, the control loop sleeps until the
+		# next slot starts. Wake it up if an error occurs in the meantime.
+		if self._timer is None and self.mode in (1, 4) and \
+				self._error() is not None:
+			self._wake_at(self._get_time())
+
+	def _start_timer(self):
+		if self._timer is None:
+			self._timer = GLib.timeout_add(INTERVAL * 1000, exit_on_error, self._on_timer)
+
+	def _wake_at(self, when):
+		""" Run the control loop at when, even if it is not polling. """
+		if (self._event.when if self._event is not None else None) == when:
+			return
+		EventScheduler.instance.cancel(self._event)
+		self._event = None
+		if when is not None:
+			self._event = EventScheduler.instance.at(when, self._on_event)
+
+	def _on_event(self, now):
+		self._event = None
+		if self._update():
+			self._start_timer()
+		elif self._timer is not None:
+			GLib.source_remove(self._timer)
+			self._timer = None
+
+	def _on_timer(self):
+		if self._update():
+			return True
+		self._timer = None
+		return False
 
 	def windows(self):
+		""" Returns the windows of the packed schedule, or of the separate
+		    slots if there is no packed schedule. Invalid slots of the packed
+		    schedule are left out. """
+		packed = self._settings['dess_schedule']
+		if packed:
+			try:
+				slots = json.loads(packed)
+			except ValueError:
+				slots = None
+			if isinstance(slots, list):
+				windows = [w for w in map(packed_window, slots) if w is not None]
+				if len(windows) < len(slots):
+					logging.error("[DynamicEss] Ignoring %d invalid slots in packed schedule",
+						len(slots) - len(windows))
+				return windows
+			logging.error("[DynamicEss] Invalid packed schedule, using slots")
+
 		starttimes = (self._settings['dess_start_{}'.format(i)] for i in range(NUM_SCHEDULES))
 		durations = (self._settings['dess_duration_{}'.format(i)] for i in range(NUM_SCHEDULES))
 		socs = (self._settings['dess_soc_{}'.format(i)] for i in range(NUM_SCHEDULES))
 		discharges = (self._settings['dess_discharge_{}'.format(i)] for i in range(NUM_SCHEDULES))
 
-		for start, duration, soc, discharge in zip(starttimes, durations, socs, discharges):
-			yield DynamicEssWindow(
-				datetime.fromtimestamp(start), duration, soc, discharge)
+		return [DynamicEssWindow(datetime.fromtimestamp(start), duration, soc, discharge)
+			for start, duration, soc, discharge in zip(starttimes, durations, socs, discharges)]
+
+	@property
+	def schedule(self):
+		""" An index over the windows, rebuilt when the schedule or the
+		    time zone changes, as the windows are in local time. """
+		tz = os.environ.get('TZ')
+		if self._schedule is None or tz != self._schedule_tz:
+			self._schedule = ScheduledWindowIndex(self.windows())
+			self._schedule_tz = tz
+		return self._schedule
 
 	@property
 	def hub4mode(self):
@@ -203,35 +308,39 @@ class DynamicEss(SystemCalcDelegate):
 			except ZeroDivisionError:
 				self.chargerate = None
 
-	def _on_timer(self):
-		# If DESS was disabled, deactivate and kill timer.
-		if self.mode == 0:
-			self.deactivate(0) # No error
-			return False
-
+	def _error(self):
+		""" Returns the error code that keeps the control loop from doing
+		    anything, or None. """
 		# Can't do anything unless we have an SOC, and the ESS assistant
 		if self.soc is None or self.minsoc is None:
-			self.active = 0 # Off
-			self.errorcode = 4 # SOC low
-			self.targetsoc = None
-			return True
+			return 4 # SOC low
 
 		if not Dvcc.instance.has_ess_assistant:
-			self.active = 0 # Off
-			self.errorcode = 1 # No ESS
-			self.targetsoc = None
-			return True
+			return 1 # No ESS
 
 		if self.capacity == 0.0:
-			self.active = 0 # Off
-			self.errorcode = 5 # Capacity not set
-			self.targetsoc = None
-			return True
+			return 5 # Capacity not set
 
 		# In Keep-Charged mode or external control, no point in doing anything
 		if BatteryLife.instance.state == BatteryLifeState.KeepCharged or self.hub4mode == 3:
+			return 2 # ESS mode is wrong
+
+		return None
+
+	def _update(self):
+		""" Runs the control loop. Returns True while it has to run every
+		    INTERVAL seconds. In Auto mode, outside the slots, it only has
+		    to run again when the next slot starts. """
+		# If DESS was disabled, deactivate and kill timer.
+		if self.mode == 0:
+			self.deactivate(0) # No error
+			self._wake_at(None)
+			return False
+
+		error = self._error()
+		if error is not None:
 			self.active = 0 # Off
-			self.errorcode = 2 # ESS mode is wrong
+			self.errorcode = error
 			self.targetsoc = None
 			return True
 
@@ -256,72 +365,76 @@ class DynamicEss(SystemCalcDelegate):
 
 		# self.mode == 1 or self.mode == 4 (Auto) below here
 		now = self._get_time()
-		for w in self.windows():
-			if now in w:
-				self.active = 1 # Auto
-
-				if self.targetsoc != w.soc:
-					self.chargerate = None # For recalculation
-				self.targetsoc = w.soc
-
-				# If schedule allows for feed-in, enable that now.
-				self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/FeedInExcess',
-					2 if w.allow_feedin else 1)
-
-				if self.soc + self.charge_hysteresis < w.soc: # Charge
-					self.charge_hysteresis = 0
+		w = self.schedule.find(now)
+		self._wake_at(self.schedule.next_boundary(now))
+		if w is not None:
+			self.active = 1 # Auto
+
+			if w is not self._window:
+				self.chargerate = None # New slot, recalculate
+			self._window = w
+			self.targetsoc = w.soc
+
+			# If schedule allows for feed-in, enable that now.
+			self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/FeedInExcess',
+				2 if w.allow_feedin else 1)
+
+			if self.soc + self.charge_hysteresis < w.soc: # Charge
+				self.charge_hysteresis = 0
+				self.discharge_hysteresis = 0
+				self.errorcode = 0 # No error
+				self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/Setpoint', None)
+				self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/ForceCharge', 1)
+				self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxDischargePower', -1.0)
+
+				# Calculate how fast to buy. Multi is given the remainder
+				# after subtracting PV power.
+				self.update_chargerate(now, w.stop, abs(self.soc - w.soc))
+				self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxChargePower',
+					max(0.0, self.chargerate - self.pvpower) if self.batteryimport else self.acpv)
+			else: # Discharge or idle
+				self.charge_hysteresis = 1
+				self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxChargePower', -1.0)
+				self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/ForceCharge', 0)
+
+				self.errorcode = 0 # No error
+				if self.soc - self.discharge_hysteresis > max(w.soc, self.minsoc): # Discharge
 					self.discharge_hysteresis = 0
-					self.errorcode = 0 # No error
-					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/Setpoint', None)
-					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/ForceCharge', 1)
-					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxDischargePower', -1.0)
 
-					# Calculate how fast to buy. Multi is given the remainder
-					# after subtracting PV power.
+					# Calculate how fast to sell. If exporting the battery
+					# to the grid is allowed, then export chargerate plus
+					# whatever DC-coupled PV is making. If exporting the
+					# battery is not allowed, then limit that to DC-coupled
+					# PV plus local consumption.
 					self.update_chargerate(now, w.stop, abs(self.soc - w.soc))
-					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxChargePower',
-						max(0.0, self.chargerate - self.pvpower) if self.batteryimport else self.acpv)
-				else: # Discharge or idle
-					self.charge_hysteresis = 1
-					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxChargePower', -1.0)
-					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/ForceCharge', 0)
-
-					self.errorcode = 0 # No error
-					if self.soc - self.discharge_hysteresis > max(w.soc, self.minsoc): # Discharge
-						self.discharge_hysteresis = 0
-
-						# Calculate how fast to sell. If exporting the battery
-						# to the grid is allowed, then export chargerate plus
-						# whatever DC-coupled PV is making. If exporting the
-						# battery is not allowed, then limit that to DC-coupled
-						# PV plus local consumption.
-						self.update_chargerate(now, w.stop, abs(self.soc - w.soc))
-						self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxDischargePower',
-							(self.chargerate + self.pvpower
-								if self.chargerate else -1.0) if self.batteryexport \
-							else self.pvpower + self.consumption + 1.0) # 1.0 to allow selling overvoltage
-					else: # battery idle
-						# SOC/target-soc needs to move 1% to move out of idle
-						# zone
-						self.discharge_hysteresis = 1
-						# This keeps battery idle by not allowing more power
-						# to be taken from the DC bus than what DC-coupled
-						# PV provides.
-						self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxDischargePower',
-							max(1.0, round(0.9*self.pvpower)))
-
-					# If Feed-in is requested, set a large negative setpoint.
-					# The battery limit above will ensure that no more than
-					# available PV is fed in.
-					if w.allow_feedin:
-						self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/Setpoint', self.maxfeedinpower)
-					else:
-						self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/Setpoint', None) # Normal ESS
-				break # out of for loop
+					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxDischargePower',
+						(self.chargerate + self.pvpower
+							if self.chargerate else -1.0) if self.batteryexport \
+						else self.pvpower + self.consumption + 1.0) # 1.0 to allow selling overvoltage
+				else: # battery idle
+					# SOC/target-soc needs to move 1% to move out of idle
+					# zone
+					self.discharge_hysteresis = 1
+					# This keeps battery idle by not allowing more power
+					# to be taken from the DC bus than what DC-coupled
+					# PV provides.
+					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxDischargePower',
+						max(1.0, round(0.9*self.pvpower)))
+
+				# If Feed-in is requested, set a large negative setpoint.
+				# The battery limit above will ensure that no more than
+				# available PV is fed in.
+				if w.allow_feedin:
+					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/Setpoint', self.maxfeedinpower)
+				else:
+					self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/Setpoint', None) # Normal ESS
 		else:
-			# No matching windows
-			if self.active:
+			# No matching windows. Also replaces an error that no longer
+			# applies.
+			self._window = None
+			if self.active or self.errorcode not in (0, 3):
 				self.deactivate(3)
+			return False
 
 		return True
 
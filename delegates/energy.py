@@ -0,0 +1,82 @@
+from time import monotonic
+
+# Victron packages
+from delegates.base import SystemCalcDelegate
+from persist import PersistentStore
+
+PHASES = ('L1', 'L2', 'L3')
+
+def _flows():
+	""" Yields (energy path, power path, direction). A direction of 1
+	    counts positive power, -1 counts negative power. """
+	for phase in PHASES:
+		power = '/Ac/Grid/{}/Power'.format(phase)
+		yield '/Energy/Ac/Grid/{}/Import'.format(phase), power, 1
+		yield '/Energy/Ac/Grid/{}/Export'.format(phase), power, -1
+		for flow in ('ConsumptionOnInput', 'ConsumptionOnOutput', 'PvOnGrid',
+				'PvOnGenset', 'PvOnOutput'):
+			yield ('/Energy/Ac/{}/{}'.format(flow, phase),
+				'/Ac/{}/{}/Power'.format(flow, phase), 1)
+	yield '/Energy/Dc/Pv', '/Dc/Pv/Power', 1
+	yield '/Energy/Dc/Battery/Charged', '/Dc/Battery/Power', 1
+	yield '/Energy/Dc/Battery/Discharged', '/Dc/Battery/Power', -1
+	yield '/Energy/Dc/System', '/Dc/System/Power', 1
+
+FLOWS = list(_flows())
+
+class Integrator(object):
+	""" Integrates power in W into energy in kWh. Power is only sampled
+	    when something changed, so a sample holds until the tick before
+	    the next one, and the last tick interval is integrated with the
+	    trapezoidal rule. Intervals where the power is unknown at either
+	    end are left out. """
+	def __init__(self, direction, energy=0.0):
+		self.direction = direction
+		self.energy = energy
+		self.power = None
+
+	def update(self, power, dt, tick=1.0):
+		if power is not None:
+			power = max(0.0, power * self.direction)
+			if self.power is not None:
+				ramp = min(dt, tick)
+				self.energy += (self.power * (dt - ramp) +
+					(self.power + power) * ramp / 2) / 3600000.0
+		self.power = power
+
+class EnergyCounters(SystemCalcDelegate):
+	""" Integrates the published power values into kWh counters under
+	    /Energy, so that consumers need not sample the power at a high
+	    rate to work out energy. The counters only go up, and are kept in a
+	    PersistentStore so that they survive a restart. """
+
+	# So we can override it in testing
+	_get_time = lambda s: monotonic()
+
+	def __init__(self):
+		super(EnergyCounters, self).__init__()
+		self._integrators = {}
+		self._lastrun = None
+		self._store = None
+
+	def set_sources(self, dbusmonitor, settings, dbusservice):
+		super(EnergyCounters, self).set_sources(dbusmonitor, settings, dbusservice)
+		self._store = PersistentStore('energy', [(path, 1) for path, _, _ in FLOWS])
+		self._integrators = {path: Integrator(direction, self._store[path][0])
+			for path, _, direction in FLOWS}
+
+	def get_output(self):
+		return [(path, {'gettext': '%.3F kWh'}) for path, _, _ in FLOWS]
+
+	def update_values(self, newvalues):
+		now = self._get_time()
+		dt = 0 if self._lastrun is None else now - self._lastrun
+		self._lastrun = now
+
+		for path, power, _ in FLOWS:
+			integrator = self._integrators[path]
+			integrator.update(newvalues.get(power), dt)
+			self._store[path][0] = integrator.energy
+			# Whole Wh, so that the counters only change on D-Bus when
+			# there is something to tell.
+			newvalues[path] = round(integrator.energy, 3)
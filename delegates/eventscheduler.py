@@ -0,0 +1,129 @@
+import os
+from datetime import datetime, timedelta
+from heapq import heapify, heappush, heappop
+from itertools import count
+from math import ceil
+from gi.repository import GLib
+
+# Victron packages
+from ve_utils import exit_on_error
+from delegates.base import SystemCalcDelegate
+
+# Never sleep longer than this, so that a clock that is set, or a time
+# zone change we did not notice, is corrected for within the hour.
+MAX_SLEEP = 3600
+
+class Event(object):
+	def __init__(self, when, callback, repeat=None):
+		self.when = when
+		self.callback = callback
+		self.repeat = repeat
+
+	def __repr__(self):
+		return "Event at {}: {}".format(self.when, self.callback)
+
+def daily(t):
+	""" Returns a function that gives the next time after now that the
+	    local time of day is t. """
+	def _next(now):
+		d = datetime.combine(now.date(), t)
+		return d if d > now else d + timedelta(days=1)
+	return _next
+
+def delay_to(when, now):
+	""" Seconds from now until when, both local times. If the UTC offset
+	    changes in between, the wall clock jumps, take that into account. """
+	shift = when.astimezone().utcoffset() - now.astimezone().utcoffset()
+	return (when - now - shift).total_seconds()
+
+class EventScheduler(SystemCalcDelegate):
+	""" Calls back delegates at a given local time, instead of having them
+	    poll the clock. A single one-shot timer is armed for the earliest
+	    event. Times are naive local datetimes, as returned by
+	    datetime.now(), and are converted to a delay only when the timer is
+	    armed, so that DST and time zone changes are taken into account.
+	    The timer is only armed again when the earliest event changes.
+	    Cancelled events stay in the heap until they are due, unless there
+	    are many of them. """
+
+	_get_time = datetime.now
+
+	def __init__(self):
+		super(EventScheduler, self).__init__()
+		self._events = [] # heap of (when, seq, event)
+		self._seq = count()
+		self._timer = None
+		self._armed = None # When the timer is armed for
+		self._dead = 0 # Cancelled events still in the heap
+		self._tz = os.environ.get('TZ')
+
+	def at(self, when, callback):
+		""" Calls callback(now) once at datetime when. Returns the event,
+		    which can be passed to cancel. """
+		return self._add(Event(when, callback))
+
+	def every_day(self, t, callback):
+		""" Calls callback(now) every day at local time of day t. """
+		repeat = daily(t)
+		return self._add(Event(repeat(self._get_time()), callback, repeat))
+
+	def cancel(self, event):
+		if event is None or event.callback is None:
+			return # Already done, or cancelled
+		event.callback = None
+		self._dead += 1
+		if 3 * self._dead > len(self._events): # more than half of the live ones
+			self._events = [e for e in self._events if e[2].callback is not None]
+			heapify(self._events)
+			self._dead = 0
+		self._arm()
+
+	def _add(self, event):
+		heappush(self._events, (event.when, next(self._seq), event))
+		self._arm()
+		return event
+
+	def _arm(self, force=False):
+		while self._events and self._events[0][2].callback is None:
+			heappop(self._events)
+			self._dead -= 1
+
+		when = self._events[0][0] if self._events else None
+		if self._timer is not None:
+			if when == self._armed and not force:
+				return
+			GLib.source_remove(self._timer)
+			self._timer = None
+
+		self._armed = when
+		if self._events:
+			delay = max(0, min(delay_to(self._events[0][0], self._get_time()),
+				MAX_SLEEP))
+			self._timer = GLib.timeout_add(int(ceil(delay * 1000)),
+				exit_on_error, self._on_timer)
+
+	def _on_timer(self):
+		self._timer = None
+		now = self._get_time()
+		while self._events and self._events[0][0] <= now:
+			when, seq, event = heappop(self._events)
+			callback = event.callback
+			if callback is None:
+				self._dead -= 1
+				continue # cancelled
+			if event.repeat is not None:
+				event.when = event.repeat(now)
+				heappush(self._events, (event.when, next(self._seq), event))
+			else:
+				event.callback = None # Done, cancelling it does nothing
+			callback(now)
+		self._arm()
+		return False
+
+	def update_values(self, newvalues):
+		# The core sets TZ when the time zone setting changes, the local
+		# times of the events now map to different delays.
+		tz = os.environ.get('TZ')
+		if tz != self._tz:
+			self._tz = tz
+			self._arm(force=True)
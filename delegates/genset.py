@@ -38,7 +38,7 @@ class GensetStartStop(SystemCalcDelegate):
 	def starttime(self, v):
 		self._dbusservice['{}/LastStartTime'.format(PREFIX)] = v
 
-	def update_values(self, newvalues):
+	def on_paths_changed(self, newvalues, changed):
 		for service in sorted(self._dbusmonitor.get_service_list('com.victronenergy.generator')):
 			rbc = self._dbusmonitor.get_value(service, '/RunningByConditionCode')
 			if rbc is not None:
@@ -0,0 +1,201 @@
+from array import array
+from time import time
+import dbus.service
+from gi.repository import GLib
+
+# Victron packages
+from ve_utils import exit_on_error
+from delegates.base import SystemCalcDelegate
+from persist import PersistentStore
+
+NaN = float('nan')
+
+# (interval in seconds, number of intervals kept)
+RESOLUTIONS = (
+	(1, 600),       # 10 minutes
+	(60, 1440),     # 24 hours
+	(900, 672))     # 7 days
+
+# Only the coarsest resolution is copied to flash, the others are kept in
+# tmpfs only, they are not worth the wear.
+FLASH_RESOLUTION = 900
+SYNC_INTERVAL = 3600000 # an hour
+
+HISTORY_PATHS = (
+	'/Dc/Battery/Power',
+	'/Dc/Battery/Soc',
+	'/Dc/Pv/Power',
+	'/Ac/Consumption/L1/Power',
+	'/Ac/Consumption/L2/Power',
+	'/Ac/Consumption/L3/Power',
+	'/Ac/Grid/L1/Power',
+	'/Ac/Grid/L2/Power',
+	'/Ac/Grid/L3/Power')
+
+class Series(object):
+	""" Keeps the min, max and mean of a value over the last length
+	    intervals, in ring buffers indexed by interval number. The interval
+	    in progress is aggregated as samples come in, and stored when the
+	    next one starts. Intervals without samples are NaN. If the clock
+	    goes back, what was kept for the intervals from then on is dropped.
+
+	    buf is a memoryview of size(length) doubles to keep everything in,
+	    as it comes from a PersistentStore. If fresh, it is cleared first. """
+	STATE = 5 # interval in progress, count, sum, min, max
+
+	@classmethod
+	def size(klass, length):
+		return 3 * length + klass.STATE
+
+	def __init__(self, interval, length, buf, fresh=True):
+		self.interval = interval
+		self.length = length
+		if fresh:
+			buf[:] = array('d', [NaN]) * self.size(length)
+		self.min = buf[:length]
+		self.max = buf[length:2 * length]
+		self.mean = buf[2 * length:3 * length]
+		self._state = buf[3 * length:]
+
+		current, n, total, low, high = self._state
+		if current != current: # NaN, nothing kept
+			self._current = None
+			self._reset()
+		else:
+			self._current = int(current)
+			self._n, self._sum, self._min, self._max = int(n), total, low, high
+
+	def _reset(self):
+		self._n = 0
+		self._sum = 0.0
+		self._min = NaN
+		self._max = NaN
+
+	def _save(self):
+		self._state[0] = self._current
+		self._state[1] = self._n
+		self._state[2] = self._sum
+		self._state[3] = self._min
+		self._state[4] = self._max
+
+	def _store(self):
+		i = self._current % self.length
+		if self._n:
+			self.min[i] = self._min
+			self.max[i] = self._max
+			self.mean[i] = self._sum / self._n
+		else:
+			self.min[i] = self.max[i] = self.mean[i] = NaN
+
+	def _advance(self, current):
+		if self._current is not None and current < self._current:
+			# The clock went back, the intervals from current on are in
+			# the future now.
+			for c in range(max(current, self._current + 1 - self.length), self._current + 1):
+				i = c % self.length
+				self.min[i] = self.max[i] = self.mean[i] = NaN
+			self._reset()
+		elif self._current is not None and current != self._current:
+			self._store()
+			self._reset()
+			# Blank out the intervals in which nothing was added
+			for c in range(max(self._current + 1, current - self.length), current):
+				i = c % self.length
+				self.min[i] = self.max[i] = self.mean[i] = NaN
+		self._current = current
+
+	def add(self, t, value):
+		self._advance(int(t // self.interval))
+		if value is not None:
+			if self._n:
+				self._min = min(self._min, value)
+				self._max = max(self._max, value)
+			else:
+				self._min = self._max = value
+			self._n += 1
+			self._sum += value
+		self._save()
+
+	def get(self, t):
+		""" Returns (start, mins, maxs, means) for the length intervals up
+		    to and including the one in progress at t, oldest first. """
+		self._advance(int(t // self.interval))
+		self._save()
+		self._store()
+		first = self._current + 1 - self.length
+		i = first % self.length
+		return (first * self.interval,
+			self.min[i:].tolist() + self.min[:i].tolist(),
+			self.max[i:].tolist() + self.max[:i].tolist(),
+			self.mean[i:].tolist() + self.mean[:i].tolist())
+
+class HistoryObject(dbus.service.Object):
+	""" Serves the series of a path in one call, so that graphs do not
+	    have to poll the values. """
+	def __init__(self, bus, history):
+		super(HistoryObject, self).__init__(bus, '/History')
+		self._history = history
+
+	@dbus.service.method('com.victronenergy.History', in_signature='',
+		out_signature='as')
+	def GetPaths(self):
+		return sorted(self._history.series)
+
+	@dbus.service.method('com.victronenergy.History', in_signature='su',
+		out_signature='dadadad')
+	def GetSeries(self, path, interval):
+		return self._history.get(str(path), int(interval))
+
+class History(SystemCalcDelegate):
+	""" Samples some of the published values every second and keeps their
+	    history in memory at several resolutions, see RESOLUTIONS. The
+	    history is kept in PersistentStores so that it survives a restart,
+	    and a reboot for FLASH_RESOLUTION. """
+
+	# So we can override it in testing
+	_get_time = lambda s: time()
+
+	def __init__(self):
+		super(History, self).__init__()
+		self.series = {}
+		self._stores = None
+		self._object = None
+
+	def set_sources(self, dbusmonitor, settings, dbusservice):
+		super(History, self).set_sources(dbusmonitor, settings, dbusservice)
+		fine = [(i, l) for i, l in RESOLUTIONS if i != FLASH_RESOLUTION]
+		coarse = [(i, l) for i, l in RESOLUTIONS if i == FLASH_RESOLUTION]
+		self._stores = (
+			(fine, PersistentStore('history', [('{}@{}'.format(path, i),
+				Series.size(l)) for path in HISTORY_PATHS for i, l in fine],
+				sync_interval=None)),
+			(coarse, PersistentStore('history-coarse', [('{}@{}'.format(path, i),
+				Series.size(l)) for path in HISTORY_PATHS for i, l in coarse],
+				sync_interval=SYNC_INTERVAL)))
+		self.series = {path: {} for path in HISTORY_PATHS}
+		for resolutions, store in self._stores:
+			for path in HISTORY_PATHS:
+				for interval, length in resolutions:
+					self.series[path][interval] = Series(interval, length,
+						store['{}@{}'.format(path, interval)], not store.restored)
+
+		# Only a real service has a bus to export the method on
+		if dbusservice.bus is not None:
+			self._object = HistoryObject(dbusservice.bus, self)
+		GLib.timeout_add(1000, exit_on_error, self._on_timer)
+
+	def _on_timer(self):
+		now = self._get_time()
+		for path, series in self.series.items():
+			try:
+				value = self._dbusservice[path]
+			except KeyError:
+				value = None
+			for s in series.values():
+				s.add(now, value)
+		return True
+
+	def get(self, path, interval):
+		""" Returns (start, mins, maxs, means) of path at interval seconds.
+		    Raises KeyError if there is no such history. """
+		return self.series[path][interval].get(self._get_time())
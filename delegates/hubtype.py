@@ -8,6 +8,10 @@ class HubTypeSelect(SystemCalcDelegate):
 	def get_output(self):
 		return [('/Hub', {'gettext': '%s'}), ('/SystemType', {'gettext': '%s'})]
 
+	def get_upstream(self):
+		return ['/Dc/Pv/Power', '/Ac/PvOnOutput/NumberOfPhases',
+			'/Ac/PvOnGrid/NumberOfPhases', '/Ac/PvOnGenset/NumberOfPhases']
+
 	def get_multi(self):
 		services = sorted(self._dbusmonitor.get_service_list('com.victronenergy.vebus').items(),
 			key=lambda x: x[1])
@@ -15,7 +19,7 @@ class HubTypeSelect(SystemCalcDelegate):
 			return services[0][0]
 		return None
 
-	def update_values(self, newvalues):
+	def on_paths_changed(self, newvalues, changed):
 		# The code below should be executed after PV inverter data has been updated, because we need the
 		# PV inverter total power to update the consumption.
 		hub = None
@@ -1,6 +1,7 @@
 import logging
 from dbus.exceptions import DBusException
 from delegates.base import SystemCalcDelegate
+from sc_utils import RollingWindow
 
 class LgCircuitBreakerDetect(SystemCalcDelegate):
 	def __init__(self):
@@ -17,7 +18,7 @@ class LgCircuitBreakerDetect(SystemCalcDelegate):
 		if service_type == 'battery' and self._dbusmonitor.get_value(service, '/ProductId') == 0xB004:
 			logging.info('LG battery service appeared: %s' % service)
 			self._lg_battery = service
-			self._lg_voltage_buffer = []
+			self._lg_voltage_buffer = RollingWindow(40)
 			self._dbusservice['/Dc/Battery/Alarms/CircuitBreakerTripped'] = 0
 
 	def device_removed(self, service, instance):
@@ -35,25 +36,23 @@ class LgCircuitBreakerDetect(SystemCalcDelegate):
 		if battery_current is None or abs(battery_current) > 0.01:
 			if len(self._lg_voltage_buffer) > 0:
 				logging.debug('LG voltage buffer reset')
-				self._lg_voltage_buffer = []
+				self._lg_voltage_buffer.clear()
 			return
 		vebus_voltage = self._dbusmonitor.get_value(vebus_path, '/Dc/0/Voltage')
 		if vebus_voltage is None:
 			return
 		self._lg_voltage_buffer.append(float(vebus_voltage))
-		if len(self._lg_voltage_buffer) > 40:
-			self._lg_voltage_buffer = self._lg_voltage_buffer[-40:]
-		elif len(self._lg_voltage_buffer) < 20:
+		if len(self._lg_voltage_buffer) < 20:
 			return
-		min_voltage = min(self._lg_voltage_buffer)
-		max_voltage = max(self._lg_voltage_buffer)
+		min_voltage = self._lg_voltage_buffer.min
+		max_voltage = self._lg_voltage_buffer.max
 		battery_voltage = self._dbusmonitor.get_value(self._lg_battery, '/Dc/0/Voltage')
 		logging.debug('LG battery current V=%s I=%s' % (battery_voltage, battery_current))
 		if min_voltage < 0.9 * battery_voltage or max_voltage > 1.1 * battery_voltage:
 			logging.error('LG shutdown detected V=%s I=%s %s' %
-				(battery_voltage, battery_current, self._lg_voltage_buffer))
+				(battery_voltage, battery_current, list(self._lg_voltage_buffer)))
 			self._dbusservice['/Dc/Battery/Alarms/CircuitBreakerTripped'] = 2
-			self._lg_voltage_buffer = []
+			self._lg_voltage_buffer.clear()
 			try:
 				self._dbusmonitor.set_value(vebus_path, '/Mode', 4)
 			except DBusException:
@@ -1,6 +1,45 @@
+from functools import partial
 from ve_utils import get_product_id
 from delegates.base import SystemCalcDelegate
 
+PHASES = ('L1', 'L2', 'L3')
+
+# Published under /VebusSystems/<instance> for every VE.Bus system
+SYSTEM_PATHS = ['/Service', '/Dc/Voltage', '/Dc/Current', '/Dc/Power',
+	'/Ac/ActiveIn/Source'] + [
+	'/Ac/{}/{}/{}'.format(a, phase, q) for a in ('ActiveIn', 'Out')
+		for phase in PHASES for q in ('Power', 'Current')]
+
+class Snapshot(object):
+	""" The values of a VE.Bus system, read once per update so that the
+	    system and the subtrees do not look them up again. """
+	def __init__(self, multi):
+		get = partial(multi.monitor.get_value, multi.service)
+		self.service = multi.service
+		self.instance = multi.instance
+		self.dc_voltage = get('/Dc/0/Voltage')
+		self.dc_current = get('/Dc/0/Current')
+		self.dc_power = get('/Dc/0/Power')
+		# Just in case /Dc/0/Power is not available
+		if self.dc_power is None and None not in (self.dc_voltage, self.dc_current):
+			self.dc_power = self.dc_voltage * self.dc_current
+
+		self.active_input = get('/Ac/ActiveIn/ActiveInput')
+		if self.active_input == 0xF0:
+			# Not connected
+			self.ac_in_source = 240
+		elif self.active_input is not None:
+			self.ac_in_source = multi.monitor.get_value('com.victronenergy.settings',
+				'/Settings/SystemSetup/AcInput%s' % (self.active_input + 1))
+		else:
+			self.ac_in_source = None
+
+		# Power and current per phase on the active input and the output
+		self.ac_in = {phase: (get('/Ac/ActiveIn/%s/P' % phase),
+			get('/Ac/ActiveIn/%s/I' % phase)) for phase in PHASES}
+		self.ac_out = {phase: (get('/Ac/Out/%s/P' % phase),
+			get('/Ac/Out/%s/I' % phase)) for phase in PHASES}
+
 class Service(object):
 	def __init__(self, monitor, service, instance):
 		self.monitor = monitor
@@ -42,6 +81,8 @@ class Multi(SystemCalcDelegate):
 		self.multis = {}
 		self.multi = None # The actual Multi that is connected and working
 		self.vebus_service = None # The VE.Bus service, Multi could be offline
+		self._systems = {} # service: path prefix of its subtree
+		self.snapshots = {} # service: Snapshot, taken once per update
 
 		# Determine if this platform has a built-in MK2/3. Maxi-GX
 		# and generic (Raspberry Pi) does not.
@@ -66,11 +107,47 @@ class Multi(SystemCalcDelegate):
 			self.multis[service] = Service(self._dbusmonitor, service, instance)
 			self._dbusmonitor.track_value(service, "/Connected", self._set_multi)
 			self._set_multi()
+			self._add_system(service, instance)
 
 	def device_removed(self, service, instance):
 		if service in self.multis:
 			del self.multis[service]
 			self._set_multi()
+			self._remove_system(service)
+
+	def _add_system(self, service, instance):
+		prefix = '/VebusSystems/{}'.format(instance)
+		if instance is None or prefix in self._systems.values():
+			return
+		self._systems[service] = prefix
+		for path in SYSTEM_PATHS:
+			self._dbusservice.add_path(prefix + path, value=None)
+		self._dbusservice[prefix + '/Service'] = service
+
+	def _remove_system(self, service):
+		prefix = self._systems.pop(service, None)
+		if prefix is not None:
+			for path in SYSTEM_PATHS:
+				del self._dbusservice[prefix + path]
+
+	def take_snapshots(self):
+		""" Reads the values of every VE.Bus system for this update. Called
+		    by the system before the delegates are updated. """
+		self.snapshots = {service: Snapshot(multi)
+			for service, multi in self.multis.items()}
+		return self.snapshots
+
+	def _system_values(self, snapshot):
+		""" The values the system uses for its Multi, for any VE.Bus
+		    system. """
+		yield '/Dc/Voltage', snapshot.dc_voltage
+		yield '/Dc/Current', snapshot.dc_current
+		yield '/Dc/Power', snapshot.dc_power
+		yield '/Ac/ActiveIn/Source', snapshot.ac_in_source
+		for phase in PHASES:
+			for a, (p, i) in (('ActiveIn', snapshot.ac_in[phase]), ('Out', snapshot.ac_out[phase])):
+				yield '/Ac/{}/{}/Power'.format(a, phase), p
+				yield '/Ac/{}/{}/Current'.format(a, phase), i
 
 	def _set_multi(self, *args, **kwargs):
 		# If platform has an onboard mkx, use only that as VE.Bus service.
@@ -100,3 +177,11 @@ class Multi(SystemCalcDelegate):
 
 		newvalues['/VebusService'] = getattr(self.multi, 'service', None)
 		newvalues['/VebusInstance'] = getattr(self.multi, 'instance', None)
+
+		with self._dbusservice as s:
+			for service, prefix in self._systems.items():
+				snapshot = self.snapshots.get(service)
+				if snapshot is None: # Added since the snapshots were taken
+					snapshot = self.snapshots[service] = Snapshot(self.multis[service])
+				for path, value in self._system_values(snapshot):
+					s[prefix + path] = value
@@ -1,10 +1,22 @@
 from delegates.base import SystemCalcDelegate
-from sc_utils import safeadd
 
 class PvInverters(SystemCalcDelegate):
+	""" Totals the PV inverter power and current per AC position. The
+	    position of each inverter is looked up once, and again when its
+	    /Position or the AC input settings change. When an inverter reports
+	    new values, only the totals it adds to are summed again, so that
+	    the work per update does not grow with the number of inverters. """
+	_paths = ['/Ac/L%s/%s' % (phase, q) for phase in range(1, 4)
+		for q in ('Power', 'Current')]
+
 	def __init__(self):
 		super(PvInverters, self).__init__()
 		self.pvinverters = set()
+		self._positions = {} # service: position, eg /Ac/PvOnGrid
+		self._contributions = {} # service: {path: value}
+		self._sources = {} # path: services that add to it
+		self._totals = {} # path: total
+		self._acinputs = None
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(PvInverters, self).set_sources(dbusmonitor, settings, dbusservice)
@@ -50,11 +62,19 @@ class PvInverters(SystemCalcDelegate):
 	def device_added(self, service, instance, *args):
 		if service.startswith('com.victronenergy.pvinverter.'):
 			self.pvinverters.add(service)
+			self._dbusmonitor.track_value(service, '/Position',
+				self._on_position_changed, service)
+			for path in self._paths:
+				self._dbusmonitor.track_value(service, path,
+					self._on_value_changed, service)
+			self._on_position_changed(service)
 			self._updatepvinverterspidlist()
 
 	def device_removed(self, service, instance):
 		if service in self.pvinverters:
 			self.pvinverters.discard(service)
+			self._positions.pop(service, None)
+			self._apply(service)
 			self._updatepvinverterspidlist()
 
 	def _updatepvinverterspidlist(self):
@@ -79,22 +99,52 @@ class PvInverters(SystemCalcDelegate):
 			2: '/Ac/PvOnGenset',
 			3: '/Ac/PvOnGrid'}.get(s)
 
+	def _on_position_changed(self, service, *args):
+		pos = self._dbusmonitor.get_value(service, '/Position')
+		self._positions[service] = None if pos is None else self.map_position(pos)
+		self._apply(service)
+
+	def _on_value_changed(self, service, *args):
+		self._apply(service)
+
+	def _apply(self, service):
+		""" Replace what service adds to the totals by its current
+		    values. """
+		old = self._contributions.pop(service, {})
+		for path in old:
+			self._sources[path].discard(service)
+
+		contribution = {}
+		position = self._positions.get(service)
+		if position is not None:
+			for path in self._paths:
+				v = self._dbusmonitor.get_value(service, path)
+				if v is not None:
+					contribution[position + path[3:]] = v
+			self._contributions[service] = contribution
+		for path in contribution:
+			self._sources.setdefault(path, set()).add(service)
+
+		# Sum the totals again rather than adjust them, so that they do
+		# not drift with float rounding.
+		for path in old.keys() | contribution.keys():
+			sources = self._sources.get(path)
+			if sources:
+				self._totals[path] = sum(self._contributions[s][path] for s in sources)
+			else:
+				self._sources.pop(path, None)
+				self._totals.pop(path, None)
+
 	def get_totals(self):
-		newvalues = {}
-		for pvinverter in self.pvinverters:
-			# Position will be None if PV inverter service has just been removed (after retrieving the
-			# service list).
-			pos = self._dbusmonitor.get_value(pvinverter, '/Position')
-			if pos is not None and (position := self.map_position(pos)) is not None:
-				for phase in range(1, 4):
-					power = self._dbusmonitor.get_value(pvinverter, '/Ac/L%s/Power' % phase)
-					if power is not None:
-						path = '%s/L%s/Power' % (position, phase)
-						newvalues[path] = safeadd(newvalues.get(path), power)
-
-					current = self._dbusmonitor.get_value(pvinverter, '/Ac/L%s/Current' % phase)
-					if current is not None:
-						path = '%s/L%s/Current' % (position, phase)
-						newvalues[path] = safeadd(newvalues.get(path), current)
-
-		return newvalues
+		# The AC input settings are not tracked, check them here
+		acinputs = (
+			self._dbusmonitor.get_value('com.victronenergy.settings',
+				'/Settings/SystemSetup/AcInput1'),
+			self._dbusmonitor.get_value('com.victronenergy.settings',
+				'/Settings/SystemSetup/AcInput2'))
+		if acinputs != self._acinputs:
+			self._acinputs = acinputs
+			for service in self.pvinverters:
+				self._on_position_changed(service)
+
+		return dict(self._totals)
@@ -2,10 +2,13 @@ from __future__ import division
 import logging
 from gi.repository import GLib
 from datetime import datetime, timedelta, time
+from bisect import bisect_right
+from heapq import heappush, heappop
 
 # Victron packages
 from ve_utils import exit_on_error
 from delegates.base import SystemCalcDelegate
+from delegates.eventscheduler import EventScheduler
 from delegates.batterylife import BatteryLife, BLPATH
 from delegates.batterylife import State as BatteryLifeState
 from delegates.dvcc import Dvcc
@@ -91,6 +94,40 @@ class ScheduledChargeWindow(ScheduledWindow):
 		return "Start charge: {}, Stop: {}, Soc: {}".format(
 			self.start, self.stop, self.soc)
 
+class ScheduledWindowIndex(object):
+	""" Splits a list of windows into sorted intervals that do not overlap,
+	    so that the window for a point in time can be found with a bisect.
+	    Where windows overlap, the one earlier in the list wins. """
+	def __init__(self, windows):
+		windows = [w for w in windows if w.start < w.stop]
+		order = sorted(range(len(windows)), key=lambda i: windows[i].start)
+		self.bounds = sorted(set(t for w in windows for t in (w.start, w.stop)))
+		self.windows = []
+
+		# Sweep over the boundaries, keeping the windows that started on a
+		# heap ordered by their position in the list.
+		active = []
+		j = 0
+		for b in self.bounds[:-1]:
+			while j < len(order) and windows[order[j]].start <= b:
+				heappush(active, (order[j], windows[order[j]]))
+				j += 1
+			while active and active[0][1].stop <= b:
+				heappop(active)
+			self.windows.append(active[0][1] if active else None)
+
+	def find(self, t):
+		i = bisect_right(self.bounds, t) - 1
+		if 0 <= i < len(self.windows):
+			return self.windows[i]
+		return None
+
+	def next_boundary(self, t):
+		i = bisect_right(self.bounds, t)
+		if i < len(self.bounds):
+			return self.bounds[i]
+		return None
+
 class ScheduledCharging(SystemCalcDelegate):
 	""" Let the system do other things based on time schedule. """
 
@@ -101,6 +138,9 @@ class ScheduledCharging(SystemCalcDelegate):
 		self.pvpower = 0
 		self.active = False
 		self.hysteresis = True
+		self._index = None
+		self._index_day = None
+		self._event = None
 		self._timer = GLib.timeout_add(5000, exit_on_error, self._on_timer)
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
@@ -115,6 +155,10 @@ class ScheduledCharging(SystemCalcDelegate):
 		]
 
 	def settings_changed(self, setting, oldvalue, newvalue):
+		if setting.startswith("schedule_"):
+			self._index = None
+			self._wake_at(self._get_time())
+
 		if setting.startswith("schedule_soc_"):
 			# target SOC was modified. Disable the hysteresis on the next
 			# run.
@@ -159,6 +203,36 @@ class ScheduledCharging(SystemCalcDelegate):
 		discharges = (self._settings['schedule_discharge_{}'.format(i)] for i in range(NUM_SCHEDULES))
 		return self._charge_windows(today, days, starttimes, durations, stopsocs, discharges)
 
+	def _window_index(self, today):
+		""" The windows only change with the settings or the day, so keep
+		    the index until one of those does. """
+		if self._index is None or self._index_day != today:
+			self._index = ScheduledWindowIndex(self.charge_windows(today))
+			self._index_day = today
+		return self._index
+
+	def _wake_at(self, when):
+		""" Run the control loop at when, even if it is not polling. """
+		if self._event is not None and self._event.when == when:
+			return
+		EventScheduler.instance.cancel(self._event)
+		self._event = EventScheduler.instance.at(when, self._on_event)
+
+	def _on_event(self, now):
+		self._event = None
+		if self._update():
+			if self._timer is None:
+				self._timer = GLib.timeout_add(5000, exit_on_error, self._on_timer)
+		elif self._timer is not None:
+			GLib.source_remove(self._timer)
+			self._timer = None
+
+	def _on_timer(self):
+		if self._update():
+			return True
+		self._timer = None
+		return False
+
 	@property
 	def forcecharge(self):
 		return self._dbusmonitor.get_value(HUB4_SERVICE, '/Overrides/ForceCharge')
@@ -176,7 +250,10 @@ class ScheduledCharging(SystemCalcDelegate):
 	def maxdischargepower(self, v):
 		return self._dbusmonitor.set_value_async(HUB4_SERVICE, '/Overrides/MaxDischargePower', v)
 
-	def _on_timer(self):
+	def _update(self):
+		""" Runs the control loop. Returns True while it has to run every 5
+		    seconds, False while outside a window, where it only has to run
+		    again when the next window starts. """
 		if self.soc is None:
 			return True
 
@@ -194,38 +271,44 @@ class ScheduledCharging(SystemCalcDelegate):
 
 		now = self._get_time()
 		today = now.date()
-
-		for w in self.charge_windows(today):
-			if now in w:
-				if w.soc_reached(self.soc):
-					self.forcecharge = False
-				elif self.hysteresis and w.soc_reached(self.soc + 5):
-					# If we are within 5%, keep it the same, but write it to
-					# avoid a timeout.
-					self.forcecharge = self.forcecharge
-				else:
-					# SoC not reached yet
-					# Note: soc_reached always returns False for a target of
-					# 100%, so this is the only branch that is ever excuted
-					# in those cases.
-					self.forcecharge = True
-
-				# Signal that scheduled charging is active
-				self.active = True
-				self._dbusservice['/Control/ScheduledSoc'] = w.soc
-
-				# If we are force-charging, that means in hub4control the mode
-				# is set to either MaxoutSetpoint or SetpointIsMaxFeedIn. When
-				# it is set to SetpointIsMaxFeedIn, the discharge limit affects
-				# the maximum feed-in, and setting this to too low a value (at
-				# 100%) will break feeding in of excess PV. Therefore avoid
-				# setting a discharge limit if we're currently charging, in
-				# other words, if we're below the target soc, or if the target
-				# soc is 100%.
-				if self.forcecharge:
-					self.maxdischargepower = -1
-					break # from the for loop, skip the else clause below.
-
+		index = self._window_index(today)
+		w = index.find(now)
+
+		# Run again when a window starts or stops, or at midnight to rebuild
+		# the index.
+		boundary = index.next_boundary(now)
+		midnight = datetime.combine(today + timedelta(days=1), time.min)
+		self._wake_at(midnight if boundary is None else min(boundary, midnight))
+
+		if w is not None:
+			if w.soc_reached(self.soc):
+				self.forcecharge = False
+			elif self.hysteresis and w.soc_reached(self.soc + 5):
+				# If we are within 5%, keep it the same, but write it to
+				# avoid a timeout.
+				self.forcecharge = self.forcecharge
+			else:
+				# SoC not reached yet
+				# Note: soc_reached always returns False for a target of
+				# 100%, so this is the only branch that is ever excuted
+				# in those cases.
+				self.forcecharge = True
+
+			# Signal that scheduled charging is active
+			self.active = True
+			self._dbusservice['/Control/ScheduledSoc'] = w.soc
+
+			# If we are force-charging, that means in hub4control the mode
+			# is set to either MaxoutSetpoint or SetpointIsMaxFeedIn. When
+			# it is set to SetpointIsMaxFeedIn, the discharge limit affects
+			# the maximum feed-in, and setting this to too low a value (at
+			# 100%) will break feeding in of excess PV. Therefore avoid
+			# setting a discharge limit if we're currently charging, in
+			# other words, if we're below the target soc, or if the target
+			# soc is 100%.
+			if self.forcecharge:
+				self.maxdischargepower = -1
+			else:
 				# If we are here, it means the battery has reached the target
 				# soc, and the target was less than 100%. If the SOC is close
 				# to the target, we want to keep it there by limiting the
@@ -245,7 +328,6 @@ class ScheduledCharging(SystemCalcDelegate):
 				else:
 					scale = 0.8 + min(delta, 1)*0.15
 					self.maxdischargepower = max(1, round(self.pvpower*scale))
-				break
 		else:
 			self.forcecharge = False
 			self.maxdischargepower = -1
@@ -254,7 +336,7 @@ class ScheduledCharging(SystemCalcDelegate):
 
 		self._dbusservice['/Control/ScheduledCharge'] = int(self.active)
 		self.hysteresis = True
-		return True
+		return self.active
 
 	@property
 	def soc(self):
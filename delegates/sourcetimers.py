@@ -4,10 +4,12 @@ from gi.repository import GLib
 # Victron packages
 from ve_utils import exit_on_error
 from delegates.base import SystemCalcDelegate
+from persist import PersistentStore
 
 class SourceTimers(SystemCalcDelegate):
 	""" Watches the active input, and based on settings determines how much
-	    time was spent on Grid/Generator/Inverter or Off. """
+	    time was spent on Grid/Generator/Inverter or Off. The timers are
+	    kept in a PersistentStore so that they survive a restart. """
 	_paths = {
 		1: '/Timers/TimeOnGrid',
 		2: '/Timers/TimeOnGenerator',
@@ -22,12 +24,14 @@ class SourceTimers(SystemCalcDelegate):
 		super(SourceTimers, self).__init__()
 		self._timer = None
 		self._lastrun = None
+		self._store = None
 
 	def set_sources(self, dbusmonitor, settings, dbusservice):
 		super(SourceTimers, self).set_sources(dbusmonitor, settings, dbusservice)
-		for p in set(self._paths.values()):
-			self._dbusservice.add_path(p, value=0)
-		self._dbusservice.add_path('/Timers/TimeOff', value=0)
+		paths = sorted(set(self._paths.values())) + ['/Timers/TimeOff']
+		self._store = PersistentStore('sourcetimers', [(p, 1) for p in paths])
+		for p in paths:
+			self._dbusservice.add_path(p, value=int(self._store[p][0]))
 		self._on_timer()
 		self._timer = GLib.timeout_add(10000, exit_on_error, self._on_timer)
 
@@ -53,4 +57,5 @@ class SourceTimers(SystemCalcDelegate):
 			path = self._paths.get(active_in, '/Timers/TimeOnInverter')
 
 		self._dbusservice[path] += self.elapsed
+		self._store[path][0] = self._dbusservice[path]
 		return True
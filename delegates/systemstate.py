@@ -78,6 +78,10 @@ class SystemState(SystemCalcDelegate):
 			('/SystemState/UserDischargeLimited', {'gettext': '%s'}),
 		]
 
+	def get_upstream(self):
+		return ['/VebusService', '/Dc/Battery/Power', '/Control/ScheduledCharge',
+			'/ActiveBmsService']
+
 	def bms_state(self, vebus):
 		""" Get the BMS state from the Multi. First check the /Bms/ paths. That
 		    handles the case for a VE.Bus BMS or a 2-signal BMS.  then read the BOL
@@ -204,6 +208,6 @@ class SystemState(SystemCalcDelegate):
 
 		return (ss, flags)
 
-	def update_values(self, newvalues):
+	def on_paths_changed(self, newvalues, changed):
 		newvalues['/SystemState/State'], flags = self.state(newvalues)
 		newvalues.update({'/SystemState/' + k: v for k, v in flags.items()})
@@ -6,8 +6,28 @@ from itertools import islice
 # Victron packages
 from ve_utils import exit_on_error
 
+from sc_utils import memoize
 from delegates.base import SystemCalcDelegate
 
+class VebusAssistants(object):
+	""" Parses the list of assistants of a vebus service. The parsed set
+	    is cached until /Devices/0/Assistants changes. """
+	def __init__(self, monitor, service):
+		self.monitor = monitor
+		self.service = service
+
+	@memoize('/Devices/0/Assistants')
+	def ids(self):
+		# Note that /Devices/0/Assistants provides a list of bytes which can be empty. It can also be invalid
+		# (empty list of ints). An empty list of bytes is not interpreted as an invalid value. This allows
+		# us to distinguish between an empty list and an invalid value.
+		value = self.monitor.get_value(self.service, '/Devices/0/Assistants')
+		if value is None:
+			return None
+		return frozenset(i[0] | i[1] * 256 for i in zip(
+			islice(value, 0, None, 2),
+			islice(value, 1, None, 2)))
+
 class VebusSocWriter(SystemCalcDelegate):
 	# Note that there are 2 categories of hub2 assistants: v1xx/v2xx firmware and v3xx/v4xx firmware.
 	# Both versions have problems with writing the SoC (the assistants themselves adjust the SoC from time
@@ -22,6 +42,7 @@ class VebusSocWriter(SystemCalcDelegate):
 
 	def __init__(self):
 		SystemCalcDelegate.__init__(self)
+		self._assistants = {}
 		GLib.idle_add(exit_on_error, lambda: not self._write_vebus_soc())
 		GLib.timeout_add(10000, exit_on_error, self._write_vebus_soc)
 
@@ -39,6 +60,9 @@ class VebusSocWriter(SystemCalcDelegate):
 		SystemCalcDelegate.set_sources(self, dbusmonitor, settings, dbusservice)
 		self._dbusservice.add_path('/Control/VebusSoc', value=0)
 
+	def device_removed(self, service, instance):
+		self._assistants.pop(service, None)
+
 	def update_values(self, newvalues):
 		vebus_service = newvalues.get('/VebusService')
 		current_written = 0
@@ -90,17 +114,16 @@ class VebusSocWriter(SystemCalcDelegate):
 			return True
 		# Writing SoC to the vebus service is not allowed when a hub-2 assistant is present, so we have to
 		# check the list of assistant IDs.
-		# Note that /Devices/0/Assistants provides a list of bytes which can be empty. It can also be invalid
-		# (empty list of ints). An empty list of bytes is not interpreted as an invalid value. This allows
-		# us to distinguish between an empty list and an invalid value.
-		value = self._dbusmonitor.get_value(vebus_service, '/Devices/0/Assistants')
-		if value is None:
+		try:
+			assistants = self._assistants[vebus_service]
+		except KeyError:
+			assistants = self._assistants[vebus_service] = \
+				VebusAssistants(self._dbusmonitor, vebus_service)
+		ids = assistants.ids
+		if ids is None:
 			# List of assistants is not yet available, so we don't know which assistants are present. Return
 			# False just in case a hub-2 assistant is in use.
 			return False
-		ids = set(i[0] | i[1] * 256 for i in zip(
-			islice(value, 0, None, 2),
-			islice(value, 1, None, 2)))
-		if len(set(ids).intersection(VebusSocWriter._hub2_assistant_ids)) > 0:
+		if ids.intersection(VebusSocWriter._hub2_assistant_ids):
 			return False
 		return True
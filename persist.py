@@ -0,0 +1,139 @@
+import logging
+import os
+import struct
+import weakref
+import zlib
+from gi.repository import GLib
+
+# Victron packages
+from ve_utils import exit_on_error
+
+logger = logging.getLogger(__name__)
+
+# magic, version, reserved, layout crc, data crc
+HEADER = struct.Struct('<4sHHII')
+MAGIC = b'SCPS'
+VERSION = 1
+
+class PersistentStore(object):
+	""" A fixed layout of named arrays of doubles, kept in memory, so that
+	    storing values costs no system calls. Every CHECKPOINT_INTERVAL a
+	    copy is written to RUNTIME_DIR, which is on tmpfs, so the values
+	    survive a restart of the service. Every sync_interval a copy is
+	    also written to FLASH_DIR, which is used if the tmpfs copy is gone
+	    after a reboot. With sync_interval None nothing goes to flash, for
+	    data that is not worth the wear. sync_all writes all copies, and is
+	    called on shutdown.
+
+	    A copy starts with a header holding a version, a crc of the layout
+	    and a crc of the data, and is only used if both match. If there is
+	    no usable copy, the values start out as zero and restored is False.
+
+	    layout is a sequence of (name, count). With RUNTIME_DIR and
+	    FLASH_DIR set to None nothing is saved, which is what the unit tests
+	    do. """
+	RUNTIME_DIR = '/run/dbus-systemcalc-py'
+	FLASH_DIR = '/data/var/lib/dbus-systemcalc-py'
+	CHECKPOINT_INTERVAL = 10000 # 10 seconds
+	SYNC_INTERVAL = 900000 # 15 minutes
+
+	_stores = weakref.WeakSet()
+
+	def __init__(self, name, layout, sync_interval=SYNC_INTERVAL):
+		self.name = name + '.bin'
+		self.restored = False
+		self._sync_interval = sync_interval
+		self._fields = {}
+
+		offset = HEADER.size
+		for field, count in layout:
+			self._fields[field] = (offset, count)
+			offset += 8 * count
+		self._size = offset
+		self._layout = zlib.crc32(repr(tuple(layout)).encode('utf-8'))
+
+		self._buf = bytearray(self._size)
+		copy = self._read(self.RUNTIME_DIR)
+		if copy is None and sync_interval is not None:
+			copy = self._read(self.FLASH_DIR)
+		if copy is not None:
+			self._buf[:] = copy
+			self.restored = True
+		self._data = memoryview(self._buf)[HEADER.size:]
+		self._views = {field: memoryview(self._buf)[o:o + 8 * c].cast('d')
+			for field, (o, c) in self._fields.items()}
+
+		PersistentStore._stores.add(self)
+		if self.RUNTIME_DIR is not None:
+			GLib.timeout_add(self.CHECKPOINT_INTERVAL, exit_on_error, self._on_checkpoint)
+		if self.FLASH_DIR is not None and sync_interval is not None:
+			GLib.timeout_add(sync_interval, exit_on_error, self._on_sync)
+
+	def __getitem__(self, field):
+		""" Returns the memoryview of doubles for field. """
+		return self._views[field]
+
+	@classmethod
+	def sync_all(klass):
+		for store in list(klass._stores):
+			store.sync()
+
+	def _valid(self, buf):
+		if len(buf) != self._size:
+			return False
+		magic, version, _, layout, crc = HEADER.unpack_from(buf)
+		return (magic, version, layout) == (MAGIC, VERSION, self._layout) and \
+			crc == zlib.crc32(memoryview(buf)[HEADER.size:])
+
+	def _read(self, directory):
+		if directory is None:
+			return None
+		path = os.path.join(directory, self.name)
+		try:
+			with open(path, 'rb') as f:
+				buf = f.read()
+		except FileNotFoundError:
+			return None
+		except OSError:
+			logger.exception("Cannot read %s", path)
+			return None
+		if self._valid(buf):
+			return buf
+		logger.warning("Discarding invalid %s", path)
+		return None
+
+	def _write(self, directory, durable):
+		HEADER.pack_into(self._buf, 0, MAGIC, VERSION, 0, self._layout,
+			zlib.crc32(self._data))
+		path = os.path.join(directory, self.name)
+		tmp = path + '.tmp'
+		try:
+			os.makedirs(directory, exist_ok=True)
+			with open(tmp, 'wb') as f:
+				f.write(self._buf)
+				if durable:
+					f.flush()
+					os.fsync(f.fileno())
+			os.replace(tmp, path)
+		except OSError:
+			logger.exception("Cannot save %s", path)
+
+	def checkpoint(self):
+		""" Writes a copy of the data to tmpfs. """
+		if self.RUNTIME_DIR is not None:
+			self._write(self.RUNTIME_DIR, False)
+
+	def sync(self):
+		""" Writes a copy of the data to tmpfs, and to flash unless
+		    sync_interval is None. """
+		self.checkpoint()
+		if self.FLASH_DIR is not None and self._sync_interval is not None:
+			self._write(self.FLASH_DIR, True)
+
+	def _on_checkpoint(self):
+		self.checkpoint()
+		return True
+
+	def _on_sync(self):
+		self.sync()
+		return True
@@ -0,0 +1,220 @@
+from collections import deque
+from functools import partial
+from time import monotonic, time
+import dbus.service
+from gi.repository import GLib
+from ve_utils import exit_on_error
+from vedbus import wrap_dbus_value
+from sc_utils import same
+
+MAX_TOMBSTONES = 256 # Removed paths whose removal is still kept
+
+class Versions(object):
+	""" Keeps the sequence number and the monotonic time of the last
+	    change of each key. The sequence number counts all changes, starting
+	    after seq. """
+	def __init__(self, seq=0):
+		self.start = self.seq = seq
+		self._versions = {}
+
+	def __len__(self):
+		return len(self._versions)
+
+	def touch(self, key):
+		""" Records a change of key, returns its sequence number. """
+		self.seq += 1
+		self._versions[key] = (self.seq, monotonic())
+		return self.seq
+
+	def get(self, key):
+		""" Returns (seq, time) of the last change of key, or None if it
+		    did not change yet. """
+		return self._versions.get(key)
+
+	def items(self):
+		return self._versions.items()
+
+	def since(self, seq):
+		""" Returns the keys that changed after seq. """
+		return [k for k, (s, _) in self._versions.items() if s > seq]
+
+	def discard(self, keys):
+		for k in keys:
+			self._versions.pop(k, None)
+
+class ChangesObject(dbus.service.Object):
+	""" Lets a poller fetch only what changed since it last asked, instead
+	    of calling GetItems and comparing. """
+	def __init__(self, bus, service):
+		super(ChangesObject, self).__init__(bus, '/Changes')
+		self._service = service
+
+	@dbus.service.method('com.victronenergy.Changes', in_signature='t',
+		out_signature='ta{sv}asb')
+	def GetChangesSince(self, seq):
+		""" Returns (head, values, removed, complete), see
+		    TrackedService.changes_since. """
+		head, values, removed, complete = self._service.changes_since(int(seq))
+		return (head, {p: wrap_dbus_value(v) for p, v in values.items()},
+			removed, complete)
+
+	@dbus.service.method('com.victronenergy.Changes', in_signature='',
+		out_signature='da(std)a(sstd)')
+	def GetVersions(self):
+		""" For debugging: returns the monotonic time now, with the
+		    sequence number and time of the last change of each published
+		    path, and of each input path of each service. """
+		return (monotonic(),
+			[(p, s, t) for p, (s, t) in self._service.versions.items()],
+			[(n, p, s, t) for (n, p), (s, t) in self._service.inputs.items()])
+
+class TrackedService(object):
+	""" Wraps the VeDbusService of the system so that the values published
+	    on it can be passed on to other consumers. Paths that changed are
+	    collected, and handed to the listeners together from an idle
+	    callback, so that the listeners see one set of changes per update,
+	    whether the value came from the core or from a delegate timer. A
+	    removed path is passed on as a change to None. Everything else is
+	    passed on to the service.
+
+	    The last change of each path is kept in versions. Sequence numbers
+	    start at the time of start in microseconds, so that they carry on
+	    increasing over a restart, and a poller that synced before gets a
+	    full snapshot. Removed paths are kept as tombstones, so that their
+	    removal can be passed on to pollers, separately from the values so
+	    that it is not mistaken for an invalid value, but only the last
+	    MAX_TOMBSTONES. A
+	    poller that synced before the oldest tombstone that was dropped
+	    gets a full snapshot. The changes of the values they are calculated
+	    from are kept by the caller, in inputs, keyed by (service, path). """
+	def __init__(self, service):
+		self.service = service
+		# The last value recorded of each path, starting with the paths the
+		# service was created with
+		self._paths = {p: service[p] for p in getattr(service, '_dbusobjects', ())}
+		self._changes = {}
+		self._listeners = []
+		self._flush_id = None
+		self.versions = Versions(int(time() * 1000000))
+		self.inputs = Versions()
+		self._tombstones = deque() # (seq, path) of removed paths
+		self._horizon = self.versions.start # Older deltas are incomplete
+
+		# Only a real service has a bus to export the method on
+		self._object = None if self.bus is None else ChangesObject(self.bus, self)
+
+	def __getattr__(self, name):
+		return getattr(self.service, name)
+
+	def __getitem__(self, path):
+		return self.service[path]
+
+	def __contains__(self, path):
+		return path in self.service
+
+	def __enter__(self):
+		self.service.__enter__()
+		return self
+
+	def __exit__(self, *exc):
+		return self.service.__exit__(*exc)
+
+	def add_path(self, path, value=None, description="", writeable=False,
+			onchangecallback=None, *args, **kwargs):
+		# Writes from D-Bus clients go to the service directly, have it
+		# tell us about the ones it accepts.
+		if writeable:
+			onchangecallback = partial(self._on_write, onchangecallback)
+		r = self.service.add_path(path, value, description, writeable,
+			onchangecallback, *args, **kwargs)
+		self._paths[path] = value
+		self._changed(path, value)
+		return r
+
+	def _on_write(self, callback, path, value):
+		if callback is not None and not callback(path, value):
+			return False
+		self._paths[path] = value
+		self._changed(path, value)
+		return True
+
+	def __setitem__(self, path, value):
+		# Compare to what was recorded, writes by clients included, so that
+		# no lookup on the service is needed. Compare the types too, so that
+		# 1.0 replaces 1, as the service would.
+		if not same(self._paths[path], value):
+			self.service[path] = value
+			self._paths[path] = value
+			self._changed(path, value)
+
+	def __delitem__(self, path):
+		del self.service[path]
+		del self._paths[path]
+		self._changed(path, None)
+		self._tombstones.append((self.versions.seq, path))
+		if len(self._tombstones) > MAX_TOMBSTONES:
+			seq, path = self._tombstones.popleft()
+			if path not in self._paths and self.versions.get(path)[0] == seq:
+				self.versions.discard((path,))
+			self._horizon = seq
+
+	@property
+	def bus(self):
+		""" The connection of the service, or None if it has none, as in
+		    the unit tests. """
+		return getattr(self.service, '_dbusconn', None)
+
+	@property
+	def seq(self):
+		return self.versions.seq
+
+	@property
+	def paths(self):
+		return self._paths.keys()
+
+	def snapshot(self):
+		""" Returns a dict with the values of all paths. """
+		return {path: self.service[path] for path in self._paths}
+
+	def add_listener(self, listener):
+		""" listener is called with a dict of the paths that changed and
+		    their new values. """
+		self._listeners.append(listener)
+
+	def changes_since(self, seq):
+		""" Returns (head, values, removed, complete), with head the
+		    sequence number of the last change. If seq is from this run,
+		    values holds the paths that changed since, removed lists the
+		    paths that were removed since, and complete is False. Otherwise
+		    values holds all paths, removed is empty and complete is True. A
+		    value of None is an invalid value, never a removal. """
+		versions = self.versions
+		if not self._horizon <= seq <= versions.seq:
+			return versions.seq, self.snapshot(), [], True
+		values = {}
+		removed = []
+		for p in versions.since(seq):
+			if p in self._paths:
+				values[p] = self.service[p]
+			else:
+				removed.append(p)
+		return versions.seq, values, removed, False
+
+	def _changed(self, path, value):
+		self.versions.touch(path)
+		if not self._listeners:
+			return
+		self._changes[path] = value
+		if self._flush_id is None:
+			self._flush_id = GLib.idle_add(exit_on_error, self._on_idle)
+
+	def _on_idle(self):
+		self._flush_id = None
+		self.flush()
+		return False
+
+	def flush(self):
+		changes, self._changes = self._changes, {}
+		if changes:
+			for listener in self._listeners:
+				listener(changes)
@@ -1,4 +1,7 @@
-from functools import update_wrapper
+import json
+from array import array
+from collections import deque
+from functools import partial, update_wrapper
 from collections import Mapping
 
 VictronServicePrefix = 'com.victronenergy'
@@ -76,6 +79,75 @@ class reify(object):
 		setattr(inst, self.wrapped.__name__, val)
 		return val
 
+class memoize(object):
+	""" Decorator for properties derived from dbus paths. The value is
+	    cached until the monitor reports a change of one of the named
+	    paths through track_value, so a cached value costs no lookups. The
+	    instance must have monitor and service attributes. """
+	def __init__(self, *paths):
+		self.paths = paths
+
+	def __call__(self, wrapped):
+		self.wrapped = wrapped
+		self.slot = '_memoized_' + wrapped.__name__
+		update_wrapper(self, wrapped)
+		return self
+
+	def _invalidate(self, inst, *args):
+		inst.__dict__.pop(self.slot, None)
+
+	def __get__(self, inst, objtype=None):
+		if inst is None:
+			return self
+		try:
+			return inst.__dict__[self.slot]
+		except KeyError:
+			pass
+		tracked = inst.__dict__.setdefault('_memoize_tracked', set())
+		if self.slot not in tracked:
+			tracked.add(self.slot)
+			for p in self.paths:
+				inst.monitor.track_value(inst.service, p,
+					partial(self._invalidate, inst))
+		v = inst.__dict__[self.slot] = self.wrapped(inst)
+		return v
+
+def same(a, b):
+	""" Returns True if a and b hold equal content of the same types, so
+	    that unlike with ==, 1, 1.0 and True are all different. """
+	if type(a) is not type(b):
+		return False
+	if isinstance(a, dict):
+		return a.keys() == b.keys() and all(same(v, b[k]) for k, v in a.items())
+	if isinstance(a, (list, tuple)):
+		return len(a) == len(b) and all(map(same, a, b))
+	return a == b
+
+class ContentCache(object):
+	""" Sets values on a D-Bus service only when their content changed.
+	    The value last published is kept per path, and a value with the
+	    same content is neither serialised nor set. Values must not be
+	    modified once they are passed in. """
+	def __init__(self, dbusservice):
+		self._dbusservice = dbusservice
+		self._published = {}
+
+	def _changed(self, path, value):
+		if path in self._published and same(self._published[path], value):
+			return False
+		self._published[path] = value
+		return True
+
+	def set(self, path, value):
+		if self._changed(path, value):
+			self._dbusservice[path] = value
+
+	def set_json(self, path, value):
+		""" Publish value as JSON, with sorted keys so that equal content
+		    always gives the same string. """
+		if self._changed(path, value):
+			self._dbusservice[path] = json.dumps(value, sort_keys=True)
+
 class smart_dict(dict):
 	# Dictionary that can be accessed via attributes.
 	def __getattr__(self, k):
@@ -88,3 +160,189 @@ class smart_dict(dict):
 			raise AttributeError(k)
 	def __setattr__(self, k, v):
 		self[k] = v
+
+class RingBuffer(object):
+	""" A fixed capacity buffer of floats. Once full, appending a value
+	    overwrites the oldest one. """
+	def __init__(self, capacity):
+		self._buf = array('d', [0.0]) * capacity
+		self._start = 0
+		self._len = 0
+
+	@property
+	def capacity(self):
+		return len(self._buf)
+
+	@property
+	def full(self):
+		return self._len == len(self._buf)
+
+	def append(self, v):
+		""" Appends v, returns the value it pushed out, or None. """
+		capacity = len(self._buf)
+		if self._len < capacity:
+			self._buf[(self._start + self._len) % capacity] = v
+			self._len += 1
+			return None
+		old = self._buf[self._start]
+		self._buf[self._start] = v
+		self._start = (self._start + 1) % capacity
+		return old
+
+	def clear(self):
+		self._start = self._len = 0
+
+	def __len__(self):
+		return self._len
+
+	def __iter__(self):
+		""" Oldest first. """
+		capacity = len(self._buf)
+		for i in range(self._start, self._start + self._len):
+			yield self._buf[i % capacity]
+
+class RollingWindow(object):
+	""" The last capacity values, with their minimum, maximum, mean and
+	    variance. Appending is amortised O(1), whatever the capacity: the
+	    minimum and maximum come from monotonic queues, the mean and
+	    variance are updated for the value that comes in and the one that
+	    drops out. Use this rather than working over a list of recent values
+	    on every update. """
+	def __init__(self, capacity):
+		self._values = RingBuffer(capacity)
+		self._mins = deque() # (index, value), values increasing
+		self._maxs = deque() # (index, value), values decreasing
+		self._count = 0 # index of the next value
+		self._mean = 0.0
+		self._m2 = 0.0
+
+	def append(self, v):
+		old = self._values.append(v)
+		if old is not None:
+			# Take out the value that dropped out first
+			n = len(self._values) - 1
+			if n:
+				d = old - self._mean
+				self._mean -= d / n
+				self._m2 -= d * (old - self._mean)
+			else:
+				self._mean = self._m2 = 0.0
+		n = len(self._values)
+		d = v - self._mean
+		self._mean += d / n
+		self._m2 += d * (v - self._mean)
+
+		i = self._count
+		self._count += 1
+		while self._mins and self._mins[-1][1] >= v:
+			self._mins.pop()
+		self._mins.append((i, v))
+		while self._maxs and self._maxs[-1][1] <= v:
+			self._maxs.pop()
+		self._maxs.append((i, v))
+
+		oldest = self._count - n
+		if self._mins[0][0] < oldest:
+			self._mins.popleft()
+		if self._maxs[0][0] < oldest:
+			self._maxs.popleft()
+
+	def clear(self):
+		self._values.clear()
+		self._mins.clear()
+		self._maxs.clear()
+		self._mean = self._m2 = 0.0
+
+	def __len__(self):
+		return len(self._values)
+
+	def __iter__(self):
+		return iter(self._values)
+
+	@property
+	def full(self):
+		return self._values.full
+
+	@property
+	def min(self):
+		return self._mins[0][1] if self._mins else None
+
+	@property
+	def max(self):
+		return self._maxs[0][1] if self._maxs else None
+
+	@property
+	def mean(self):
+		return self._mean if self._values else None
+
+	@property
+	def variance(self):
+		""" Population variance. """
+		return max(0.0, self._m2 / len(self._values)) if self._values else None
+
+def ewma_step(value, newvalue, alpha):
+	""" One step of an exponentially weighted moving average. NaN means
+	    there is no new value, the average is kept as it is. """
+	if newvalue != newvalue:
+		return value
+	return value + (newvalue - value) * alpha
+
+class Ewma(object):
+	""" An exponentially weighted moving average, or first order low pass
+	    filter, of the values passed to update. """
+	def __init__(self, alpha, value=None):
+		self.alpha = alpha
+		self.value = value
+
+	def update(self, v):
+		self.value = v if self.value is None else ewma_step(self.value, v, self.alpha)
+		return self.value
+
+class LowPassFilterBank(object):
+	""" A set of low pass filters that are stepped together. The states and
+	    omegas are kept in arrays, and filters are referred to by the index
+	    returned from add. Only the filters that received an input are
+	    stepped, in place. """
+	def __init__(self):
+		self._values = array('d')
+		self._omegas = array('d')
+		self._pending = {}
+		self._names = []
+		self._free = []
+
+	def add(self, omega, value, name=None):
+		""" Add a filter, returns its index. """
+		if self._free:
+			i = self._free.pop()
+			self._values[i] = value
+			self._omegas[i] = omega
+			self._names[i] = name
+			return i
+		self._values.append(value)
+		self._omegas.append(omega)
+		self._names.append(name)
+		return len(self._values) - 1
+
+	def remove(self, i):
+		self._omegas[i] = 0
+		self._pending.pop(i, None)
+		self._names[i] = None
+		self._free.append(i)
+
+	def __getitem__(self, i):
+		return self._values[i]
+
+	def set_input(self, i, newvalue):
+		""" Set the value filter i is stepped with on the next update. """
+		self._pending[i] = newvalue
+
+	def update(self):
+		""" Step all filters that received an input since the last update. """
+		values, omegas = self._values, self._omegas
+		for i, v in self._pending.items():
+			values[i] = ewma_step(values[i], v, omegas[i])
+		self._pending.clear()
+
+	def values(self):
+		""" Return the values of all named filters. """
+		return {n: v for n, v in zip(self._names, self._values) if n is not None}
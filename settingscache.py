@@ -0,0 +1,50 @@
+from gi.repository import GLib
+from ve_utils import exit_on_error
+
+class WriteBehindSettings(object):
+	""" Wraps a SettingsDevice so that writes to localsettings are held back
+	    and done together from an idle callback. Every write is a D-Bus call
+	    and a flash write in localsettings, and the delegates often change
+	    several settings, or the same setting more than once, in one tick.
+	    Writes of the value a setting already has are dropped. Reads return
+	    the pending value if there is one. Everything else is passed on to
+	    the SettingsDevice. """
+	def __init__(self, device):
+		self.device = device
+		self._pending = {}
+		self._flush_id = None
+
+	def __getattr__(self, name):
+		return getattr(self.device, name)
+
+	def __getitem__(self, setting):
+		try:
+			return self._pending[setting]
+		except KeyError:
+			return self.device[setting]
+
+	def __setitem__(self, setting, value):
+		if value == self.device[setting]:
+			self._pending.pop(setting, None)
+			return
+		self._pending[setting] = value
+		if self._flush_id is None:
+			self._flush_id = GLib.idle_add(exit_on_error, self._on_idle)
+
+	def _on_idle(self):
+		self._flush_id = None
+		self._write()
+		return False
+
+	def _write(self):
+		pending, self._pending = self._pending, {}
+		for setting, value in pending.items():
+			if value != self.device[setting]:
+				self.device[setting] = value
+
+	def flush(self):
+		""" Write out the pending settings now rather than when idle. """
+		if self._flush_id is not None:
+			GLib.source_remove(self._flush_id)
+			self._flush_id = None
+		self._write()
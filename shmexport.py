@@ -0,0 +1,196 @@
+""" Export of the values of com.victronenergy.system to a memory mapped
+    file, so that local consumers can read them without D-Bus round trips.
+    The reader needs only this module and the standard library.
+
+    Layout, all little endian:
+
+    header     magic 'SCVT', version u16, stale u8, reserved u8,
+               generation u64, count u32, directory size u32
+    directory  count times: path length u16, utf-8 path, padded to 8 bytes
+    tags       count times u8, padded to 8 bytes. TAG_NONE, TAG_FLOAT,
+               TAG_INT, or TAG_OTHER for values that are not numbers
+    values     count times 8 bytes, a float64 for TAG_FLOAT, an int64 for
+               TAG_INT, NaN otherwise
+
+    The generation is odd while the writer updates values. A reader copies
+    the tags and values when it is even, and tries again if it changed in
+    the meantime. A writer that died halfway leaves it odd, so a reader
+    gives up after a timeout. When paths are added or removed, a new file replaces the
+    old one, and stale is set in the old one so that readers open the new
+    one. """
+import mmap
+import os
+import struct
+from time import monotonic, sleep
+
+HEADER = struct.Struct('<4sHBBQII')
+MAGIC = b'SCVT'
+VERSION = 1
+
+TAG_NONE = 0
+TAG_FLOAT = 1
+TAG_INT = 2
+TAG_OTHER = 3
+
+DEFAULT_PATH = '/run/dbus-systemcalc-py/values'
+
+SPINS = 100 # tries before the reader starts sleeping between tries
+RETRY_SLEEP = 0.001 # seconds
+TIMEOUT = 1.0 # seconds
+
+_float = struct.Struct('<d')
+_int = struct.Struct('<q')
+_generation = struct.Struct('<Q')
+_GENERATION = 8 # offset of the generation in the header
+_STALE = 6 # offset of the stale flag
+NaN = float('nan')
+
+def _align(n):
+	return (n + 7) & ~7
+
+def _encode(value):
+	if value is None:
+		return TAG_NONE, _float.pack(NaN)
+	if isinstance(value, int) and -2**63 <= value < 2**63:
+		return TAG_INT, _int.pack(value)
+	if isinstance(value, float):
+		return TAG_FLOAT, _float.pack(value)
+	return TAG_OTHER, _float.pack(NaN)
+
+def _offsets(count, dirsize):
+	tags = HEADER.size + _align(dirsize)
+	return tags, tags + _align(count)
+
+class ShmExport(object):
+	""" Keeps the file up to date. Pass it to TrackedService.add_listener,
+	    service is that TrackedService. """
+	def __init__(self, service, path=DEFAULT_PATH):
+		self.path = path
+		self._service = service
+		self._buf = None
+		self._index = {}
+		self._create()
+
+	def _create(self):
+		paths = sorted(self._service.paths)
+		directory = bytearray()
+		for p in paths:
+			b = p.encode('utf-8')
+			directory += struct.pack('<H', len(b)) + b
+		tags, values = _offsets(len(paths), len(directory))
+
+		data = bytearray(values + 8 * len(paths))
+		HEADER.pack_into(data, 0, MAGIC, VERSION, 0, 0, 0, len(paths), len(directory))
+		data[HEADER.size:HEADER.size + len(directory)] = directory
+		snapshot = self._service.snapshot()
+		for i, p in enumerate(paths):
+			data[tags + i], data[values + 8 * i:values + 8 * i + 8] = _encode(snapshot[p])
+
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		tmp = self.path + '.tmp'
+		with open(tmp, 'w+b') as f:
+			f.write(data)
+			f.flush()
+			buf = mmap.mmap(f.fileno(), len(data))
+		os.replace(tmp, self.path)
+
+		if self._buf is not None:
+			self._buf[_STALE] = 1
+			self._buf.close()
+		self._buf = buf
+		self._tags = tags
+		self._values = values
+		self._index = {p: i for i, p in enumerate(paths)}
+
+	def __call__(self, changes):
+		index = self._index
+		if any(p not in index or p not in self._service for p in changes):
+			# A path was added or removed
+			self._create()
+			return
+
+		buf = self._buf
+		generation = _generation.unpack_from(buf, _GENERATION)[0]
+		_generation.pack_into(buf, _GENERATION, generation + 1)
+		for p, value in changes.items():
+			i = index[p]
+			o = self._values + 8 * i
+			buf[self._tags + i], buf[o:o + 8] = _encode(value)
+		_generation.pack_into(buf, _GENERATION, generation + 2)
+
+class ShmReader(object):
+	""" Reads consistent snapshots of the exported values. Values that
+	    are not numbers read as None. If no consistent copy can be made
+	    within timeout seconds, the file is opened again, in case the
+	    writer was restarted, and if that does not help either, reading
+	    raises TimeoutError. """
+	def __init__(self, path=DEFAULT_PATH, timeout=TIMEOUT):
+		self.path = path
+		self.timeout = timeout
+		self._buf = None
+		self._open()
+
+	def _open(self):
+		with open(self.path, 'rb') as f:
+			buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, _, _, _, count, dirsize = HEADER.unpack_from(buf)
+		if (magic, version) != (MAGIC, VERSION):
+			raise ValueError("{} is not a value table".format(self.path))
+
+		paths = []
+		o = HEADER.size
+		for i in range(count):
+			n, = struct.unpack_from('<H', buf, o)
+			paths.append(buf[o + 2:o + 2 + n].decode('utf-8'))
+			o += 2 + n
+
+		if self._buf is not None:
+			self._buf.close()
+		self._buf = buf
+		self.paths = paths
+		self._tags, self._values = _offsets(count, dirsize)
+		self._count = count
+
+	def _copy(self):
+		""" Returns (tags, values) copied under the seqlock. """
+		tries = 0
+		deadline = None
+		reopened = False
+		while True:
+			if self._buf[_STALE]:
+				self._open()
+			buf = self._buf
+			generation = _generation.unpack_from(buf, _GENERATION)[0]
+			if not generation & 1: # not being written
+				tags = buf[self._tags:self._tags + self._count]
+				values = buf[self._values:self._values + 8 * self._count]
+				if _generation.unpack_from(buf, _GENERATION)[0] == generation:
+					return tags, values
+
+			# Spin for a short update, then back off
+			tries += 1
+			if tries < SPINS:
+				continue
+			now = monotonic()
+			if deadline is None:
+				deadline = now + self.timeout
+			elif now >= deadline:
+				if reopened:
+					raise TimeoutError("No consistent copy of {}".format(self.path))
+				self._open()
+				reopened = True
+				deadline = now + self.timeout
+			sleep(RETRY_SLEEP)
+
+	def snapshot(self):
+		""" Returns a dict of path: value. """
+		tags, values = self._copy()
+		floats = struct.unpack('<{}d'.format(self._count), values)
+		ints = struct.unpack('<{}q'.format(self._count), values)
+		return {p: (floats[i] if tags[i] == TAG_FLOAT else
+			ints[i] if tags[i] == TAG_INT else None)
+			for i, p in enumerate(self.paths)}
+
+	def close(self):
+		self._buf.close()
+		self._buf = None
@@ -0,0 +1,238 @@
+""" Streams the values of com.victronenergy.system over a unix domain
+    socket, so that local consumers get the changes pushed to them instead
+    of polling D-Bus.
+
+    Both directions use the same framing: a u32 length, big endian,
+    followed by that many bytes of a compact utf-8 JSON object.
+
+    A client subscribes by sending
+
+        {"subscribe": ["/Dc/Battery/", "/Ac/Grid/"], "interval": 1.0}
+
+    Both keys are optional. Without prefixes all paths are sent, and without
+    an interval every update is. The interval is at most MAX_INTERVAL. The server replies with
+
+        {"snapshot": {path: value, ...}}
+
+    holding the current values of the paths that match one of the prefixes,
+    followed by
+
+        {"changes": {path: value, ...}}
+
+    with the values that changed since the previous message, no more often
+    than once per interval. A removed path is sent as a change to null. A
+    client can subscribe again at any time, which starts over with a new
+    snapshot. A client that does not keep up with its messages is
+    disconnected. """
+import json
+import logging
+import os
+import socket
+import struct
+from functools import partial
+from math import ceil
+from time import monotonic
+from gi.repository import GLib
+
+# Victron packages
+from ve_utils import exit_on_error
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct('>I')
+MAX_REQUEST = 4096 # bytes in a request
+MAX_BACKLOG = 1 << 20 # bytes queued for a client before it is dropped
+MAX_INTERVAL = 3600 # seconds
+
+DEFAULT_PATH = '/run/dbus-systemcalc-py/stream'
+
+def encode(message):
+	""" Returns message as a frame. """
+	data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+	return FRAME.pack(len(data)) + data
+
+class FrameDecoder(object):
+	""" Splits the bytes received into messages. """
+	def __init__(self, limit=None):
+		self._buf = bytearray()
+		self._limit = limit
+
+	def feed(self, data):
+		""" Returns a list of the messages completed by data. Raises
+		    ValueError on a message that is too long or not JSON. """
+		self._buf += data
+		messages = []
+		while len(self._buf) >= FRAME.size:
+			n, = FRAME.unpack_from(self._buf)
+			if self._limit is not None and n > self._limit:
+				raise ValueError("Message of {} bytes".format(n))
+			if len(self._buf) < FRAME.size + n:
+				break
+			messages.append(json.loads(self._buf[FRAME.size:FRAME.size + n].decode('utf-8')))
+			del self._buf[:FRAME.size + n]
+		return messages
+
+class StreamClient(object):
+	""" A connection, with its subscription and the changes not sent yet. """
+	def __init__(self, server, sock):
+		self.server = server
+		self.sock = sock
+		self.prefixes = None # Not subscribed
+		self.interval = 0
+		self._decoder = FrameDecoder(MAX_REQUEST)
+		self._pending = {}
+		self._last = None
+		self._timer = None
+		self._out = bytearray()
+		self._out_watch = None
+		self._in_watch = GLib.io_add_watch(sock.fileno(), GLib.PRIORITY_DEFAULT,
+			GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+			partial(exit_on_error, self._on_readable))
+
+	def _on_readable(self, fd, condition):
+		try:
+			data = self.sock.recv(MAX_REQUEST)
+		except BlockingIOError:
+			return True
+		except OSError:
+			data = b''
+		if not data:
+			self.close()
+			return False
+
+		try:
+			for request in self._decoder.feed(data):
+				self.subscribe(request.get('subscribe'), request.get('interval'))
+		except (ValueError, TypeError, AttributeError, OverflowError):
+			logger.warning("Invalid request on stream, disconnecting")
+			self.close()
+			return False
+		return self.sock is not None
+
+	def subscribe(self, prefixes=None, interval=None):
+		""" Starts sending the values of the paths starting with one of
+		    prefixes, at most once per interval seconds. Raises ValueError
+		    if interval is out of range. """
+		interval = float(interval or 0)
+		if not 0 <= interval <= MAX_INTERVAL: # Also false for NaN
+			raise ValueError("Interval of {} seconds".format(interval))
+		self.prefixes = tuple(str(p) for p in (prefixes or ('/',)))
+		self.interval = interval
+		self._pending = {}
+		self._last = self.server._get_time()
+		self._send({'snapshot': {p: v for p, v in self.server.snapshot().items()
+			if p.startswith(self.prefixes)}})
+
+	def changed(self, changes):
+		if self.prefixes is None:
+			return
+		self._pending.update((p, v) for p, v in changes.items()
+			if p.startswith(self.prefixes))
+		if not self._pending or self._timer is not None:
+			return
+
+		delay = self._last + self.interval - self.server._get_time()
+		if delay > 0:
+			self._timer = GLib.timeout_add(int(ceil(delay * 1000)),
+				exit_on_error, self._on_timer)
+		else:
+			self._flush()
+
+	def _on_timer(self):
+		self._timer = None
+		self._flush()
+		return False
+
+	def _flush(self):
+		changes, self._pending = self._pending, {}
+		if changes and self.sock is not None:
+			self._last = self.server._get_time()
+			self._send({'changes': changes})
+
+	def _send(self, message):
+		self._out += encode(message)
+		if len(self._out) > MAX_BACKLOG:
+			logger.warning("Stream client does not keep up, disconnecting")
+			self.close()
+		elif self._out_watch is None:
+			self._write()
+
+	def _write(self):
+		try:
+			del self._out[:self.sock.send(self._out)]
+		except BlockingIOError:
+			pass
+		except OSError:
+			self.close()
+			return
+		if self._out and self._out_watch is None:
+			self._out_watch = GLib.io_add_watch(self.sock.fileno(),
+				GLib.PRIORITY_DEFAULT, GLib.IO_OUT,
+				partial(exit_on_error, self._on_writable))
+
+	def _on_writable(self, fd, condition):
+		self._out_watch = None
+		if self.sock is not None:
+			self._write()
+		return False
+
+	def close(self):
+		if self.sock is None:
+			return
+		for source in (self._in_watch, self._out_watch, self._timer):
+			if source is not None:
+				GLib.source_remove(source)
+		self._in_watch = self._out_watch = self._timer = None
+		self.sock.close()
+		self.sock = None
+		self.server.clients.discard(self)
+
+class StreamServer(object):
+	""" Accepts the clients on a unix domain socket at path. Pass it to
+	    TrackedService.add_listener, service is that TrackedService. """
+
+	# So we can override it in testing
+	_get_time = lambda s: monotonic()
+
+	def __init__(self, service, path=DEFAULT_PATH):
+		self.path = path
+		self.clients = set()
+		self._service = service
+
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		try:
+			os.unlink(path) # Left over from a previous run
+		except FileNotFoundError:
+			pass
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.setblocking(False)
+		self.sock.bind(path)
+		self.sock.listen(8)
+		self._watch = GLib.io_add_watch(self.sock.fileno(), GLib.PRIORITY_DEFAULT,
+			GLib.IO_IN, partial(exit_on_error, self._on_accept))
+
+	def _on_accept(self, fd, condition):
+		try:
+			sock, _ = self.sock.accept()
+		except BlockingIOError:
+			return True
+		sock.setblocking(False)
+		self.clients.add(StreamClient(self, sock))
+		return True
+
+	def snapshot(self):
+		return self._service.snapshot()
+
+	def __call__(self, changes):
+		for client in list(self.clients):
+			client.changed(changes)
+
+	def close(self):
+		for client in list(self.clients):
+			client.close()
+		GLib.source_remove(self._watch)
+		self.sock.close()
+		try:
+			os.unlink(self.path)
+		except FileNotFoundError:
+			pass
@@ -44,7 +44,9 @@ class TestSystemCalcBase(unittest.TestCase):
 		self._monitor.remove_service(service)
 
 	def _set_setting(self, path, value):
-		self._system_calc._settings[self._system_calc._settings.get_short_name(path)] = value
+		# Changes made elsewhere go straight to localsettings
+		settings = self._system_calc._settings
+		settings.device[settings.get_short_name(path)] = value
 
 	def _check_settings(self, values):
 		settings = {k: v[1] for k, v in self._system_calc._settings._settings.items()}
@@ -91,3 +91,36 @@ class TestHubSystem(TestSystemCalcBase):
 		data = self._service._dbusobjects['/Batteries']
 		self.assertTrue(len(data) == 1)
 		self.assertEqual(data[0]['name'], "battery")
+
+	def test_trackers_marked_dirty_on_change(self):
+		mock_load_configured_batteries(BatteryData.instance, [
+			{"name": None, "service": "com.victronenergy.battery/0", "enabled": True},
+		])
+
+		self._update_values(5000)
+		tracker = BatteryData.instance.batteries['com.victronenergy.battery.ttyO1'][0]
+		self.assertFalse(tracker.dirty)
+
+		self._monitor.set_value('com.victronenergy.battery.ttyO1', '/Soc', 16.0)
+		self.assertTrue(tracker.dirty)
+
+		self._update_values(5000)
+		self.assertFalse(tracker.dirty)
+		data = self._service._dbusobjects['/Batteries']
+		self.assertEqual(data[0]['soc'], 16.0)
+
+	def test_unchanged_entries_reused(self):
+		mock_load_configured_batteries(BatteryData.instance, [
+			{"name": None, "service": "com.victronenergy.battery/0", "enabled": True},
+			{"name": None, "service": "com.victronenergy.battery/1", "enabled": True},
+		])
+
+		self._update_values(5000)
+		before = {b['instance']: b for b in self._service._dbusobjects['/Batteries']}
+
+		self._monitor.set_value('com.victronenergy.battery.ttyO1', '/Dc/0/Temperature', 25.1)
+		self._update_values(5000)
+		after = {b['instance']: b for b in self._service._dbusobjects['/Batteries']}
+
+		self.assertEqual(after[0]['temperature'], 25.1)
+		self.assertIs(after[1], before[1])
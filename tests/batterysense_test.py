@@ -957,6 +957,35 @@ class VoltageSenseTest(TestSystemCalcBase):
 				'/Link/VoltageSense': 53.1,
 				'/Link/TemperatureSense': 24.5}})
 
+	def test_link_targets_index(self):
+		self._add_device('com.victronenergy.solarcharger.ttyO1', {
+			'/State': 0,
+			'/Link/NetworkMode': 0,
+			'/Link/VoltageSense': None,
+			'/Link/BatteryCurrent': None,
+			'/Dc/0/Voltage': 12.32,
+			'/Dc/0/Current': 9.7},
+			connection='VE.Direct')
+		self._add_device('com.victronenergy.solarcharger.ttyO2', {
+			'/State': 0,
+			'/Dc/0/Voltage': 12.32,
+			'/Dc/0/Current': 9.7},
+			connection='VE.Direct')
+		bs = BatterySense.instance
+		self.assertEqual(bs._link_targets['/Link/VoltageSense'],
+			{'com.victronenergy.solarcharger.ttyO1'})
+		self.assertEqual(bs._link_targets['/Link/BatteryCurrent'],
+			{'com.victronenergy.solarcharger.ttyO1'})
+		self.assertEqual(bs._link_targets['/Link/TemperatureSense'], set())
+		self.assertEqual(bs._networked, {'com.victronenergy.solarcharger.ttyO1'})
+
+		self._monitor.set_value('com.victronenergy.solarcharger.ttyO1', '/Link/NetworkMode', None)
+		self.assertEqual(bs._networked, set())
+
+		self._remove_device('com.victronenergy.solarcharger.ttyO1')
+		self.assertEqual(bs._link_targets['/Link/VoltageSense'], set())
+		self.assertEqual(bs._link_targets['/Link/BatteryCurrent'], set())
+
 	def test_can_bms_sense_data(self):
 		""" Test that for some BMSes, the shunt information is passed
 		    along as sense data. """
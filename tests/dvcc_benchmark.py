@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+""" Benchmarks for the DVCC charge current allocation. This is not part of
+    the unit tests, run it directly: python3 tests/dvcc_benchmark.py """
+import random
+import timeit
+from itertools import count
+
+# This adapts sys.path to include all relevant packages
+import context
+
+from delegates.dvcc import distribute, water_fill, SolarChargerSubsystem
+
+SIZES = (2, 10, 50, 200)
+
+def distribute_reference(current_values, max_values, increment):
+	""" The original O(n^2) implementation of distribute, kept here to
+	    compare results and running time. """
+	n = cn = len(current_values)
+	new_values = [-1] * n
+	for j in range(0, n):
+		for i, mv, av in zip(count(), max_values, current_values):
+			assert mv >= 0
+			if new_values[i] == mv or new_values[i] == 0:
+				continue
+			nv = av + float(increment) / cn
+
+			if nv >= mv:
+				increment += av - mv
+				cn -= 1
+				new_values[i] = mv
+				break
+			elif nv < 0:
+				increment += av
+				cn -= 1
+				new_values[i] = 0
+				break
+
+			new_values[i] = nv
+		else:
+			break
+		continue
+	return new_values
+
+def balance_pair_reference(charger1, charger2, l1, l2):
+	""" The original pairwise balancing of two chargers. """
+	c1, c2 = charger1.currentlimit, charger2.currentlimit
+	a1 = min(charger1.smoothed_current, c1)
+	a2 = min(charger2.smoothed_current, c2)
+	k = l1 + l2
+
+	try:
+		l1 = round((c2 * a1 - c1 * a2 + k * c1)/(c1 + c2), 1)
+	except ArithmeticError:
+		return l1, l2 # unchanged
+	else:
+		l1 = max(min(l1, c1), 0)
+		return l1, k - l1
+
+def balance_ring_reference(chargers):
+	""" The original ring balancing, each charger is balanced against its
+	    neighbour, the one at the end is paired with the one at the start. """
+	limits = []
+	r = chargers[0].maxchargecurrent
+	for c1, c2 in zip(chargers, chargers[1:]):
+		l, r = balance_pair_reference(c1, c2, r, c2.maxchargecurrent)
+		limits.append(l)
+	l, limits[0] = balance_pair_reference(c2, chargers[0], r, limits[0])
+	limits.append(l)
+	for charger, limit in zip(chargers, limits):
+		charger.maxchargecurrent = limit
+
+def balance_global(chargers):
+	limits = SolarChargerSubsystem._balance_chargers(chargers,
+		[c.maxchargecurrent for c in chargers])
+	for charger, limit in zip(chargers, limits):
+		charger.maxchargecurrent = limit
+
+class Charger(object):
+	""" A solar charger that produces what the panels give, up to its
+	    limit. """
+	def __init__(self, currentlimit, maxchargecurrent, available):
+		self.currentlimit = currentlimit
+		self.maxchargecurrent = maxchargecurrent
+		self.available = available
+
+	@property
+	def smoothed_current(self):
+		return min(self.available, self.maxchargecurrent)
+
+def scenario(n, rnd):
+	""" Returns limits, ceilings and an increment for n chargers, with some
+	    of the chargers close to their ceiling so that they get capped. """
+	ceilings = [rnd.choice((15, 35, 50, 70, 85, 100)) for _ in range(n)]
+	limits = [rnd.uniform(0.5, 1) * c for c in ceilings]
+	increment = rnd.uniform(-0.2, 0.4) * sum(limits)
+	return limits, ceilings, increment
+
+def bench_distribute():
+	rnd = random.Random(1)
+	print("distribute: charge current allocation")
+	print("{:>9} {:>14} {:>14} {:>8} {:>10}".format(
+		"chargers", "reference (us)", "sorted (us)", "speedup", "max diff"))
+	for n in SIZES:
+		cases = [scenario(n, rnd) for _ in range(50)]
+		diff = max(max(abs(a - b) for a, b in zip(
+			distribute_reference(*c), distribute(*c))) for c in cases)
+
+		number = max(1, 2000 // n)
+		ref = min(timeit.repeat(lambda: [distribute_reference(*c) for c in cases],
+			number=number, repeat=3)) / number / len(cases) * 1e6
+		new = min(timeit.repeat(lambda: [distribute(*c) for c in cases],
+			number=number, repeat=3)) / number / len(cases) * 1e6
+		print("{:>9} {:>14.1f} {:>14.1f} {:>7.1f}x {:>10.1e}".format(
+			n, ref, new, ref / new, diff))
+
+def converge(balance, chargers, limit=1000):
+	""" Returns the number of control cycles it takes until all limits are
+	    within 0.5A of the balanced solution, or None if that does not happen
+	    within limit cycles. """
+	sizes = [c.currentlimit for c in chargers]
+	balanced = water_fill([c.available for c in chargers], sizes, sizes,
+		sum(c.maxchargecurrent for c in chargers))
+	for cycle in range(1, limit + 1):
+		balance(chargers)
+		if max(abs(b - c.maxchargecurrent) for b, c in zip(balanced, chargers)) <= 0.5:
+			return cycle
+	return None
+
+def chargers(n, rnd):
+	""" All the headroom starts out on the first charger. """
+	sizes = [rnd.choice((15, 35, 50, 70, 85, 100)) for _ in range(n)]
+	available = [rnd.uniform(0.3, 0.7) * c for c in sizes]
+	limits = list(available)
+	limits[0] = sizes[0]
+	return [Charger(c, l, a) for c, l, a in zip(sizes, limits, available)]
+
+def bench_balance():
+	rnd = random.Random(2)
+	print("")
+	print("Headroom balancing: control cycles (of ADJUST seconds) to converge")
+	print("{:>9} {:>10} {:>10}".format("chargers", "ring", "global"))
+	for n in SIZES:
+		seed = rnd.random()
+		ring = converge(balance_ring_reference, chargers(n, random.Random(seed)))
+		glob = converge(balance_global, chargers(n, random.Random(seed)))
+		print("{:>9} {:>10} {:>10}".format(n,
+			'>1000' if ring is None else ring, glob))
+
+if __name__ == "__main__":
+	bench_distribute()
+	bench_balance()
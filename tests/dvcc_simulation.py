@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+""" Closed-loop simulation of DVCC against simple models of solar chargers, a
+    Multi and a battery with a BMS. This is not part of the unit tests, run it
+    directly:
+
+        python3 tests/dvcc_simulation.py [scenario ...]
+
+    Time runs accelerated on the mock timer manager. For every scenario it
+    reports how long the battery current takes to settle after each event,
+    how far it overshoots the BMS charge current limit, and how many D-Bus
+    writes DVCC does per minute. """
+import sys
+from collections import defaultdict
+from math import sin, pi
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# Testing tools
+from mock_gobject import timer_manager
+
+# our own packages
+from base import MockSystemCalc
+
+# Monkey patching for unit tests
+import patches
+
+from sc_utils import service_base_name
+
+# Battery model: open circuit voltage and internal resistance of a 48V bank
+BATTERY_OCV = 52.0
+BATTERY_RESISTANCE = 0.02
+
+# Charger output follows its set-point with this time constant, in seconds
+CHARGER_TAU = 2.0
+
+# Battery current within this many amps of the target counts as settled
+SETTLE_BAND = 1.0
+
+class SolarChargerModel(object):
+	""" A solar charger that produces what the panels give, limited by
+	    /Link/ChargeCurrent and /Link/ChargeVoltage. """
+	def __init__(self, service, size, panel):
+		self.service = service
+		self.size = size
+		self.panel = panel # fraction of size the array gives at full sun
+		self.current = 0.0
+
+	def values(self):
+		return {
+			'/State': 3,
+			'/Link/NetworkMode': 0,
+			'/Link/ChargeVoltage': None,
+			'/Link/ChargeCurrent': None,
+			'/Link/VoltageSense': None,
+			'/Settings/ChargeCurrentLimit': self.size,
+			'/Dc/0/Voltage': BATTERY_OCV,
+			'/Dc/0/Current': 0.0,
+			'/FirmwareVersion': 0x0129}
+
+	def available(self, irradiance):
+		return self.size * self.panel * irradiance
+
+	def step(self, monitor, irradiance, voltage_headroom):
+		target = self.available(irradiance)
+		limit = monitor.get_value(self.service, '/Link/ChargeCurrent')
+		if limit is not None:
+			target = min(target, limit)
+		target = max(0.0, min(target, self.size, voltage_headroom))
+		self.current += (target - self.current) / CHARGER_TAU
+		return self.current
+
+class MultiModel(object):
+	""" A Multi that inverts AC loads from the battery, or passes them through
+	    from the grid and charges at its BOL charge current limit. """
+	def __init__(self, service, charger_size):
+		self.service = service
+		self.charger_size = charger_size
+		self.current = 0.0
+
+	def values(self):
+		return {
+			'/Ac/ActiveIn/L1/P': 0,
+			'/Ac/ActiveIn/ActiveInput': 0,
+			'/Ac/ActiveIn/Connected': 0,
+			'/Ac/Out/L1/P': 0,
+			'/Dc/0/Voltage': BATTERY_OCV,
+			'/Dc/0/Current': 0.0,
+			'/DeviceInstance': 0,
+			'/Devices/0/Assistants': [0] * 28,
+			'/Dc/0/MaxChargeCurrent': None,
+			'/Soc': 50,
+			'/State': 3,
+			'/Mode': 3,
+			'/BatteryOperationalLimits/MaxChargeVoltage': None,
+			'/BatteryOperationalLimits/MaxChargeCurrent': None,
+			'/BatteryOperationalLimits/MaxDischargeCurrent': None,
+			'/BatteryOperationalLimits/BatteryLowVoltage': None,
+			'/BatterySense/Voltage': None,
+			'/Bms/AllowToCharge': 1,
+			'/Bms/AllowToDischarge': 1,
+			'/FirmwareFeatures/BolFrame': 1,
+			'/FirmwareFeatures/BolUBatAndTBatSense': 1,
+			'/FirmwareVersion': 0x456}
+
+	def step(self, monitor, load, grid, voltage):
+		if grid:
+			limit = monitor.get_value(self.service, '/BatteryOperationalLimits/MaxChargeCurrent')
+			target = min(self.charger_size, self.charger_size if limit is None else limit)
+		else:
+			target = -load / voltage
+		self.current += (target - self.current) / CHARGER_TAU
+		monitor.set_value(self.service, '/Ac/ActiveIn/Connected', int(grid))
+		monitor.set_value(self.service, '/Ac/Out/L1/P', load)
+		return self.current
+
+class Scenario(object):
+	""" Describes the inputs to the plant over time. Subclasses override the
+	    profile methods, events lists the times at which inputs step. """
+	duration = 600
+	events = (0,)
+	chargers = ((100, 0.8), (70, 0.8), (35, 0.8), (15, 0.8))
+	multi_charger = 70
+
+	def irradiance(self, t):
+		return 1.0
+
+	def load(self, t):
+		return 1000.0
+
+	def grid(self, t):
+		return False
+
+	def ccl(self, t):
+		return 100.0
+
+	def cvl(self, t):
+		return 56.8
+
+class CclStep(Scenario):
+	""" The BMS drops its charge current limit to 20A, and to 0 briefly. """
+	events = (0, 120, 300, 330, 450)
+
+	def ccl(self, t):
+		if 120 <= t < 300:
+			return 20.0
+		if 300 <= t < 330:
+			return 0.0
+		if 330 <= t < 450:
+			return 40.0
+		return 100.0
+
+class Clouds(Scenario):
+	""" Passing clouds under a charge current limit the array can exceed. """
+	events = (0, 100, 160, 220, 280, 340)
+
+	def irradiance(self, t):
+		if 100 <= t < 160 or 220 <= t < 280:
+			return 0.3
+		return 1.0
+
+	def ccl(self, t):
+		return 60.0
+
+class LoadStep(Scenario):
+	""" Large AC loads switch on and off while charging at the limit. """
+	events = (0, 120, 240, 360)
+
+	def load(self, t):
+		return 4000.0 if (120 <= t < 240 or 360 <= t < 480) else 500.0
+
+	def ccl(self, t):
+		return 50.0
+
+class GridCharge(Scenario):
+	""" Grid connected, the Multi charges alongside the solar chargers. The
+	    irradiance rises and falls slowly. """
+	events = (0, 200)
+
+	def irradiance(self, t):
+		return max(0.0, sin(pi * t / self.duration))
+
+	def grid(self, t):
+		return t >= 200
+
+	def ccl(self, t):
+		return 80.0
+
+SCENARIOS = {
+	'cclstep': CclStep,
+	'clouds': Clouds,
+	'loadstep': LoadStep,
+	'gridcharge': GridCharge,
+}
+
+class Simulation(object):
+	battery = 'com.victronenergy.battery.ttyO2'
+	vebus = 'com.victronenergy.vebus.ttyO1'
+
+	def __init__(self, scenario):
+		self.scenario = scenario
+		timer_manager.reset()
+		self.systemcalc = MockSystemCalc()
+		self.monitor = self.systemcalc._dbusmonitor
+		self.writes = defaultdict(int)
+
+		# Count every write DVCC does to other services
+		set_value_async = self.monitor.set_value_async
+		def counting_set_value_async(service, path, value, *args, **kwargs):
+			self.writes[(service_base_name(service), path)] += 1
+			return set_value_async(service, path, value, *args, **kwargs)
+		self.monitor.set_value_async = counting_set_value_async
+
+		self._add_device('com.victronenergy.settings', {
+			'/Settings/SystemSetup/AcInput1': 1,
+			'/Settings/SystemSetup/AcInput2': 2})
+		self._set_setting('/Settings/Services/Bol', 1)
+
+		self.multi = MultiModel(self.vebus, scenario.multi_charger)
+		self._add_device(self.vebus, self.multi.values(), product_name='Multi')
+
+		self.chargers = []
+		for i, (size, panel) in enumerate(scenario.chargers):
+			c = SolarChargerModel('com.victronenergy.solarcharger.ttyS{}'.format(i), size, panel)
+			self._add_device(c.service, c.values(), connection='VE.Direct')
+			self.chargers.append(c)
+
+		self._add_device(self.battery, {
+			'/Dc/0/Voltage': BATTERY_OCV,
+			'/Dc/0/Current': 0.0,
+			'/Dc/0/Power': 0.0,
+			'/Soc': 50,
+			'/DeviceInstance': 2,
+			'/Info/BatteryLowVoltage': 44,
+			'/Info/MaxChargeCurrent': scenario.ccl(0),
+			'/Info/MaxChargeVoltage': scenario.cvl(0),
+			'/Info/MaxDischargeCurrent': 200}, product_name='battery')
+
+	def _add_device(self, service, values, product_name='dummy', connection='dummy'):
+		values['/Connected'] = 1
+		values['/ProductName'] = product_name
+		values['/Mgmt/Connection'] = connection
+		values.setdefault('/DeviceInstance', 0)
+		self.monitor.add_service(service, values)
+
+	def _set_setting(self, path, value):
+		settings = self.systemcalc._settings
+		settings.device[settings.get_short_name(path)] = value
+
+	def _target(self, t, load):
+		""" The battery current the system should settle at. """
+		s = self.scenario
+		solar = sum(c.available(s.irradiance(t)) for c in self.chargers)
+		if s.grid(t):
+			available = solar + self.multi.charger_size
+		else:
+			available = solar - load / BATTERY_OCV
+		return min(s.ccl(t), available)
+
+	def run(self):
+		s = self.scenario
+		voltage = BATTERY_OCV
+		trace = []
+		for t in range(s.duration):
+			ccl, cvl, load = s.ccl(t), s.cvl(t), s.load(t)
+			self.monitor.set_value(self.battery, '/Info/MaxChargeCurrent', ccl)
+			self.monitor.set_value(self.battery, '/Info/MaxChargeVoltage', cvl)
+
+			# Chargers back off when the battery reaches the charge voltage
+			headroom = (cvl - voltage) / BATTERY_RESISTANCE
+			solar = sum(c.step(self.monitor, s.irradiance(t), headroom) for c in self.chargers)
+			multi = self.multi.step(self.monitor, load, s.grid(t), voltage)
+			current = solar + multi
+			voltage = BATTERY_OCV + current * BATTERY_RESISTANCE
+
+			for c in self.chargers:
+				self.monitor.set_value(c.service, '/Dc/0/Current', c.current)
+				self.monitor.set_value(c.service, '/Dc/0/Voltage', voltage)
+			self.monitor.set_value(self.vebus, '/Dc/0/Current', multi)
+			self.monitor.set_value(self.vebus, '/Dc/0/Voltage', voltage)
+			self.monitor.set_value(self.battery, '/Dc/0/Current', current)
+			self.monitor.set_value(self.battery, '/Dc/0/Voltage', voltage)
+			self.monitor.set_value(self.battery, '/Dc/0/Power', current * voltage)
+
+			trace.append((t, current, ccl, self._target(t, load)))
+			timer_manager.run(1000)
+		return trace
+
+def settling_times(trace, events, duration):
+	""" For each event, the time until the battery current stays within
+	    SETTLE_BAND of its target until the next event, None if it never
+	    does. """
+	result = []
+	bounds = list(events) + [duration]
+	for start, end in zip(bounds, bounds[1:]):
+		settled = None
+		for t, current, ccl, target in trace[start:end]:
+			if abs(current - target) <= SETTLE_BAND:
+				if settled is None:
+					settled = t - start
+			else:
+				settled = None
+		result.append(settled)
+	return result
+
+def report(name, scenario, trace, writes):
+	overshoot = [max(0.0, current - ccl) for t, current, ccl, target in trace]
+	minutes = scenario.duration / 60.0
+	print("{}: {}".format(name, scenario.__doc__.strip()))
+	print("  settling time (s) per event: {}".format(', '.join(
+		'{}@{}'.format('never' if s is None else s, e)
+		for e, s in zip(scenario.events, settling_times(trace, scenario.events, scenario.duration)))))
+	print("  overshoot above CCL: max {:.1f} A, {:.0f} As total, {} s above".format(
+		max(overshoot), sum(overshoot), sum(1 for o in overshoot if o > 0)))
+	print("  D-Bus writes per minute: {:.1f}".format(sum(writes.values()) / minutes))
+	for (service, path), count in sorted(writes.items()):
+		print("    {:<35} {:<45} {:.1f}".format(service, path, count / minutes))
+
+def main(names):
+	for name in names or sorted(SCENARIOS):
+		scenario = SCENARIOS[name]()
+		simulation = Simulation(scenario)
+		trace = simulation.run()
+		report(name, scenario, trace, simulation.writes)
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
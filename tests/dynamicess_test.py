@@ -1,3 +1,4 @@
+import json
 from datetime import datetime, date, time, timedelta
 
 # This adapts sys.path to include all relevant packages
@@ -121,7 +122,7 @@ class TestDynamicEss(TestSystemCalcBase):
 			'com.victronenergy.hub4': {
 				'/Overrides/ForceCharge': 0,
 				'/Overrides/Setpoint': -32000,
-				'/Overrides/MaxDischargePower': 501, # 5% of 10kWh over 1 hour
+				'/Overrides/MaxDischargePower': 500, # 5% of 10kWh over 1 hour
 				'/Overrides/FeedInExcess': 2
 		}})
 
@@ -135,6 +136,56 @@ class TestDynamicEss(TestSystemCalcBase):
 				'/Overrides/FeedInExcess': 0
 		}})
 
+	def test_packed_schedule(self):
+		now = timer_manager.datetime
+		stamp = int(now.timestamp())
+
+		# A day of quarter-hour slots, alternately buying and selling
+		slots = [[stamp - 5 + 900 * i, 900, 60 if i % 2 == 0 else 40, 0]
+			for i in range(96)]
+
+		self._set_setting('/Settings/DynamicEss/Mode', 1)
+		self._set_setting('/Settings/DynamicEss/Schedule/Packed', json.dumps(slots))
+
+		timer_manager.run(5000)
+		self._check_values({
+			'/DynamicEss/Active': 1,
+			'/DynamicEss/TargetSoc': 60})
+		self._check_external_values({
+			'com.victronenergy.hub4': {
+				'/Overrides/ForceCharge': 1,
+				'/Overrides/FeedInExcess': 1
+		}})
+
+		timer_manager.run(900000)
+		self._check_values({
+			'/DynamicEss/Active': 1,
+			'/DynamicEss/TargetSoc': 40})
+		self._check_external_values({
+			'com.victronenergy.hub4': {
+				'/Overrides/ForceCharge': 0,
+				'/Overrides/MaxChargePower': -1
+		}})
+
+	def test_packed_schedule_invalid_slots(self):
+		stamp = int(timer_manager.datetime.timestamp())
+		slots = [
+			[stamp - 5, 900, 'x', 0],
+			[stamp - 5, 900, 60, 0, 1],
+			[stamp - 5, -900, 60, 0],
+			[stamp - 5, 900, 160, 0],
+			[1e300, 900, 60, 0],
+			None,
+			[stamp - 5, 900, 40, 0]]
+
+		self._set_setting('/Settings/DynamicEss/Mode', 1)
+		self._set_setting('/Settings/DynamicEss/Schedule/Packed', json.dumps(slots))
+
+		timer_manager.run(5000)
+		self._check_values({
+			'/DynamicEss/Active': 1,
+			'/DynamicEss/TargetSoc': 40})
+
 	def test_stop_on_soc(self):
 		self._add_device('com.victronenergy.solarcharger.ttyO1', {
 			'/State': 252,
@@ -159,7 +210,7 @@ class TestDynamicEss(TestSystemCalcBase):
 			'com.victronenergy.hub4': {
 				'/Overrides/ForceCharge': 0,
 				'/Overrides/Setpoint': -32000,
-				'/Overrides/MaxDischargePower': 1001, # 5% of 10kWh over 1 hour, including 500W from PV
+				'/Overrides/MaxDischargePower': 1000, # 5% of 10kWh over 1 hour, including 500W from PV
 				'/Overrides/FeedInExcess': 2
 		}})
 
@@ -275,3 +326,36 @@ class TestDynamicEss(TestSystemCalcBase):
 			'/Overrides/MaxDischargePower') == -1.0)
 		self.assertTrue(self._monitor.get_value('com.victronenergy.hub4',
 			'/Overrides/MaxChargePower') > 0.0)
+
+	def test_error_between_slots(self):
+		stamp = int(timer_manager.datetime.timestamp())
+
+		self._set_setting('/Settings/DynamicEss/Mode', 1)
+		self._set_setting('/Settings/DynamicEss/Schedule/0/Start', stamp + 3600)
+		self._set_setting('/Settings/DynamicEss/Schedule/0/Duration', 3600)
+		self._set_setting('/Settings/DynamicEss/Schedule/0/Soc', 60)
+
+		timer_manager.run(5000)
+		self._check_values({
+			'/DynamicEss/Active': 0,
+			'/DynamicEss/ErrorCode': 0})
+
+		# Losing the SOC is reported while waiting for the next slot
+		self._monitor.set_value(self.vebus, '/Soc', None)
+		timer_manager.run(5000)
+		self._check_values({
+			'/DynamicEss/Active': 0,
+			'/DynamicEss/ErrorCode': 4})
+
+		# And cleared again when it comes back
+		self._monitor.set_value(self.vebus, '/Soc', 55.0)
+		timer_manager.run(10000)
+		self._check_values({
+			'/DynamicEss/Active': 0,
+			'/DynamicEss/ErrorCode': 3})
+
+		timer_manager.run(3600000)
+		self._check_values({
+			'/DynamicEss/Active': 1,
+			'/DynamicEss/ErrorCode': 0,
+			'/DynamicEss/TargetSoc': 60})
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import tempfile
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# Testing tools
+from mock_gobject import timer_manager
+
+# our own packages
+from base import TestSystemCalcBase
+from delegates import EnergyCounters
+from persist import PersistentStore
+
+# Monkey patching for unit tests
+import patches
+
+# Time travel patch
+EnergyCounters._get_time = lambda *a: timer_manager.time / 1000.0
+
+class TestEnergyCounters(TestSystemCalcBase):
+	battery = 'com.victronenergy.battery.ttyO2'
+
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+		self._add_device(self.battery,
+			product_name='battery',
+			values={
+				'/Dc/0/Voltage': 50.0,
+				'/Dc/0/Current': 20.0,
+				'/Dc/0/Power': 1000,
+				'/Soc': 50.0,
+				'/DeviceInstance': 2})
+		self._update_values()
+
+	def test_battery_charged_and_discharged(self):
+		self._check_values({
+			'/Energy/Dc/Battery/Charged': 0,
+			'/Energy/Dc/Battery/Discharged': 0})
+
+		# Nothing changes for an hour, the last sample holds
+		timer_manager.run(3600000)
+		self._monitor.set_value(self.battery, '/Dc/0/Power', -2000)
+		self._update_values()
+		self.assertAlmostEqual(self._service['/Energy/Dc/Battery/Charged'], 1.0, places=2)
+
+		timer_manager.run(1800000)
+		self._monitor.set_value(self.battery, '/Dc/0/Power', -1999)
+		self._update_values()
+		self.assertAlmostEqual(self._service['/Energy/Dc/Battery/Charged'], 1.0, places=2)
+		self.assertAlmostEqual(self._service['/Energy/Dc/Battery/Discharged'], 1.0, places=2)
+
+	def test_restart(self):
+		with tempfile.TemporaryDirectory() as d:
+			PersistentStore.RUNTIME_DIR = d
+			try:
+				# Nothing saved yet, starts at zero
+				self.setUp()
+				self._check_values({'/Energy/Dc/Battery/Charged': 0})
+
+				timer_manager.run(3600000)
+				self._monitor.set_value(self.battery, '/Dc/0/Power', 0)
+				self._update_values()
+
+				# Carries on where it was after a restart
+				PersistentStore.sync_all()
+				self.setUp()
+			finally:
+				PersistentStore.RUNTIME_DIR = None
+
+		self.assertAlmostEqual(self._service['/Energy/Dc/Battery/Charged'], 1.0, places=2)
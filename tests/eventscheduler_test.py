@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+from datetime import datetime, time, timedelta
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# Testing tools
+from mock_gobject import timer_manager
+
+# our own packages
+from base import TestSystemCalcBase
+from delegates import EventScheduler
+
+# Monkey patching for unit tests
+import patches
+
+class TestEventScheduler(TestSystemCalcBase):
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+		self.scheduler = EventScheduler.instance
+		self.calls = []
+
+	def callback(self, name):
+		return lambda now: self.calls.append((name, now))
+
+	def test_at(self):
+		start = timer_manager.datetime
+		self.scheduler.at(start + timedelta(seconds=90), self.callback('b'))
+		self.scheduler.at(start + timedelta(seconds=30), self.callback('a'))
+		cancelled = self.scheduler.at(start + timedelta(seconds=60),
+			self.callback('cancelled'))
+		self.scheduler.cancel(cancelled)
+
+		timer_manager.run(29000)
+		self.assertEqual(self.calls, [])
+
+		timer_manager.run(100000)
+		self.assertEqual([name for name, now in self.calls], ['a', 'b'])
+
+		# Called exactly on time
+		self.assertEqual(self.calls[0][1], start + timedelta(seconds=30))
+		self.assertEqual(self.calls[1][1], start + timedelta(seconds=90))
+
+	def test_past_event_runs_immediately(self):
+		self.scheduler.at(datetime(1970, 1, 2), self.callback('past'))
+		timer_manager.run(1)
+		self.assertEqual([name for name, now in self.calls], ['past'])
+
+	def test_every_day(self):
+		start = timer_manager.datetime
+		self.scheduler.every_day(time.min, self.callback('midnight'))
+		timer_manager.run(3 * 86400000)
+
+		midnight = datetime.combine(start.date(), time.min)
+		self.assertEqual([now for name, now in self.calls],
+			[midnight + timedelta(days=d) for d in (1, 2, 3)])
+
+	def test_cancelled_events_removed(self):
+		start = timer_manager.datetime
+		self.scheduler.at(start + timedelta(seconds=10), self.callback('first'))
+		timer = self.scheduler._timer
+
+		# A later event leaves the timer alone
+		events = [self.scheduler.at(start + timedelta(seconds=20 + i),
+			self.callback(i)) for i in range(10)]
+		self.assertEqual(self.scheduler._timer, timer)
+
+		# Cancelled events do not pile up
+		for event in events:
+			self.scheduler.cancel(event)
+		self.assertLessEqual(len(self.scheduler._events), 2)
+
+		timer_manager.run(60000)
+		self.assertEqual([name for name, now in self.calls], ['first'])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import math
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# Testing tools
+from mock_gobject import timer_manager
+
+# our own packages
+from base import TestSystemCalcBase
+from delegates import History
+
+# Monkey patching for unit tests
+import patches
+
+# Time travel patch
+History._get_time = lambda *a: timer_manager.time / 1000.0
+
+class TestHistory(TestSystemCalcBase):
+	battery = 'com.victronenergy.battery.ttyO2'
+
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+		self._add_device(self.battery,
+			product_name='battery',
+			values={
+				'/Dc/0/Voltage': 50.0,
+				'/Dc/0/Current': 2.0,
+				'/Dc/0/Power': 100,
+				'/Soc': 50.0,
+				'/DeviceInstance': 2})
+		self._update_values()
+
+	def test_downsampling(self):
+		timer_manager.run(60000)
+		self._monitor.set_value(self.battery, '/Dc/0/Power', 400)
+		timer_manager.run(60000)
+
+		start, mins, maxs, means = History.instance.get('/Dc/Battery/Power', 60)
+		self.assertEqual(len(means), 1440)
+		# Interval in progress last, one before that is done
+		self.assertEqual(start, (timer_manager.time // 60000 - 1439) * 60)
+		self.assertEqual(mins[-2], 100)
+		self.assertEqual(maxs[-2], 400)
+		self.assertTrue(100 < means[-2] < 400)
+		self.assertEqual(means[-1], 400)
+
+		# Nothing recorded before the start
+		self.assertTrue(math.isnan(means[0]))
+
+		start, mins, maxs, means = History.instance.get('/Dc/Battery/Power', 1)
+		self.assertEqual(len(means), 600)
+		self.assertEqual(means[-1], 400)
+
+	def test_unknown(self):
+		self.assertRaises(KeyError, History.instance.get, '/Dc/Battery/Power', 5)
+		self.assertRaises(KeyError, History.instance.get, '/Foo', 60)
+
+	def test_clock_back(self):
+		from array import array
+		from delegates.history import Series
+
+		series = Series(1, 10, memoryview(array('d', [0]) * Series.size(10)))
+		for t in range(100, 106):
+			series.add(t, t)
+
+		series.add(102, 7)
+		start, mins, maxs, means = series.get(102)
+		self.assertEqual(start, 93)
+		self.assertEqual(means[-3:], [100, 101, 7])
+		# Kept from before the jump, in the slots of 93 to 95
+		self.assertTrue(all(math.isnan(v) for v in means[:3]))
@@ -295,6 +295,106 @@ class TestHubSystem(TestSystemCalcBase):
 			'/Control/EffectiveChargeVoltage': 55.2,
 			'/Control/BmsParameters': 1})
 
+	def test_bms_limit_decrease_is_applied_immediately(self):
+		self._monitor.add_value('com.victronenergy.vebus.ttyO1', '/Hub/ChargeVoltage', 55.2)
+		self._monitor.add_value('com.victronenergy.settings', '/Settings/CGwacs/OvervoltageFeedIn', 0)
+		self._add_device('com.victronenergy.solarcharger.ttyO2', {
+			'/State': 3,
+			'/Link/NetworkMode': 0,
+			'/Link/ChargeVoltage': None,
+			'/Link/ChargeCurrent': None,
+			'/Link/VoltageSense': None,
+			'/Settings/ChargeCurrentLimit': 100,
+			'/Dc/0/Voltage': 58.0,
+			'/Dc/0/Current': 30,
+			'/FirmwareVersion': 0x0129},
+			connection='VE.Direct')
+		self._add_device('com.victronenergy.battery.ttyO2',
+			product_name='battery',
+			values={
+				'/Dc/0/Voltage': 58.1,
+				'/Dc/0/Current': 5.3,
+				'/Dc/0/Power': 65,
+				'/Soc': 15.3,
+				'/DeviceInstance': 2,
+				'/Info/BatteryLowVoltage': 47,
+				'/Info/MaxChargeCurrent': 45,
+				'/Info/MaxChargeVoltage': 58.2,
+				'/Info/MaxDischargeCurrent': 50})
+		self._update_values(interval=60000)
+		self._check_external_values({
+			'com.victronenergy.solarcharger.ttyO2': {
+				'/Link/ChargeCurrent': 45 + 8}})
+
+		# A decrease is applied without waiting for the next tick
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Info/MaxChargeCurrent', 10)
+		self._update_values(interval=10)
+		self._check_external_values({
+			'com.victronenergy.solarcharger.ttyO2': {
+				'/Link/ChargeCurrent': 10 + 8}})
+
+		# An increase waits for the next ADJUST cycle
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Info/MaxChargeCurrent', 45)
+		self._update_values(interval=10)
+		self._check_external_values({
+			'com.victronenergy.solarcharger.ttyO2': {
+				'/Link/ChargeCurrent': 10 + 8}})
+		self._update_values(interval=3000)
+		self._check_external_values({
+			'com.victronenergy.solarcharger.ttyO2': {
+				'/Link/ChargeCurrent': 45 + 8}})
+
+	def test_bms_limit_decreases_are_rate_limited(self):
+		self._monitor.add_value('com.victronenergy.vebus.ttyO1', '/Hub/ChargeVoltage', 55.2)
+		self._monitor.add_value('com.victronenergy.settings', '/Settings/CGwacs/OvervoltageFeedIn', 0)
+		self._add_device('com.victronenergy.solarcharger.ttyO2', {
+			'/State': 3,
+			'/Link/NetworkMode': 0,
+			'/Link/ChargeVoltage': None,
+			'/Link/ChargeCurrent': None,
+			'/Link/VoltageSense': None,
+			'/Settings/ChargeCurrentLimit': 100,
+			'/Dc/0/Voltage': 58.0,
+			'/Dc/0/Current': 30,
+			'/FirmwareVersion': 0x0129},
+			connection='VE.Direct')
+		self._add_device('com.victronenergy.battery.ttyO2',
+			product_name='battery',
+			values={
+				'/Dc/0/Voltage': 58.1,
+				'/Dc/0/Current': 5.3,
+				'/Dc/0/Power': 65,
+				'/Soc': 15.3,
+				'/DeviceInstance': 2,
+				'/Info/BatteryLowVoltage': 47,
+				'/Info/MaxChargeCurrent': 45,
+				'/Info/MaxChargeVoltage': 58.2,
+				'/Info/MaxDischargeCurrent': 50})
+		self._update_values(interval=60000)
+
+		writes = []
+		set_value_async = self._monitor.set_value_async
+		def counting_set_value_async(service, path, value, *args, **kwargs):
+			if path == '/Link/ChargeCurrent':
+				writes.append(value)
+			return set_value_async(service, path, value, *args, **kwargs)
+		self._monitor.set_value_async = counting_set_value_async
+
+		# A BMS that tapers every second. The first decrease is applied
+		# immediately, in place of the next cycle, after that only once
+		# per ADJUST cycle.
+		for i in range(6):
+			self._monitor.set_value('com.victronenergy.battery.ttyO2',
+				'/Info/MaxChargeCurrent', 40 - 5 * i)
+			self._update_values(interval=1000)
+		self.assertEqual(len(writes), 3)
+
+		# Once the limits settle, the last one is applied on the next cycle
+		self._update_values(interval=3000)
+		self._check_external_values({
+			'com.victronenergy.solarcharger.ttyO2': {
+				'/Link/ChargeCurrent': 15 + 8}})
+
 	def test_vedirect_solarcharger_bms_battery_max_charge_current_setting(self):
 		self._monitor.add_value('com.victronenergy.vebus.ttyO1', '/Hub/ChargeVoltage', 55.2)
 		self._monitor.add_value('com.victronenergy.settings', '/Settings/CGwacs/OvervoltageFeedIn', 0)
@@ -435,6 +535,51 @@ class TestHubSystem(TestSystemCalcBase):
 
 		self.assertEqual(sum(c.maxchargecurrent for c in (c1, c2, c3)), 120.0)
 
+	def test_charge_current_balance(self):
+		from delegates.dvcc import SolarChargerSubsystem
+
+		# All the headroom starts out on the first charger
+		sizes = [100, 15, 35, 50, 70, 85, 15, 35, 100, 50]
+		chargers = [Charger(c, c * 0.4, c * 0.4) for c in sizes]
+		chargers[0].maxchargecurrent = 100
+		total = sum(round(c.maxchargecurrent * 10) for c in chargers)
+
+		# One pass spreads it over all of them
+		SolarChargerSubsystem._distribute_current(chargers, total / 10.0)
+		for c in chargers:
+			self.assertAlmostEqual((c.maxchargecurrent - c.smoothed_current) / c.currentlimit,
+				0.108, delta=0.1 / c.currentlimit)
+
+		# In whole steps of 100mA, adding up exactly
+		tenths = [c.maxchargecurrent * 10 for c in chargers]
+		self.assertTrue(all(t == int(t) for t in tenths))
+		self.assertEqual(sum(int(t) for t in tenths), total)
+
+	def test_lowpass_filter_bank(self):
+		from delegates.dvcc import LowPassFilterBank
+
+		bank = LowPassFilterBank()
+		a = bank.add(0.5, 0, 'a')
+		b = bank.add(0.25, 10, 'b')
+
+		# Only filters that received an input are stepped
+		bank.set_input(a, 10)
+		bank.update()
+		self.assertEqual(bank[a], 5)
+		self.assertEqual(bank[b], 10)
+
+		bank.set_input(a, 10)
+		bank.set_input(b, 2)
+		bank.update()
+		self.assertEqual(bank[a], 7.5)
+		self.assertEqual(bank[b], 8)
+
+		# Slots are reused
+		bank.remove(a)
+		c = bank.add(0.1, 1, 'c')
+		self.assertEqual(c, a)
+		self.assertEqual(bank.values(), {'b': 8, 'c': 1})
+
 	def test_charge_current_distribution_2(self):
 		# Check that it works sanely with two chargers
 		from delegates.dvcc import SolarChargerSubsystem
@@ -735,8 +880,9 @@ class TestHubSystem(TestSystemCalcBase):
 		self._check_values({'/Control/VebusSoc': 0})
 
 	def test_multi_class(self):
-		from delegates.dvcc import Multi
-		multi = Multi(self._system_calc._dbusmonitor, self._service)
+		from delegates.dvcc import Multi, LowPassFilterBank
+		multi = Multi(self._system_calc._dbusmonitor, self._service,
+			LowPassFilterBank())
 		self.assertIsNone(multi.bol.chargevoltage)
 		self.assertIsNone(multi.bol.maxchargecurrent)
 
@@ -759,7 +905,7 @@ class TestHubSystem(TestSystemCalcBase):
 
 	def test_multi_nobol(self):
 		from dbus.exceptions import DBusException
-		from delegates.dvcc import Multi
+		from delegates.dvcc import Multi, LowPassFilterBank
 
 		self._remove_device('com.victronenergy.vebus.ttyO1')
 		self._add_device('com.victronenergy.vebus.ttyB1',
@@ -768,12 +914,13 @@ class TestHubSystem(TestSystemCalcBase):
 				'/State': 3,
 			})
 		self._update_values()
-		multi = Multi(self._system_calc._dbusmonitor, self._service)
+		multi = Multi(self._system_calc._dbusmonitor, self._service,
+			LowPassFilterBank())
 		self.assertIsNone(multi.bol.chargevoltage)
 
 
 	def test_solar_subsys(self):
-		from delegates.dvcc import SolarChargerSubsystem
+		from delegates.dvcc import SolarChargerSubsystem, LowPassFilterBank
 		self._add_device('com.victronenergy.solarcharger.ttyO1', {
 			'/State': 0,
 			'/Link/NetworkMode': 0,
@@ -801,7 +948,8 @@ class TestHubSystem(TestSystemCalcBase):
 			'/FirmwareVersion': 0x102ff,
 		}, connection='VE.Can')
 
-		system = SolarChargerSubsystem(self._system_calc._dbusmonitor)
+		system = SolarChargerSubsystem(self._system_calc._dbusmonitor,
+			LowPassFilterBank())
 		system.add_charger('com.victronenergy.solarcharger.ttyO1')
 		system.add_charger('com.victronenergy.solarcharger.ttyO2')
 
@@ -832,7 +980,7 @@ class TestHubSystem(TestSystemCalcBase):
 		self.assertTrue(system.want_bms)
 
 	def test_solar_subsys_distribution(self):
-		from delegates.dvcc import SolarChargerSubsystem
+		from delegates.dvcc import SolarChargerSubsystem, LowPassFilterBank
 		self._add_device('com.victronenergy.battery.socketcan_can0_di0_uc30688', {
 			'/Dc/0/Voltage': 12.6,
 			'/Dc/0/Current': 9.3,
@@ -869,7 +1017,8 @@ class TestHubSystem(TestSystemCalcBase):
 			'/Settings/ChargeCurrentLimit': 15,
 		}, connection='VE.Direct')
 
-		system = SolarChargerSubsystem(self._system_calc._dbusmonitor)
+		system = SolarChargerSubsystem(self._system_calc._dbusmonitor,
+			LowPassFilterBank())
 		system.add_charger('com.victronenergy.solarcharger.ttyO1')
 		system.add_charger('com.victronenergy.solarcharger.ttyO2')
 		system.add_charger('com.victronenergy.solarcharger.ttyO3')
@@ -914,6 +1063,20 @@ class TestHubSystem(TestSystemCalcBase):
 
 		newlimits = distribute([2, 2], [2, 2], 20)
 
+	def test_distribute_above_max(self):
+		from delegates.dvcc import distribute
+
+		# What the first charger loses by going down to its max counts
+		# towards the decrease.
+		self.assertEqual(distribute([11, 1, 1], [9, 5, 5], -6), [7, 0, 0])
+		self.assertEqual(distribute([9, 11], [10, 4], -13), [3, 4])
+
+		# Whatever the order of the values, the total adds up
+		self.assertEqual(distribute([0, 7], [5, 5], -1), [1, 5])
+
+		with self.assertRaises(AssertionError):
+			distribute([1, 2], [-1, 5], 1)
+
 	def test_hub1bridge_distr_1(self):
 		from delegates.dvcc import distribute
 		actual_values = [1, 2, 3]
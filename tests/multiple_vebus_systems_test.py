@@ -172,3 +172,54 @@ class TestMultipleVebusDevices(TestSystemCalcBase):
 			'/Dc/Battery/Power':  60,
 			'/ActiveBatteryService': 'com.victronenergy.vebus/2',
 			'/AutoSelectedBatteryService': 'MultiTTY on dummy'})
+
+	def test_every_system_has_a_subtree(self):
+		self._add_device('com.victronenergy.vebus.ttyO1',
+			product_name='Multi',
+			values={
+				'/Ac/ActiveIn/L1/P': 123,
+				'/Ac/ActiveIn/ActiveInput': 0,
+				'/Ac/ActiveIn/Connected': 1,
+				'/Ac/Out/L1/P': 100,
+				'/Dc/0/Voltage': 12.25,
+				'/Dc/0/Current': -8,
+				'/DeviceInstance': 0,
+				'/Soc': 53.2,
+				'/State': 3,
+			})
+		self._add_device('com.victronenergy.vebus.ttyO2',
+			product_name='Multi2',
+			values={
+				'/Ac/ActiveIn/L1/P': 127,
+				'/Ac/ActiveIn/ActiveInput': 1,
+				'/Ac/Out/L1/P': 87,
+				'/Dc/0/Voltage': 50.0,
+				'/Dc/0/Current': 2,
+				'/DeviceInstance': 1,
+				'/Soc': 60.0,
+				'/State': 3
+			})
+		self._update_values()
+
+		# The system uses the first one
+		self._check_values({
+			'/VebusService': 'com.victronenergy.vebus.ttyO1',
+			'/Dc/Vebus/Power': -98.0,
+			'/Ac/Grid/L1/Power': 123,
+			'/VebusSystems/0/Service': 'com.victronenergy.vebus.ttyO1',
+			'/VebusSystems/0/Dc/Power': -98.0,
+			'/VebusSystems/0/Ac/ActiveIn/Source': 1,
+			'/VebusSystems/0/Ac/ActiveIn/L1/Power': 123,
+			'/VebusSystems/0/Ac/Out/L1/Power': 100,
+			'/VebusSystems/1/Service': 'com.victronenergy.vebus.ttyO2',
+			'/VebusSystems/1/Dc/Voltage': 50.0,
+			'/VebusSystems/1/Dc/Power': 100.0,
+			'/VebusSystems/1/Ac/ActiveIn/Source': 2,
+			'/VebusSystems/1/Ac/ActiveIn/L1/Power': 127,
+			'/VebusSystems/1/Ac/Out/L1/Power': 87,
+		})
+
+		self._remove_device('com.victronenergy.vebus.ttyO2')
+		self._update_values()
+		self.assertFalse('/VebusSystems/1/Service' in self._service)
+		self._check_values({'/VebusSystems/0/Dc/Power': -98.0})
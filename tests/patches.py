@@ -11,3 +11,12 @@ dbus_systemcalc.logger = logging.getLogger()
 # the MAC address of 'eth0' which may not be available.
 dbus_systemcalc.get_vrm_portal_id = lambda: 'aabbccddeeff'
 mock_gobject.patch_gobject(dbus_systemcalc.GLib)
+
+# Run the event scheduler on the mock clock
+from delegates.eventscheduler import EventScheduler
+EventScheduler._get_time = lambda *a: mock_gobject.timer_manager.datetime
+
+# Keep persistent state in memory only
+from persist import PersistentStore
+PersistentStore.RUNTIME_DIR = None
+PersistentStore.FLASH_DIR = None
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# Monkey patching for unit tests
+import patches
+
+from persist import PersistentStore
+
+class TestPersistentStore(unittest.TestCase):
+	layout = [('a', 1), ('b', 3)]
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		PersistentStore.RUNTIME_DIR = os.path.join(self.dir, 'run')
+		PersistentStore.FLASH_DIR = os.path.join(self.dir, 'flash')
+
+	def tearDown(self):
+		PersistentStore.RUNTIME_DIR = None
+		PersistentStore.FLASH_DIR = None
+		shutil.rmtree(self.dir)
+
+	def test_restart(self):
+		store = PersistentStore('test', self.layout)
+		self.assertFalse(store.restored)
+		self.assertEqual(list(store['b']), [0, 0, 0])
+		store['a'][0] = 1.5
+		store['b'][2] = 7
+		store.checkpoint()
+		store['a'][0] = 2.5 # Lost, not in the checkpoint
+
+		# Restart, values are still in tmpfs
+		store = PersistentStore('test', self.layout)
+		self.assertTrue(store.restored)
+		self.assertEqual(store['a'][0], 1.5)
+		self.assertEqual(list(store['b']), [0, 0, 7])
+
+	def test_corrupt_checkpoint(self):
+		store = PersistentStore('test', self.layout)
+		store['a'][0] = 1.5
+		store.sync()
+		store['a'][0] = 2.5
+		store.checkpoint()
+		with open(os.path.join(PersistentStore.RUNTIME_DIR, 'test.bin'), 'r+b') as f:
+			f.seek(20)
+			f.write(b'\xff')
+
+		# Falls back to the copy in flash
+		store = PersistentStore('test', self.layout)
+		self.assertTrue(store.restored)
+		self.assertEqual(store['a'][0], 1.5)
+
+	def test_not_synced(self):
+		store = PersistentStore('test', self.layout, sync_interval=None)
+		store['a'][0] = 1.5
+		store.sync()
+		self.assertFalse(os.path.exists(os.path.join(PersistentStore.FLASH_DIR, 'test.bin')))
+
+		store = PersistentStore('test', self.layout, sync_interval=None)
+		self.assertEqual(store['a'][0], 1.5)
+
+	def test_reboot(self):
+		store = PersistentStore('test', self.layout)
+		store['a'][0] = 1.5
+		store.sync()
+		store['a'][0] = 2.5 # Lost, not synced
+		shutil.rmtree(PersistentStore.RUNTIME_DIR)
+
+		store = PersistentStore('test', self.layout)
+		self.assertTrue(store.restored)
+		self.assertEqual(store['a'][0], 1.5)
+
+	def test_corrupt_copy(self):
+		store = PersistentStore('test', self.layout)
+		store['a'][0] = 1.5
+		store.sync()
+		shutil.rmtree(PersistentStore.RUNTIME_DIR)
+		with open(os.path.join(PersistentStore.FLASH_DIR, 'test.bin'), 'r+b') as f:
+			f.seek(20)
+			f.write(b'\xff')
+
+		store = PersistentStore('test', self.layout)
+		self.assertFalse(store.restored)
+		self.assertEqual(store['a'][0], 0)
+
+	def test_layout_changed(self):
+		store = PersistentStore('test', self.layout)
+		store['a'][0] = 1.5
+		store.sync()
+		store = PersistentStore('test', [('a', 1), ('b', 4)])
+		self.assertFalse(store.restored)
+		self.assertEqual(store['a'][0], 0)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# our own packages
+from base import TestSystemCalcBase
+
+# Monkey patching for unit tests
+import patches
+
+class TestChangesSince(TestSystemCalcBase):
+	battery = 'com.victronenergy.battery.ttyO2'
+
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+		self._add_device(self.battery,
+			product_name='battery',
+			values={
+				'/Dc/0/Voltage': 12.5,
+				'/Dc/0/Current': 8,
+				'/Dc/0/Power': 100,
+				'/Soc': 50.0,
+				'/DeviceInstance': 2})
+		self._update_values()
+
+	def test_changes(self):
+		head, values, removed, complete = self._service.changes_since(0)
+		self.assertTrue(complete)
+		self.assertEqual(values['/Dc/Battery/Soc'], 50.0)
+
+		self._monitor.set_value(self.battery, '/Soc', 51.0)
+		self._update_values()
+		newhead, values, removed, complete = self._service.changes_since(head)
+		self.assertFalse(complete)
+		self.assertEqual(values, {'/Dc/Battery/Soc': 51.0})
+		self.assertEqual(removed, [])
+		self.assertGreater(newhead, head)
+
+		# Nothing changed since
+		self.assertEqual(self._service.changes_since(newhead), (newhead, {}, [], False))
+
+	def test_previous_run(self):
+		# Sequence numbers from before a restart are lower than any now
+		_, values, removed, complete = self._service.changes_since(self._service.versions.start - 1)
+		self.assertTrue(complete)
+		self.assertEqual(values['/Dc/Battery/Power'], 100)
+
+	def test_versions(self):
+		seq, _ = self._service.versions.get('/Dc/Battery/Soc')
+		inputseq = self._service.inputs.seq
+
+		self._monitor.set_value(self.battery, '/Soc', 51.0)
+		self._update_values()
+		self.assertGreater(self._service.versions.get('/Dc/Battery/Soc')[0], seq)
+		self.assertGreater(self._service.inputs.get((self.battery, '/Soc'))[0], inputseq)
+		self.assertEqual(self._service.inputs.since(inputseq), [(self.battery, '/Soc')])
+
+		self._remove_device(self.battery)
+		self.assertEqual(self._service.inputs.get((self.battery, '/Soc')), None)
+
+	def test_tombstones(self):
+		from publisher import MAX_TOMBSTONES
+		head = self._service.seq
+		paths = ['/Test/{}'.format(i) for i in range(MAX_TOMBSTONES + 1)]
+		for p in paths:
+			self._service.add_path(p, value=1)
+		for p in paths:
+			del self._service[p]
+
+		# The oldest removal is forgotten, so an older poller starts over
+		self.assertEqual(self._service.versions.get(paths[0]), None)
+		_, values, removed, complete = self._service.changes_since(head)
+		self.assertTrue(complete)
+		self.assertFalse(paths[0] in values)
+		self.assertEqual(removed, [])
+
+		# A newer one still sees the later removals
+		_, values, removed, complete = self._service.changes_since(self._service.seq - 1)
+		self.assertFalse(complete)
+		self.assertEqual(values, {})
+		self.assertEqual(removed, [paths[-1]])
+
+	def test_client_write(self):
+		changes = []
+		self._service.add_listener(changes.append)
+		accepted = []
+		self._service.add_path('/Test/Writable', value=0, writeable=True,
+			onchangecallback=lambda p, v: accepted.append(v) or v != 2)
+		head = self._service.seq
+
+		# As a D-Bus client would
+		self._service.set_value('/Test/Writable', 1)
+		self.assertEqual(accepted, [1])
+		self.assertEqual(self._service.changes_since(head)[1], {'/Test/Writable': 1})
+
+		# Refused, nothing recorded
+		head = self._service.seq
+		self._service.set_value('/Test/Writable', 2)
+		self.assertEqual(self._service.changes_since(head), (head, {}, [], False))
+
+		self._service.flush()
+		self.assertEqual(changes[-1], {'/Test/Writable': 1})
+
+	def test_invalid_is_not_removed(self):
+		self._service.add_path('/Test/Invalid', value=1)
+		self._service.add_path('/Test/Removed', value=1)
+		head = self._service.seq
+
+		self._service['/Test/Invalid'] = None
+		del self._service['/Test/Removed']
+		_, values, removed, complete = self._service.changes_since(head)
+		self.assertFalse(complete)
+		self.assertEqual(values, {'/Test/Invalid': None})
+		self.assertEqual(removed, ['/Test/Removed'])
+
+	def test_type_change(self):
+		self._service.add_path('/Test/List', value=[1])
+		head = self._service.seq
+
+		# Equal, but not the same on D-Bus
+		self._service['/Test/List'] = [1.0]
+		self.assertEqual(self._service.changes_since(head)[1], {'/Test/List': [1.0]})
+		self.assertTrue(isinstance(self._service['/Test/List'][0], float))
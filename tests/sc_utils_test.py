@@ -44,3 +44,99 @@ class TestScUtils(unittest.TestCase):
 		self.assertEqual(54,
 			self._monitor.get_value('com.victronenergy.vebus.ttyO1',
 			'/BatteryOperationalLimits/MaxChargeVoltage'))
+
+	def test_memoize(self):
+		from sc_utils import memoize
+
+		class Device(object):
+			def __init__(self, monitor, service):
+				self.monitor = monitor
+				self.service = service
+				self.evaluated = 0
+
+			@memoize('/Info/MaxChargeVoltage')
+			def voltage(self):
+				self.evaluated += 1
+				return self.monitor.get_value(self.service, '/Info/MaxChargeVoltage')
+
+		d = Device(self._monitor, 'com.victronenergy.battery.ttyO2')
+		self.assertEqual(d.voltage, 55)
+		self.assertEqual(d.voltage, 55)
+		self.assertEqual(d.evaluated, 1)
+
+		self._monitor.set_value('com.victronenergy.battery.ttyO2', '/Info/MaxChargeVoltage', 54)
+		self.assertEqual(d.voltage, 54)
+		self.assertEqual(d.evaluated, 2)
+
+	def test_rolling_window(self):
+		from sc_utils import RollingWindow
+
+		w = RollingWindow(3)
+		self.assertEqual((w.min, w.max, w.mean, w.variance), (None, None, None, None))
+
+		for v in (2.0, 5.0, 1.0):
+			w.append(v)
+		self.assertTrue(w.full)
+		self.assertEqual((w.min, w.max), (1.0, 5.0))
+		self.assertAlmostEqual(w.mean, 8.0 / 3)
+
+		# 2 drops out
+		w.append(4.0)
+		self.assertEqual(list(w), [5.0, 1.0, 4.0])
+		self.assertEqual((w.min, w.max), (1.0, 5.0))
+		self.assertAlmostEqual(w.mean, 10.0 / 3)
+		self.assertAlmostEqual(w.variance, 26.0 / 9)
+
+		# 5 and 1 drop out
+		w.append(3.0)
+		w.append(3.5)
+		self.assertEqual((w.min, w.max), (3.0, 4.0))
+		self.assertAlmostEqual(w.mean, 3.5)
+
+		w.clear()
+		self.assertEqual(len(w), 0)
+		w.append(7.0)
+		self.assertEqual((w.min, w.max, w.mean, w.variance), (7.0, 7.0, 7.0, 0.0))
+
+	def test_ewma(self):
+		from sc_utils import Ewma
+
+		f = Ewma(0.5)
+		self.assertEqual(f.update(4.0), 4.0)
+		self.assertEqual(f.update(0.0), 2.0)
+		self.assertEqual(f.update(float('nan')), 2.0)
+
+	def test_content_cache(self):
+		from sc_utils import ContentCache
+
+		class Service(dict):
+			writes = 0
+			def __setitem__(self, k, v):
+				self.writes += 1
+				super(Service, self).__setitem__(k, v)
+
+		service = Service()
+		cache = ContentCache(service)
+		cache.set_json('/Json', {'b': 1, 'a': [1, {'y': 2, 'x': 3}]})
+		self.assertEqual(service['/Json'], '{"a": [1, {"x": 3, "y": 2}], "b": 1}')
+
+		# Same content, keys added in another order
+		cache.set_json('/Json', {'a': [1, {'x': 3, 'y': 2}], 'b': 1})
+		self.assertEqual(service.writes, 1)
+
+		cache.set_json('/Json', {'a': [1, {'x': 3, 'y': 2}], 'b': 2})
+		self.assertEqual(service.writes, 2)
+
+		cache.set('/List', [{'name': 'a'}])
+		cache.set('/List', [{'name': 'a'}])
+		self.assertEqual(service.writes, 3)
+		cache.set('/List', None)
+		self.assertEqual(service['/List'], None)
+		self.assertEqual(service.writes, 4)
+
+		# Equal with ==, but published differently
+		cache.set('/List', [1])
+		cache.set('/List', [True])
+		cache.set('/List', [1.0])
+		self.assertEqual(service['/List'], [1.0])
+		self.assertEqual(service.writes, 7)
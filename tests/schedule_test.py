@@ -88,6 +88,35 @@ class TestSchedule(TestSystemCalcBase):
 				'/Overrides/ForceCharge': 0,
 		}})
 
+	def test_scheduled_charge_starts_on_time(self):
+		now = timer_manager.datetime
+		midnight = datetime.combine(now.date(), time.min)
+		stamp = (now-midnight).seconds
+
+		# A window that starts and stops between two 5-second ticks
+		self._set_setting('/Settings/CGwacs/BatteryLife/Schedule/Charge/0/Day', 7)
+		self._set_setting('/Settings/CGwacs/BatteryLife/Schedule/Charge/0/Start', stamp+7)
+		self._set_setting('/Settings/CGwacs/BatteryLife/Schedule/Charge/0/Duration', 4)
+		self._set_setting('/Settings/CGwacs/BatteryLife/Schedule/Charge/0/Soc', 100)
+
+		timer_manager.run(7100)
+		self._check_external_values({
+				'com.victronenergy.hub4': {
+				'/Overrides/ForceCharge': 1,
+		}})
+
+		timer_manager.run(2800)
+		self._check_external_values({
+				'com.victronenergy.hub4': {
+				'/Overrides/ForceCharge': 1,
+		}})
+
+		timer_manager.run(1200)
+		self._check_external_values({
+				'com.victronenergy.hub4': {
+				'/Overrides/ForceCharge': 0,
+		}})
+
 	def test_scheduled_charge_stop_on_soc(self):
 		# Add solar charger
 		self._add_device('com.victronenergy.solarcharger.ttyO1', {
@@ -474,3 +503,21 @@ class TestSchedule(TestSystemCalcBase):
 				'com.victronenergy.hub4': {
 				'/Overrides/ForceCharge': 0,
 		}})
+
+	def test_window_index(self):
+		from delegates.schedule import ScheduledWindow, ScheduledWindowIndex
+		w0 = ScheduledWindow(datetime(2018, 6, 6, 1, 0, 0), 3600)
+		w1 = ScheduledWindow(datetime(2018, 6, 6, 0, 30, 0), 7200)
+		index = ScheduledWindowIndex([w0, w1])
+
+		# Where windows overlap, the first one wins
+		self.assertTrue(index.find(datetime(2018, 6, 6, 0, 29, 59)) is None)
+		self.assertTrue(index.find(datetime(2018, 6, 6, 0, 30, 0)) is w1)
+		self.assertTrue(index.find(datetime(2018, 6, 6, 1, 0, 0)) is w0)
+		self.assertTrue(index.find(datetime(2018, 6, 6, 1, 59, 59)) is w0)
+		self.assertTrue(index.find(datetime(2018, 6, 6, 2, 0, 0)) is w1)
+		self.assertTrue(index.find(datetime(2018, 6, 6, 2, 30, 0)) is None)
+
+		self.assertEqual(index.next_boundary(datetime(2018, 6, 6, 1, 0, 0)),
+			datetime(2018, 6, 6, 2, 0, 0))
+		self.assertTrue(index.next_boundary(datetime(2018, 6, 6, 3, 0, 0)) is None)
@@ -0,0 +1,64 @@
+import unittest
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# Testing tools
+from mock_gobject import timer_manager
+
+# Monkey patching for unit tests
+import patches
+
+from settingscache import WriteBehindSettings
+
+class CountingSettings(dict):
+	""" Stands in for SettingsDevice, counts the writes. """
+	def __init__(self, *args, **kwargs):
+		super(CountingSettings, self).__init__(*args, **kwargs)
+		self.writes = []
+
+	def __setitem__(self, k, v):
+		self.writes.append(k)
+		super(CountingSettings, self).__setitem__(k, v)
+
+	def get_short_name(self, path):
+		return path
+
+class TestWriteBehindSettings(unittest.TestCase):
+	def setUp(self):
+		timer_manager.reset()
+		self.device = CountingSettings(state=2, flags=0, soclimit=10)
+		self.settings = WriteBehindSettings(self.device)
+
+	def test_writes_are_coalesced(self):
+		self.settings['state'] = 3
+		self.settings['state'] = 4
+		self.settings['flags'] |= 1
+		self.settings['soclimit'] = 10 # unchanged
+
+		# Reads see the pending values, nothing is written yet
+		self.assertEqual(self.settings['state'], 4)
+		self.assertEqual(self.settings['flags'], 1)
+		self.assertEqual(self.device.writes, [])
+
+		timer_manager.run(10)
+		self.assertEqual(sorted(self.device.writes), ['flags', 'state'])
+		self.assertEqual(self.device['state'], 4)
+		self.assertEqual(self.device['flags'], 1)
+
+	def test_write_back_to_old_value(self):
+		self.settings['state'] = 3
+		self.settings['state'] = 2
+		timer_manager.run(10)
+		self.assertEqual(self.device.writes, [])
+		self.assertEqual(self.settings['state'], 2)
+
+	def test_flush(self):
+		self.settings['state'] = 5
+		self.settings.flush()
+		self.assertEqual(self.device.writes, ['state'])
+		timer_manager.run(10)
+		self.assertEqual(self.device.writes, ['state'])
+
+	def test_passthrough(self):
+		self.assertEqual(self.settings.get_short_name('/Foo'), '/Foo')
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# our own packages
+from base import TestSystemCalcBase
+from shmexport import ShmReader
+
+# Monkey patching for unit tests
+import patches
+
+class TestShmExport(TestSystemCalcBase):
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'values')
+		self._system_calc.export_values(self.path)
+		self.reader = ShmReader(self.path)
+
+	def tearDown(self):
+		self.reader.close()
+		shutil.rmtree(self.dir)
+
+	def test_values(self):
+		values = self.reader.snapshot()
+		self.assertEqual(values['/Dc/Battery/Power'], None)
+		self.assertEqual(values['/Serial'], None) # Not a number
+
+		self._add_device('com.victronenergy.battery.ttyO2',
+			product_name='battery',
+			values={
+				'/Dc/0/Voltage': 12.5,
+				'/Dc/0/Current': 8,
+				'/Dc/0/Power': 100,
+				'/Soc': 50.0,
+				'/DeviceInstance': 2})
+		self._update_values()
+
+		values = self.reader.snapshot()
+		self.assertEqual(values['/Dc/Battery/Voltage'], 12.5)
+		self.assertEqual(values['/Dc/Battery/Power'], 100)
+		self.assertEqual(values['/Dc/Battery/Soc'], 50.0)
+
+	def test_paths_added(self):
+		self._add_device('com.victronenergy.vebus.ttyO1',
+			product_name='Multi',
+			values={
+				'/Dc/0/Voltage': 12.25,
+				'/Dc/0/Current': 8,
+				'/DeviceInstance': 0,
+				'/State': 3})
+		self._update_values()
+
+		# The reader picks up the new file
+		self.assertEqual(self.reader.snapshot()['/VebusSystems/0/Dc/Voltage'], 12.25)
+
+	def test_writer_died(self):
+		import struct
+		from shmexport import _GENERATION
+
+		# Left halfway through an update
+		with open(self.path, 'r+b') as f:
+			f.seek(_GENERATION)
+			f.write(struct.pack('<Q', 1))
+
+		reader = ShmReader(self.path, timeout=0.01)
+		self.assertRaises(TimeoutError, reader.snapshot)
+		reader.close()
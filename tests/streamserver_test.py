@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import socket
+import tempfile
+
+# This adapts sys.path to include all relevant packages
+import context
+
+# Testing tools
+from mock_gobject import timer_manager
+
+# our own packages
+from base import TestSystemCalcBase
+from streamserver import StreamServer, FrameDecoder, encode
+
+# Monkey patching for unit tests
+import patches
+
+# Time travel patch
+StreamServer._get_time = lambda *a: timer_manager.time / 1000.0
+
+class TestStreamServer(TestSystemCalcBase):
+	battery = 'com.victronenergy.battery.ttyO2'
+
+	def __init__(self, methodName='runTest'):
+		TestSystemCalcBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestSystemCalcBase.setUp(self)
+		self.dir = tempfile.mkdtemp()
+		self.server = self._system_calc.stream_values(os.path.join(self.dir, 'stream'))
+		self._add_device(self.battery,
+			product_name='battery',
+			values={
+				'/Dc/0/Voltage': 12.5,
+				'/Dc/0/Current': 8,
+				'/Dc/0/Power': 100,
+				'/Soc': 50.0,
+				'/DeviceInstance': 2})
+		self._update_values()
+
+	def tearDown(self):
+		self.server.close()
+		shutil.rmtree(self.dir)
+
+	def _connect(self, request):
+		""" Connects and subscribes, as the mainloop would. """
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.connect(self.server.path)
+		self.server._on_accept(None, None)
+		sock.sendall(encode(request))
+		for client in self.server.clients:
+			client._on_readable(None, None)
+		sock.setblocking(False)
+		return sock, FrameDecoder()
+
+	def _receive(self, sock, decoder):
+		try:
+			return decoder.feed(sock.recv(65536))
+		except BlockingIOError:
+			return []
+
+	def test_snapshot_and_changes(self):
+		sock, decoder = self._connect({'subscribe': ['/Dc/Battery/']})
+		messages = self._receive(sock, decoder)
+		self.assertEqual(len(messages), 1)
+		snapshot = messages[0]['snapshot']
+		self.assertEqual(snapshot['/Dc/Battery/Soc'], 50.0)
+		self.assertEqual(snapshot['/Dc/Battery/Power'], 100)
+		self.assertTrue(all(p.startswith('/Dc/Battery/') for p in snapshot))
+
+		self._monitor.set_value(self.battery, '/Soc', 51.0)
+		self._update_values()
+		self.assertEqual(self._receive(sock, decoder),
+			[{'changes': {'/Dc/Battery/Soc': 51.0}}])
+		sock.close()
+
+	def test_interval(self):
+		sock, decoder = self._connect({'subscribe': ['/Dc/Battery/Soc'], 'interval': 5})
+		self._receive(sock, decoder)
+
+		self._monitor.set_value(self.battery, '/Soc', 51.0)
+		self._update_values()
+		self._monitor.set_value(self.battery, '/Soc', 52.0)
+		self._update_values()
+		self.assertEqual(self._receive(sock, decoder), [])
+
+		# Sent together once the interval is over
+		self._update_values(3000)
+		self.assertEqual(self._receive(sock, decoder),
+			[{'changes': {'/Dc/Battery/Soc': 52.0}}])
+		sock.close()
+
+	def test_disconnect(self):
+		sock, decoder = self._connect({})
+		self.assertEqual(len(self.server.clients), 1)
+		sock.close()
+		for client in list(self.server.clients):
+			client._on_readable(None, None)
+		self.assertEqual(len(self.server.clients), 0)
+
+	def test_invalid_interval(self):
+		for interval in ('inf', 'nan', 1e308, -1):
+			sock, decoder = self._connect({'interval': interval})
+			self.assertEqual(len(self.server.clients), 0)
+			sock.close()
@@ -7,6 +7,7 @@ import context
 
 # our own packages
 from base import TestSystemCalcBase
+from delegates import HubTypeSelect
 
 # Monkey patching for unit tests
 import patches
@@ -503,6 +504,30 @@ class TestSystemCalc(TestSystemCalcBase):
 			'/SystemType': 'Hub-1',
 			'/Dc/Pv/Power': 12.4 * (9.7 + 5) + 12.3 * (5.6 + 5)})
 
+	def test_pushed_delegate_skipped(self):
+		hubtype = HubTypeSelect.instance
+		calls = []
+		def on_paths_changed(newvalues, changed):
+			calls.append(changed)
+			HubTypeSelect.on_paths_changed(hubtype, newvalues, changed)
+		hubtype.on_paths_changed = on_paths_changed
+		self._monitor.add_value('com.victronenergy.vebus.ttyO1', '/Hub4/AssistantId', None)
+
+		self._update_values()
+		self.assertEqual(calls, [None]) # Devices were added
+		self._check_values({'/SystemType': None})
+
+		# Not an input, skipped, and the outputs stay
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Dc/0/Voltage', 12.5)
+		self._update_values()
+		self.assertEqual(len(calls), 1)
+		self._check_values({'/Dc/Battery/Voltage': 12.5, '/SystemType': None})
+
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Hub4/AssistantId', 5)
+		self._update_values()
+		self.assertEqual(calls[1], {('com.victronenergy.vebus.ttyO1', '/Hub4/AssistantId')})
+		self._check_values({'/Hub': 4, '/SystemType': 'ESS'})
+
 	def test_hub1_vecan(self):
 		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Mgmt/Connection', "VE.Can")
 		self._add_device('com.victronenergy.solarcharger.ttyO1',
@@ -1439,5 +1464,45 @@ class TestSystemCalc(TestSystemCalcBase):
 			'/Ac/PvOnGrid/L1/Power': 210
 		})
 
+	def test_pv_totals_follow_changes(self):
+		self._monitor.set_value('com.victronenergy.settings', '/Settings/SystemSetup/AcInput1', 1) # Grid
+		self._add_device('com.victronenergy.pvinverter.fronius_122_2314', {
+			'/Ac/L1/Power': 105,
+			'/Ac/L1/Current': 0.5,
+			'/Position': 0 # AC-in 1
+		})
+		self._add_device('com.victronenergy.pvinverter.fronius_122_2315', {
+			'/Ac/L1/Power': 210,
+			'/Position': 0 # AC-in 1
+		})
+		self._update_values()
+		self._check_values({
+			'/Ac/PvOnGrid/L1/Power': 315,
+			'/Ac/PvOnGrid/L1/Current': 0.5,
+			'/Ac/PvOnOutput/L1/Power': None
+		})
+
+		self._monitor.set_value('com.victronenergy.pvinverter.fronius_122_2314', '/Ac/L1/Power', 100)
+		self._update_values()
+		self._check_values({
+			'/Ac/PvOnGrid/L1/Power': 310
+		})
+
+		# Moved to the output
+		self._monitor.set_value('com.victronenergy.pvinverter.fronius_122_2315', '/Position', 1)
+		self._update_values()
+		self._check_values({
+			'/Ac/PvOnGrid/L1/Power': 100,
+			'/Ac/PvOnOutput/L1/Power': 210
+		})
+
+		self._remove_device('com.victronenergy.pvinverter.fronius_122_2314')
+		self._update_values()
+		self._check_values({
+			'/Ac/PvOnGrid/L1/Power': None,
+			'/Ac/PvOnGrid/L1/Current': None,
+			'/Ac/PvOnOutput/L1/Power': 210
+		})
+
 if __name__ == '__main__':
 	unittest.main()